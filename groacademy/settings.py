@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.TracingMiddleware',
+    'main.middleware.AccessLogMiddleware',
+    'main.middleware.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,9 +54,69 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'main.middleware.InvalidationMiddleware',
+    'main.middleware.EntityCacheMiddleware',
 ]
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Per-client token buckets and load shedding, see main.middleware.RateLimitMiddleware.
+RATE_LIMIT = {
+    'ENABLED': True,
+    'CAPACITY': 60,
+    'REFILL_PER_SECOND': 2.0,
+    # Password hashing makes authentication far more expensive than a page view.
+    # A batch is charged the sum of its sub-requests.
+    'ROUTE_COSTS': {'api_login': 10, 'login': 10, 'api_register': 10, 'register': 10},
+    'SEARCH_COST': 4,
+    'SEARCH_ROUTES': ['api_courses', 'api_course_search', 'home', 'api_users', 'api_my_courses', 'my_courses'],
+    # Shed when the 90th percentile of the last 50 requests exceeds 2 s.
+    'LATENCY_THRESHOLD': 2.0,
+    'LATENCY_PERCENTILE': 0.9,
+    'LATENCY_WINDOW': 50,
+    'LATENCY_MIN_SAMPLES': 20,
+    'SHED_SECONDS': 5,
+}
+
+# Structured access log, see main.middleware.AccessLogMiddleware. Failed and
+# slow requests are always logged, other responses are sampled.
+ACCESS_LOG = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.1,
+    'SLOW_MS': 500,
+}
+
+# Request tracing, see main.tracing. The last BUFFER_SIZE traces of each
+# worker are kept in memory and listed by the admin /api/traces endpoint.
+TRACING = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'HEADER': 'X-Trace-Id',
+    'BUFFER_SIZE': 200,
+    'MAX_SPANS': 500,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'main.accesslog.JsonFormatter'},
+    },
+    'handlers': {
+        'access': {
+            'class': 'main.accesslog.BatchingQueueHandler',
+            'formatter': 'json',
+            'filename': os.environ.get('ACCESS_LOG_FILE', str(BASE_DIR / 'var' / 'access.log')),
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 5,
+            'batch_size': 500,
+            'flush_interval': 1.0,
+        },
+    },
+    'loggers': {
+        'main.access': {'handlers': ['access'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'groacademy.urls'
 
 TEMPLATES = [
@@ -80,10 +144,87 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock at BEGIN so concurrent writers queue on the
+            # busy timeout instead of failing when a read lock is upgraded.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
     }
 }
 
 
+# Cache
+# Shared by every worker process on the host through a memory-mapped file.
+# The file must belong to the user running the app (main.mmapcache refuses
+# any other), so it lives in a directory the app owns rather than in /tmp.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'main.mmapcache.MmapCache',
+        'LOCATION': os.environ.get('CACHE_FILE', str(BASE_DIR / 'var' / 'cache.bin')),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'SLOTS': 16384,
+            'SLOT_SIZE': 4096,
+        },
+    }
+}
+
+# Seconds between polls of the cross-worker invalidation bus (None disables
+# polling), and how long published events are kept.
+INVALIDATION_POLL_INTERVAL = 0.05
+INVALIDATION_RETENTION = 3600
+
+# Seconds repository entities stay in the shared cache (main.entity_cache).
+ENTITY_CACHE_TIMEOUT = 60
+
+# Threads per worker that run the independent GETs of an /api/batch call.
+BATCH_MAX_WORKERS = 4
+
+# Video heartbeat buffering (main.activity): seconds between flushes (None
+# flushes on every request), most buffered (user, module) pairs per worker,
+# and the share of a video after which its module counts as completed.
+ACTIVITY_FLUSH_INTERVAL = 2.0
+ACTIVITY_MAX_PENDING = 10000
+ACTIVITY_COMPLETION_RATIO = 0.9
+
+# Seconds between reloads of the certificate revocation list. Certificate ids
+# are signed with CERTIFICATE_SECRET when set, otherwise with SECRET_KEY.
+CERTIFICATE_REVOCATION_REFRESH = 60
+
+# Certificate PDFs rendered by the job queue ahead of their first download.
+CERTIFICATE_DIR = Path(os.environ.get('CERTIFICATE_DIR', BASE_DIR / 'var' / 'certificates'))
+
+# Co-purchase neighbours written by manage.py build_recommendations, and how
+# often workers check the file for a rebuild.
+RECOMMENDATIONS_PATH = Path(os.environ.get('RECOMMENDATIONS_PATH', BASE_DIR / 'var' / 'recommendations.bin'))
+RECOMMENDATIONS_RELOAD_INTERVAL = 5
+
+# TF-IDF index for similar courses and text search (manage.py build_text_index).
+# Each build is a directory of .npy arrays; 'current' points at the newest.
+TEXT_INDEX_PATH = Path(os.environ.get('TEXT_INDEX_PATH', BASE_DIR / 'var' / 'text-index'))
+TEXT_INDEX_RELOAD_INTERVAL = 5
+
+# Most purchased courses replayed through the services by the gunicorn master
+# before forking (manage.py warmup_caches does the same); 0 disables.
+WARMUP_TOP_COURSES = 50
+
+# Catalog delta sync (/api/changes): seconds of recent changes sent again on
+# the next sync in case an older transaction commits late, and seconds
+# deletion tombstones are kept (run_worker prunes older ones; clients with
+# an older cursor must sync from scratch).
+CHANGES_SAFETY_WINDOW = 5
+TOMBSTONE_RETENTION = 90 * 24 * 3600
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -120,6 +261,16 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Optional local storage for uploaded thumbnails, PDFs and videos, served by
+# main.media with Range support. Off by default: those fields are plain URLs
+# to external hosting otherwise. Pillow is needed for thumbnail derivatives.
+MEDIA_LOCAL_STORAGE = os.environ.get('MEDIA_LOCAL_STORAGE', '') == '1'
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = '/media/'
+MEDIA_MAX_UPLOAD_SIZE = 512 * 1024 * 1024
+MEDIA_MAX_IMAGE_PIXELS = 40_000_000
+THUMBNAIL_SIZES = (320, 640)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+wsgi_app = 'groacademy.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Import Django and the app once in the master; workers inherit it on fork.
+preload_app = True
+
+
+def when_ready(server):
+    from main import warmup
+    warmup.preload()
+
+
+def post_fork(server, worker):
+    from main import warmup
+    warmup.connect()
+
+
+def worker_exit(server, worker):
+    from main import activity
+    activity.buffer.shutdown()
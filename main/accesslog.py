@@ -0,0 +1,136 @@
+"""
+Queue-based logging handler for the access log.
+
+emit() only puts the record on a bounded in-memory queue, so a request never
+waits on disk. A background thread drains the queue in batches and writes
+each batch to a size-rotated file with a single write and flush. When the
+queue is full, records are dropped and counted rather than blocking.
+
+Every gunicorn worker writes to the same file in append mode. Before each
+batch the writer reopens the file if another worker has rotated it.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import List, Optional
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, 'access', None)
+        if fields is None:
+            fields = {'message': record.getMessage()}
+        return json.dumps({'time': round(record.created, 3), **fields}, separators=(',', ':'), default=str)
+
+
+class _BatchFile(RotatingFileHandler):
+    def _reopen_if_rotated(self) -> None:
+        try:
+            rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self.stream.close()
+            self.stream = self._open()
+
+    def write_batch(self, records: List[logging.LogRecord]) -> None:
+        lines = ''.join(self.format(r) + self.terminator for r in records)
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            else:
+                self._reopen_if_rotated()
+            size = self.stream.seek(0, os.SEEK_END)
+            if self.maxBytes > 0 and size and size + len(lines) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(lines)
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+class BatchingQueueHandler(logging.Handler):
+    def __init__(self, filename: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5,
+                 batch_size: int = 500, flush_interval: float = 1.0, max_queue: int = 10000):
+        super().__init__()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), mode=0o700, exist_ok=True)
+        self.target = _BatchFile(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.queue: Optional[queue.Queue] = None
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+        self.pid: Optional[int] = None
+        self.start_lock = threading.Lock()
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self) -> None:
+        # A thread started before a fork does not exist in the child, and
+        # its queue may have been copied with a lock held.
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue(self.max_queue)
+            self.thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+            self.thread.start()
+
+    def _drain(self, first: logging.LogRecord) -> List[logging.LogRecord]:
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            batch.append(logging.makeLogRecord({'access': {'dropped': dropped}}))
+        try:
+            self.target.write_batch(batch)
+        except Exception:
+            self.handleError(batch[0])
+
+    def _run(self) -> None:
+        q = self.queue
+        while True:
+            batch = self._drain(q.get())
+            self._write(batch)
+            if len(batch) < self.batch_size:
+                # Let the next batch build up instead of writing every record.
+                time.sleep(self.flush_interval)
+
+    def flush(self) -> None:
+        if self.queue is None or self.pid != os.getpid():
+            return
+        while True:
+            try:
+                first = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self._write(self._drain(first))
+
+    def close(self) -> None:
+        self.flush()
+        self.target.close()
+        super().close()
@@ -0,0 +1,162 @@
+"""
+In-memory ingestion of video heartbeats.
+
+Heartbeats are coalesced per (user, module) in a per-worker buffer: watch
+time is summed and the latest position wins. A background thread hands the
+buffer to ModuleService.record_activity every ACTIVITY_FLUSH_INTERVAL
+seconds, which appends one ModuleActivity row per pair and updates progress.
+
+Memory is bounded by ACTIVITY_MAX_PENDING pairs. A full buffer is flushed
+inline, and when that fails too new heartbeats are refused. A failed flush
+puts its entries back, and shutdown() flushes whatever is left, so every
+accepted heartbeat is written at least once.
+"""
+import atexit
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from main.services import ModuleService
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[int, Any]
+
+
+def _merge(into: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    into['watched_seconds'] += entry['watched_seconds']
+    into['events'] += entry['events']
+    into['started_at'] = min(into['started_at'], entry['started_at'])
+    if entry['ended_at'] >= into['ended_at']:
+        into['position'] = entry['position']
+        into['ended_at'] = entry['ended_at']
+    into['completed'] = into['completed'] or entry['completed']
+
+
+class ActivityBuffer:
+    def __init__(self, flush: Callable[[List[Dict[str, Any]]], None]):
+        self._flush = flush
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending: Dict[Key, Dict[str, Any]] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.pid: Optional[int] = None
+
+    @property
+    def interval(self) -> Optional[float]:
+        return getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 2.0)
+
+    @property
+    def max_pending(self) -> int:
+        return getattr(settings, 'ACTIVITY_MAX_PENDING', 10000)
+
+    def add(self, user_id: int, events: List[Dict[str, Any]]) -> bool:
+        """
+        Buffers the user's heartbeats. Returns False when the buffer is full
+        and cannot be flushed, in which case nothing was accepted.
+        """
+        if len(self.pending) >= self.max_pending:
+            self.flush()
+            if len(self.pending) >= self.max_pending:
+                return False
+
+        now = timezone.now()
+        ratio = getattr(settings, 'ACTIVITY_COMPLETION_RATIO', 0.9)
+        with self.lock:
+            for event in events:
+                duration = event.get('duration')
+                entry = {
+                    'user_id': user_id,
+                    'module_id': event['module_id'],
+                    'position': event['position'],
+                    'watched_seconds': event['watched'],
+                    'events': 1,
+                    'started_at': now,
+                    'ended_at': now,
+                    'completed': event['ended'] or bool(duration and event['position'] >= duration * ratio),
+                }
+                key = (user_id, event['module_id'])
+                if key in self.pending:
+                    _merge(self.pending[key], entry)
+                else:
+                    self.pending[key] = entry
+
+        if self.interval is None:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return True
+
+    def peek(self, user_id: int, module_id: Any) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.pending.get((user_id, module_id))
+            return dict(entry) if entry else None
+
+    def flush(self) -> int:
+        with self.flush_lock:
+            with self.lock:
+                entries, self.pending = self.pending, {}
+            if not entries:
+                return 0
+            try:
+                self._flush(list(entries.values()))
+            except Exception:
+                logger.exception("Activity flush of %d entries failed, keeping them for the next one", len(entries))
+                with self.lock:
+                    for key, entry in self.pending.items():
+                        if key in entries:
+                            _merge(entries[key], entry)
+                        else:
+                            entries[key] = entry
+                    self.pending = entries
+                return 0
+            return len(entries)
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        self.flush()
+
+    def _ensure_thread(self) -> None:
+        # A thread started before a fork does not exist in the child.
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+            self.thread.start()
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+buffer = ActivityBuffer(ModuleService.record_activity)
+atexit.register(buffer.shutdown)
+
+
+def resume(user, module) -> Dict[str, Any]:
+    """
+    The stored progress with this worker's unflushed heartbeats applied.
+    """
+    progress = ModuleService.get_progress(user, module)
+    state = {
+        'last_position': progress.last_position if progress else 0,
+        'watched_seconds': progress.watched_seconds if progress else 0,
+        'is_completed': bool(progress and progress.is_completed),
+    }
+    pending = buffer.peek(user.id, module.id)
+    if pending:
+        state['last_position'] = pending['position']
+        state['watched_seconds'] += pending['watched_seconds']
+    return state
@@ -0,0 +1,161 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+from main import invalidation
+from main.models import CourseEntry
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _keys_for(title: str, instructor: str, topics: Any) -> List[Tuple[str, str]]:
+    """
+    Index keys for one course as (key, field) pairs: the full title and
+    instructor, each of their words, and each topic.
+    """
+    keys = []
+    for field, value in (('title', title or ''), ('instructor', instructor or '')):
+        value = value.strip().lower()
+        if value:
+            keys.append((value, field))
+            keys.extend((w, field) for w in _WORD_RE.findall(value))
+    if isinstance(topics, str):
+        topics = [topics]
+    for t in topics or []:
+        t = str(t).strip().lower()
+        if t:
+            keys.append((t, 'topic'))
+    return list(dict.fromkeys(keys))
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index: every key is stored once per course in a sorted
+    list, so a prefix lookup is a bisect plus a scan over the matching slice.
+    Results for recent prefixes are memoized until the next write.
+    """
+
+    def __init__(self, memo_size: int = 2048):
+        self._lock = threading.RLock()
+        self._entries: List[Tuple[str, str, str]] = []
+        self._courses: Dict[str, Dict[str, Any]] = {}
+        self._memo: 'OrderedDict[Tuple[str, int], List[Dict[str, Any]]]' = OrderedDict()
+        self._memo_size = memo_size
+        self.built = False
+
+    def build(self) -> int:
+        rows = (
+            CourseEntry.objects
+            .values_list('id', 'title', 'instructor', 'topics', 'purchase_count')
+            .iterator(chunk_size=2000)
+        )
+        entries = []
+        courses = {}
+        for cid, title, instructor, topics, popularity in rows:
+            cid = str(cid)
+            keys = _keys_for(title, instructor, topics)
+            courses[cid] = {'title': title, 'instructor': instructor, 'popularity': popularity, 'keys': keys}
+            entries.extend((key, cid, field) for key, field in keys)
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._courses = courses
+            self._memo.clear()
+            self.built = True
+        return len(courses)
+
+    def ensure_built(self) -> None:
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    self.build()
+
+    def upsert(self, course: CourseEntry) -> None:
+        cid = str(course.id)
+        with self._lock:
+            if not self.built:
+                return
+            self._remove_entries(cid)
+            keys = _keys_for(course.title, course.instructor, course.topics)
+            self._courses[cid] = {'title': course.title, 'instructor': course.instructor,
+                                  'popularity': course.purchase_count, 'keys': keys}
+            for key, field in keys:
+                insort(self._entries, (key, cid, field))
+            self._memo.clear()
+
+    def remove(self, course_id: Any) -> None:
+        with self._lock:
+            if self._remove_entries(str(course_id)):
+                self._memo.clear()
+
+    def on_course_changed(self, course_id: str) -> None:
+        if course_id == invalidation.ALL:
+            self.reset()
+            return
+        if not self.built:
+            return
+        course = CourseEntry.objects.filter(id=course_id).first()
+        if course is None:
+            self.remove(course_id)
+        else:
+            self.upsert(course)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries = []
+            self._courses = {}
+            self._memo.clear()
+            self.built = False
+
+    def _remove_entries(self, cid: str) -> bool:
+        course = self._courses.pop(cid, None)
+        if course is None:
+            return False
+        for key, field in course['keys']:
+            i = bisect_left(self._entries, (key, cid, field))
+            if i < len(self._entries) and self._entries[i] == (key, cid, field):
+                del self._entries[i]
+        return True
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self.ensure_built()
+        memo_key = (prefix, limit)
+        with self._lock:
+            cached = self._memo.get(memo_key)
+            if cached is not None:
+                self._memo.move_to_end(memo_key)
+                return cached
+
+            matches: Dict[str, str] = {}
+            i = bisect_left(self._entries, (prefix,))
+            entries = self._entries
+            while i < len(entries) and entries[i][0].startswith(prefix):
+                _, cid, field = entries[i]
+                matches.setdefault(cid, field)
+                i += 1
+
+            courses = self._courses
+            top = heapq.nsmallest(limit, matches, key=lambda cid: (-courses[cid]['popularity'], courses[cid]['title']))
+            result = [{
+                'id': cid,
+                'title': courses[cid]['title'],
+                'instructor': courses[cid]['instructor'],
+                'matched': matches[cid],
+            } for cid in top]
+
+            self._memo[memo_key] = result
+            if len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+            return result
+
+
+course_index = PrefixIndex()
+invalidation.subscribe('course', course_index.on_course_changed)
+# Popularity comes from the purchase counter.
+invalidation.subscribe('course.counters', course_index.on_course_changed)
+invalidation.on_reset(course_index.reset)
@@ -0,0 +1,117 @@
+"""
+Dispatch of /api/batch sub-requests.
+
+Each sub-request is resolved through the URLconf and handed to its view
+with the batch's authenticated user already attached, so the token is
+decoded and the user loaded once per batch.
+
+Writes run in order on the batch's own thread and connection. Runs of
+consecutive GETs between them are independent and go to a small thread
+pool, unless the batch is inside a transaction, whose uncommitted rows
+other connections could not see.
+"""
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from main import entity_cache, tracing
+
+MAX_REQUESTS = 20
+# Not reachable from a batch: nesting, and the password-hashing auth routes.
+EXCLUDED_ROUTES = {'api_batch', 'api_login', 'api_register'}
+FORWARDED_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_HOST', 'HTTP_USER_AGENT', 'REMOTE_ADDR',
+                     'HTTP_X_FORWARDED_FOR', 'SERVER_NAME', 'SERVER_PORT', 'wsgi.url_scheme')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    # Created on first use so gunicorn workers never inherit it across fork.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BATCH_MAX_WORKERS', 4), thread_name_prefix='batch'
+            )
+        return _executor
+
+
+def _build_request(parent: HttpRequest, user, entry: Dict[str, Any]) -> HttpRequest:
+    url = urlsplit(entry['path'])
+    request = HttpRequest()
+    request.method = entry['method']
+    request.path = request.path_info = url.path
+    request.GET = QueryDict(url.query)
+    request.META = {k: parent.META[k] for k in FORWARDED_HEADERS if k in parent.META}
+    request.META.update(REQUEST_METHOD=entry['method'], PATH_INFO=url.path, QUERY_STRING=url.query)
+    body = b'' if entry['body'] is None else json.dumps(entry['body']).encode()
+    request._body = body
+    request.META.update(CONTENT_TYPE='application/json', CONTENT_LENGTH=str(len(body)))
+    if hasattr(parent, 'session'):
+        request.session = parent.session
+    request.token_user = user
+    return request
+
+
+def _call(parent: HttpRequest, user, entry: Dict[str, Any]) -> Dict[str, Any]:
+    result = {'id': entry['id'], 'status': 404, 'body': None}
+    try:
+        match = resolve(urlsplit(entry['path']).path)
+    except Resolver404:
+        return result
+    if match.url_name in EXCLUDED_ROUTES or not match.url_name.startswith('api_'):
+        return result
+
+    request = _build_request(parent, user, entry)
+    request.resolver_match = match
+    try:
+        with tracing.span(f"view {match.url_name}", 'view'):
+            response = match.func(request, *match.args, **match.kwargs)
+    except Exception as e:
+        result.update(status=500, body={'status': 'error', 'message': str(e), 'data': None})
+        return result
+
+    result['status'] = response.status_code
+    if response.get('Content-Type', '').startswith('application/json') and response.content:
+        result['body'] = json.loads(response.content)
+    return result
+
+
+def _call_in_thread(parent: HttpRequest, user, entry: Dict[str, Any]) -> Dict[str, Any]:
+    close_old_connections()
+    try:
+        with entity_cache.request_scope(), connection.execute_wrapper(tracing.sql_span):
+            return _call(parent, user, entry)
+    finally:
+        close_old_connections()
+
+
+def _run_reads(parent: HttpRequest, user, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if len(entries) == 1 or connection.in_atomic_block:
+        return [_call(parent, user, e) for e in entries]
+    # Each read runs in a copy of this context, so its spans join the trace.
+    futures = [
+        _pool().submit(contextvars.copy_context().run, _call_in_thread, parent, user, e) for e in entries
+    ]
+    return [f.result() for f in futures]
+
+
+def run(parent: HttpRequest, user, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    reads: List[Dict[str, Any]] = []
+    for entry in entries:
+        if entry['method'] == 'GET':
+            reads.append(entry)
+            continue
+        results += _run_reads(parent, user, reads)
+        reads = []
+        results.append(_call(parent, user, entry))
+    results += _run_reads(parent, user, reads)
+    return results
@@ -0,0 +1,186 @@
+"""
+Certificate rendering and stateless verification.
+
+A certificate id packs the user id, course id and completion date into 23
+bytes, followed by a truncated HMAC-SHA256 over them, as unpadded base64url.
+Verifying it needs only the signing key and the in-memory revocation list,
+so the public verification endpoint does not touch the database.
+
+The revocation list is loaded once per process and then refreshed by a
+background thread every CERTIFICATE_REVOCATION_REFRESH seconds, or right
+after the invalidation bus reports a revocation.
+"""
+import base64
+import binascii
+import datetime
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.crypto import constant_time_compare, salted_hmac
+from main import invalidation
+from main.repositories import CertificateRepository
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+EPOCH = datetime.date(2000, 1, 1)
+PAYLOAD = struct.Struct('>BI16sH')
+MAC_BYTES = 12
+KEY_SALT = 'main.certificates'
+
+
+def render_certificate(output, user, course, completed_on: datetime.date,
+                       certificate_id: Optional[str] = None) -> None:
+    # reportlab is only needed here and is slow to import, so it is loaded on
+    # the first certificate download instead of at worker start.
+    from reportlab.pdfgen import canvas
+
+    p = canvas.Canvas(output)
+    p.drawString(100, 750, "Certificate of Completion")
+    p.drawString(100, 700, f"Presented to: {user.first_name} {user.last_name}")
+    p.drawString(100, 650, f"For completing the course: {course.title}")
+    p.drawString(100, 600, f"Instructor: {course.instructor}")
+    p.drawString(100, 550, f"Date: {completed_on.strftime('%B %d, %Y')}")
+    if certificate_id:
+        p.drawString(100, 500, f"Certificate ID: {certificate_id}")
+    p.showPage()
+    p.save()
+
+
+def _prepared_path(user, course, certificate: Dict[str, Any]) -> str:
+    # Everything printed on the certificate, so a rename renders a new one.
+    printed = [certificate['certificate_id'], user.first_name, user.last_name, course.title, course.instructor]
+    digest = hashlib.sha256('\0'.join(str(v or '') for v in printed).encode()).hexdigest()
+    return os.path.join(str(settings.CERTIFICATE_DIR), f"{digest}.pdf")
+
+
+def prepared_certificate(user, course, certificate: Dict[str, Any]) -> Optional[str]:
+    """
+    The path of the certificate PDF rendered by prepare_certificate, or None
+    when it has not been rendered for the current names and title.
+    """
+    path = _prepared_path(user, course, certificate)
+    return path if os.path.exists(path) else None
+
+
+def prepare_certificate(user, course, certificate: Dict[str, Any]) -> str:
+    path = _prepared_path(user, course, certificate)
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            render_certificate(f, user, course, certificate['completed_on'], certificate['certificate_id'])
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+
+def _mac(payload: bytes) -> bytes:
+    secret = getattr(settings, 'CERTIFICATE_SECRET', None) or settings.SECRET_KEY
+    return salted_hmac(KEY_SALT, payload, secret=secret, algorithm='sha256').digest()[:MAC_BYTES]
+
+
+def sign(user_id: int, course_id: Any, completed_on: datetime.date) -> str:
+    course_uuid = course_id if isinstance(course_id, uuid.UUID) else uuid.UUID(str(course_id))
+    payload = PAYLOAD.pack(VERSION, int(user_id), course_uuid.bytes, (completed_on - EPOCH).days)
+    return base64.urlsafe_b64encode(payload + _mac(payload)).rstrip(b'=').decode()
+
+
+def decode(certificate_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The signed fields of a certificate id, or None when it is malformed or
+    its signature does not match. Revocation is not checked.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(certificate_id + '=' * (-len(certificate_id) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) != PAYLOAD.size + MAC_BYTES:
+        return None
+    payload, mac = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+    if not constant_time_compare(mac, _mac(payload)):
+        return None
+    version, user_id, course_bytes, days = PAYLOAD.unpack(payload)
+    if version != VERSION:
+        return None
+    return {
+        'user_id': user_id,
+        'course_id': uuid.UUID(bytes=course_bytes),
+        'completed_on': EPOCH + datetime.timedelta(days=days),
+    }
+
+
+class RevocationList:
+    def __init__(self):
+        self.revoked: frozenset = frozenset()
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.pid: Optional[int] = None
+
+    def refresh(self) -> None:
+        self.revoked = frozenset(CertificateRepository.revoked_pairs())
+        self.loaded = True
+
+    def contains(self, user_id: int, course_id: uuid.UUID) -> bool:
+        if not self.loaded:
+            self.refresh()
+        self._ensure_thread()
+        return (user_id, course_id) in self.revoked
+
+    def notify(self, *args) -> None:
+        self.wake.set()
+
+    def _ensure_thread(self) -> None:
+        # A thread started before a fork does not exist in the child.
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='certificate-revocations', daemon=True)
+            self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.wake.wait(getattr(settings, 'CERTIFICATE_REVOCATION_REFRESH', 60))
+            self.wake.clear()
+            close_old_connections()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Refreshing certificate revocations failed")
+            finally:
+                close_old_connections()
+
+
+revocations = RevocationList()
+invalidation.subscribe('certificate', revocations.notify)
+invalidation.on_reset(revocations.notify)
+
+
+def verify(certificate_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The certificate's fields with a 'revoked' flag, or None when the id is
+    not a certificate we signed.
+    """
+    fields = decode(certificate_id)
+    if fields is None:
+        return None
+    fields['revoked'] = revocations.contains(fields['user_id'], fields['course_id'])
+    return fields
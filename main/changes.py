@@ -0,0 +1,111 @@
+"""
+Catalog delta sync for offline clients.
+
+A client pages through /api/changes with the cursor of the previous
+response and gets the courses and modules updated, and the ones deleted,
+since then. Without a cursor it starts with the whole catalog.
+
+Each of the three streams is read in (updated_at, id) order, or
+(deleted_at, id) for tombstones, from the position stored in the cursor.
+A transaction can commit after a later one with an earlier timestamp, so
+once a stream is caught up its position is held back to
+CHANGES_SAFETY_WINDOW seconds ago and the newest rows are sent again on the
+next sync. Clients apply changes as upserts keyed by id.
+
+Tombstones are kept for TOMBSTONE_RETENTION seconds. A cursor older than
+that may have missed deletions and is refused; the client starts over.
+"""
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.utils import timezone
+from main.repositories import CourseRepository, ModuleRepository, TombstoneRepository
+
+STREAMS = {
+    # name: (repository lookup, timestamp field, id type, id before every row)
+    'courses': (CourseRepository.changed_after, 'updated_at', uuid.UUID, uuid.UUID(int=0)),
+    'modules': (ModuleRepository.changed_after, 'updated_at', uuid.UUID, uuid.UUID(int=0)),
+    'deleted': (TombstoneRepository.deleted_after, 'deleted_at', int, 0),
+}
+
+Position = Optional[Tuple[datetime.datetime, Any]]
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def encode_cursor(positions: Dict[str, Position]) -> str:
+    data = {
+        name: [position[0].isoformat(), str(position[1])] if position else None
+        for name, position in positions.items()
+    }
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Position]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        positions = {}
+        for name, (_, _, id_type, _) in STREAMS.items():
+            value = data[name]
+            if value is None:
+                positions[name] = None
+                continue
+            moment = datetime.datetime.fromisoformat(value[0])
+            if moment.tzinfo is None:
+                raise ValueError
+            positions[name] = (moment, id_type(value[1]))
+        return positions
+    except (binascii.Error, ValueError, TypeError, KeyError, IndexError):
+        raise ValueError("Invalid cursor")
+
+
+def _advance(rows: List[Any], field: str, limit: int, horizon: datetime.datetime, first_id: Any) -> Position:
+    if len(rows) == limit:
+        return getattr(rows[-1], field), rows[-1].id
+    # Caught up. Moving to the horizon even when nothing changed also dates
+    # the cursor, which expires by the age of its tombstone position.
+    return horizon, first_id
+
+
+def since(cursor: Optional[str], limit: int) -> Dict[str, Any]:
+    """
+    The next page of changes after cursor, as model instances per stream,
+    with the cursor to continue from and whether more changes are waiting.
+    Raises ValueError for a malformed cursor and CursorExpired for one older
+    than the tombstone retention.
+    """
+    now = timezone.now()
+    horizon = now - datetime.timedelta(seconds=getattr(settings, 'CHANGES_SAFETY_WINDOW', 5))
+    if cursor:
+        positions = decode_cursor(cursor)
+        retention = datetime.timedelta(seconds=getattr(settings, 'TOMBSTONE_RETENTION', 90 * 86400))
+        deleted = positions['deleted']
+        if deleted is None or deleted[0] < now - retention:
+            raise CursorExpired("Cursor expired, sync again without one")
+    else:
+        # A full sync already leaves out everything deleted before it.
+        positions = {'courses': None, 'modules': None, 'deleted': (horizon, STREAMS['deleted'][3])}
+
+    result: Dict[str, Any] = {}
+    following: Dict[str, Position] = {}
+    has_more = False
+    for name, (lookup, field, _, first_id) in STREAMS.items():
+        rows = lookup(positions[name], limit)
+        result[name] = rows
+        following[name] = _advance(rows, field, limit, horizon, first_id)
+        has_more = has_more or len(rows) == limit
+    result['cursor'] = encode_cursor(following)
+    result['has_more'] = has_more
+    return result
+
+
+def prune() -> int:
+    retention = getattr(settings, 'TOMBSTONE_RETENTION', 90 * 86400)
+    return TombstoneRepository.prune(timezone.now() - datetime.timedelta(seconds=retention))
@@ -0,0 +1,44 @@
+import functools
+import random
+import time
+from typing import Iterator
+from django.db import OperationalError, connection
+
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_lock_error(exc: Exception) -> bool:
+    return any(msg in str(exc).lower() for msg in LOCK_ERRORS)
+
+
+def backoff_delays(attempts: int, base: float = 0.05, cap: float = 1.0) -> Iterator[float]:
+    """
+    Exponential backoff with full jitter, one delay per retry.
+    """
+    for attempt in range(attempts - 1):
+        yield random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_on_locked(func=None, *, attempts: int = 5, base: float = 0.05, cap: float = 1.0):
+    """
+    Retries a write when SQLite reports the database as locked. Only the
+    outermost transaction is retried: inside an atomic block the error is
+    re-raised so the enclosing retry_on_locked can restart the whole unit.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            delays = backoff_delays(attempts, base, cap)
+            while True:
+                try:
+                    return f(*args, **kwargs)
+                except OperationalError as e:
+                    if connection.in_atomic_block or not is_lock_error(e):
+                        raise
+                    delay = next(delays, None)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
@@ -0,0 +1,111 @@
+"""
+Read-through cache for entities loaded by the repositories.
+
+Lookups go first to a per-request identity map, so repeated gets of the same
+entity within one request return the same instance without another query.
+They then go to the shared Django cache, kept for ENTITY_CACHE_TIMEOUT
+seconds, and only then to the database.
+
+Entries are dropped through the invalidation bus when the owning repository
+publishes a change. An ALL event bumps the entity's generation, which makes
+every cached entry of that kind unreachable at once.
+"""
+import contextlib
+import copy
+import threading
+from typing import Any, Callable, Optional
+from django.conf import settings
+from django.core.cache import cache
+from main import invalidation
+
+ENTITIES = ('course', 'module', 'user')
+
+_local = threading.local()
+
+
+def _identity_map() -> Optional[dict]:
+    return getattr(_local, 'identity', None)
+
+
+@contextlib.contextmanager
+def request_scope():
+    previous = _identity_map()
+    _local.identity = {}
+    try:
+        yield
+    finally:
+        _local.identity = previous
+
+
+def _generation(entity: str) -> int:
+    identity = _identity_map()
+    gen_key = f"entity-gen:{entity}"
+    if identity is not None and gen_key in identity:
+        return identity[gen_key]
+    gen = cache.get(gen_key) or 0
+    if identity is not None:
+        identity[gen_key] = gen
+    return gen
+
+
+def _key(entity: str, entity_id: Any) -> str:
+    return f"entity:{entity}:{_generation(entity)}:{entity_id}"
+
+
+def _detached(obj):
+    # Related objects are cached under their own keys; keeping copies of
+    # them inside this entry would let it serve stale relations.
+    clone = copy.copy(obj)
+    clone._state = copy.copy(obj._state)
+    clone._state.fields_cache = {}
+    return clone
+
+
+def get(entity: str, entity_id: Any, loader: Callable[[], Any]):
+    key = _key(entity, entity_id)
+    identity = _identity_map()
+    if identity is not None and key in identity:
+        return identity[key]
+
+    obj = cache.get(key)
+    if obj is None:
+        obj = loader()
+        if obj is not None:
+            cache.set(key, _detached(obj), getattr(settings, 'ENTITY_CACHE_TIMEOUT', 60))
+    if identity is not None:
+        identity[key] = obj
+    return obj
+
+
+def prime(entity: str, obj) -> None:
+    key = _key(entity, obj.pk)
+    cache.set(key, _detached(obj), getattr(settings, 'ENTITY_CACHE_TIMEOUT', 60))
+    identity = _identity_map()
+    if identity is not None:
+        identity[key] = obj
+
+
+def invalidate(entity: str, entity_id: str) -> None:
+    identity = _identity_map()
+    if entity_id == invalidation.ALL:
+        gen_key = f"entity-gen:{entity}"
+        cache.set(gen_key, (cache.get(gen_key) or 0) + 1, None)
+        if identity is not None:
+            for key in [k for k in identity if k.startswith(f"entity:{entity}:") or k == gen_key]:
+                del identity[key]
+        return
+    key = _key(entity, entity_id)
+    cache.delete(key)
+    if identity is not None:
+        identity.pop(key, None)
+
+
+def reset() -> None:
+    for entity in ENTITIES:
+        invalidate(entity, invalidation.ALL)
+
+
+for _entity in ENTITIES:
+    invalidation.subscribe(_entity, lambda entity_id, _entity=_entity: invalidate(_entity, entity_id))
+invalidation.subscribe('course.counters', lambda entity_id: invalidate('course', entity_id))
+invalidation.on_reset(reset)
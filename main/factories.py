@@ -1,3 +1,5 @@
+import math
+import uuid
 from typing import Dict, Any, List
 
 
@@ -65,4 +67,135 @@ class EntityFactory:
             'order': int(payload.get('order', existing.order)),
             'pdf_content': payload.get('pdf_content', existing.pdf_content),
             'video_content': payload.get('video_content', existing.video_content)
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def build_module_completion(payload: Dict[str, Any], max_items: int = 1000) -> Dict[str, Any]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        module_ids = payload.get('module_ids')
+        if not isinstance(module_ids, list) or not module_ids:
+            raise ValueError("module_ids must be a non-empty list")
+        user_ids = payload.get('user_ids')
+        if user_ids is not None and (not isinstance(user_ids, list) or not user_ids):
+            raise ValueError("user_ids must be a non-empty list")
+        if len(module_ids) * len(user_ids or [None]) > max_items:
+            raise ValueError(f"At most {max_items} completions per request")
+        try:
+            parsed_modules = list(dict.fromkeys(uuid.UUID(str(m)) for m in module_ids))
+            parsed_users = list(dict.fromkeys(int(u) for u in user_ids)) if user_ids is not None else None
+        except (TypeError, ValueError):
+            raise ValueError("Invalid module or user id")
+        return {'module_ids': parsed_modules, 'user_ids': parsed_users}
+
+    @staticmethod
+    def build_activity(payload: Dict[str, Any], max_items: int = 500, max_watched: float = 60) -> List[Dict[str, Any]]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        events = payload.get('events')
+        if not isinstance(events, list) or not events:
+            raise ValueError("events must be a non-empty list")
+        if len(events) > max_items:
+            raise ValueError(f"At most {max_items} events per request")
+        result = []
+        for event in events:
+            if not isinstance(event, dict):
+                raise ValueError("Each event must be an object")
+            try:
+                module_id = uuid.UUID(str(event.get('module_id')))
+                position = float(event.get('position', 0))
+                watched = float(event.get('watched', 0))
+                duration = event.get('duration')
+                duration = float(duration) if duration is not None else None
+            except (TypeError, ValueError):
+                raise ValueError("Invalid activity event")
+            # json.loads accepts NaN and Infinity, which would poison the sums.
+            if not all(math.isfinite(v) for v in (position, watched, duration or 0.0)):
+                raise ValueError("Invalid activity event")
+            result.append({
+                'module_id': module_id,
+                'position': max(position, 0.0),
+                # Heartbeats arrive every few seconds; cap what one can claim.
+                'watched': min(max(watched, 0.0), max_watched),
+                'duration': duration,
+                'ended': bool(event.get('ended', False)),
+            })
+        return result
+
+    @staticmethod
+    def build_batch(payload: Dict[str, Any], max_items: int = 20) -> List[Dict[str, Any]]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        entries = payload.get('requests')
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("requests must be a non-empty list")
+        if len(entries) > max_items:
+            raise ValueError(f"At most {max_items} requests per batch")
+        result = []
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not str(entry.get('path', '')).startswith('/api/'):
+                raise ValueError(f"Request {i} needs a path under /api/")
+            method = str(entry.get('method', 'GET')).upper()
+            if method not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
+                raise ValueError(f"Request {i} has an unsupported method")
+            result.append({
+                'id': entry.get('id', i),
+                'method': method,
+                'path': str(entry['path']),
+                'body': entry.get('body'),
+            })
+        return result
+
+    @staticmethod
+    def build_bulk_credit(payload: Dict[str, Any]) -> Dict[str, Any]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        try:
+            delta = int(payload.get('increment', 0))
+        except (TypeError, ValueError):
+            raise ValueError("increment must be an integer")
+        if delta == 0:
+            raise ValueError("increment must be non-zero")
+        user_ids = payload.get('user_ids')
+        if user_ids is not None:
+            if not isinstance(user_ids, list) or not user_ids:
+                raise ValueError("user_ids must be a non-empty list")
+            try:
+                user_ids = [int(u) for u in user_ids]
+            except (TypeError, ValueError):
+                raise ValueError("Invalid user id")
+        return {
+            'delta': delta,
+            'user_ids': user_ids,
+            'reason': str(payload.get('reason', '')).strip()[:200],
+        }
+
+    @staticmethod
+    def build_certificate_revocation(payload: Dict[str, Any]) -> Dict[str, str]:
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        return {
+            'certificate_id': str(payload.get('certificate_id', '')),
+            'reason': str(payload.get('reason', ''))[:255],
+        }
+
+    @staticmethod
+    def build_course_sort(value) -> str:
+        sort = (value or 'newest').strip().lower()
+        if sort not in ('newest', 'popular', 'price'):
+            raise ValueError("sort must be one of newest, popular, price")
+        return sort
+
+    @staticmethod
+    def build_course_filters(params) -> Dict[str, Any]:
+        filters: Dict[str, Any] = {
+            'topic': (params.get('topic') or '').strip() or None,
+            'instructor': (params.get('instructor') or '').strip() or None,
+        }
+        for key in ('min_price', 'max_price'):
+            value = params.get(key)
+            try:
+                filters[key] = int(value) if value not in (None, '') else None
+            except ValueError:
+                raise ValueError(f"{key} must be an integer")
+        return filters
@@ -0,0 +1,148 @@
+"""
+Cross-worker invalidation bus backed by the invalidation event table.
+
+Writers append an event in the same transaction as the change, so it only
+becomes visible once the change is committed. The writing process applies it
+to its own caches right after commit. Every other process picks it up with a
+throttled poll over the event sequence, called at the start of each request.
+
+A process that falls behind the retained window, or has not polled for longer
+than the retention period, cannot know what it missed and resets every
+subscribed cache instead.
+"""
+import collections
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from main.models import InvalidationEvent
+
+logger = logging.getLogger(__name__)
+
+ALL = '*'
+LOOKBACK = 100
+MAX_BATCH = 1000
+
+_listeners: Dict[str, List[Callable[[str], None]]] = collections.defaultdict(list)
+_reset_listeners: List[Callable[[], None]] = []
+_poll_lock = threading.Lock()
+_state = {'last_seen': None, 'last_poll': 0.0}
+_recent = collections.deque(maxlen=LOOKBACK * 2)
+
+
+def _origin() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def subscribe(entity: str, callback: Callable[[str], None]) -> None:
+    """
+    callback(entity_id) runs when an entity changes; entity_id is ALL when
+    every entity of that kind may have changed.
+    """
+    _listeners[entity].append(callback)
+
+
+def on_reset(callback: Callable[[], None]) -> None:
+    _reset_listeners.append(callback)
+
+
+def publish(entity: str, entity_id: Any) -> None:
+    entity_id = str(entity_id)
+    InvalidationEvent.objects.create(entity=entity, entity_id=entity_id, origin=_origin())
+    transaction.on_commit(lambda: _dispatch(entity, entity_id))
+
+
+def publish_many(entity: str, entity_ids: List[Any]) -> None:
+    entity_ids = [str(entity_id) for entity_id in entity_ids]
+    if not entity_ids:
+        return
+    origin = _origin()
+    InvalidationEvent.objects.bulk_create(
+        [InvalidationEvent(entity=entity, entity_id=entity_id, origin=origin) for entity_id in entity_ids]
+    )
+    transaction.on_commit(lambda: [_dispatch(entity, entity_id) for entity_id in entity_ids])
+
+
+def _dispatch(entity: str, entity_id: str) -> None:
+    for callback in _listeners.get(entity, []):
+        try:
+            callback(entity_id)
+        except Exception:
+            logger.exception("Invalidation listener failed for %s:%s", entity, entity_id)
+
+
+def reset_all() -> None:
+    for callback in _reset_listeners:
+        try:
+            callback()
+        except Exception:
+            logger.exception("Invalidation reset listener failed")
+
+
+def mark_synced() -> None:
+    """
+    Records the current head of the event sequence. Call before building
+    in-process caches so the first poll only replays later events.
+    """
+    window = list(InvalidationEvent.objects.order_by('-id').values_list('id', flat=True)[:LOOKBACK])
+    _recent.clear()
+    _recent.extend(reversed(window))
+    _state.update(last_seen=window[0] if window else 0, last_poll=time.monotonic())
+
+
+def poll(force: bool = False) -> int:
+    interval = getattr(settings, 'INVALIDATION_POLL_INTERVAL', 0.05)
+    if interval is None and not force:
+        return 0
+    now = time.monotonic()
+    if not force and now - _state['last_poll'] < interval:
+        return 0
+    if not _poll_lock.acquire(blocking=False):
+        return 0
+    try:
+        if _state['last_seen'] is None:
+            mark_synced()
+            return 0
+
+        retention = getattr(settings, 'INVALIDATION_RETENTION', 3600)
+        stale = now - _state['last_poll'] > retention
+        _state['last_poll'] = now
+        # Re-read a small window below the high-water mark: a transaction
+        # that took its id earlier may commit after a later one.
+        low = max(_state['last_seen'] - LOOKBACK, 0)
+        events = list(
+            InvalidationEvent.objects.filter(id__gt=low)
+            .order_by('id')
+            .values_list('id', 'entity', 'entity_id', 'origin')[:MAX_BATCH + LOOKBACK]
+        )
+        if stale or len(events) >= MAX_BATCH + LOOKBACK:
+            logger.info("Invalidation bus fell behind, resetting local caches")
+            reset_all()
+            mark_synced()
+            return 0
+
+        origin = _origin()
+        applied = 0
+        for event_id, entity, entity_id, event_origin in events:
+            if event_id in _recent:
+                continue
+            _recent.append(event_id)
+            _state['last_seen'] = max(_state['last_seen'], event_id)
+            if event_origin != origin:
+                _dispatch(entity, entity_id)
+                applied += 1
+        return applied
+    finally:
+        _poll_lock.release()
+
+
+def prune(older_than_seconds: int) -> int:
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than_seconds)
+    deleted, _ = InvalidationEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,42 @@
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from main.repositories import CreditRepository
+from main.services import UserService
+
+
+class Command(BaseCommand):
+    help = "Credit balances in bulk with set-based updates, or resume unfinished credit batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--increment', type=int, help="Amount to add to every selected balance")
+        parser.add_argument('--users', help="Comma separated user ids (default: all active users)")
+        parser.add_argument('--reason', default='')
+        parser.add_argument('--resume', metavar='BATCH_ID', help="Continue an interrupted batch")
+        parser.add_argument('--pending', action='store_true', help="Continue every unfinished batch")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            batches = CreditRepository.list_pending()
+        elif options['resume']:
+            try:
+                uuid.UUID(options['resume'])
+            except ValueError:
+                raise CommandError(f"Invalid credit batch id: {options['resume']}")
+            batch = UserService.get_credit_batch(options['resume'])
+            if not batch:
+                raise CommandError(f"Credit batch {options['resume']} not found")
+            batches = [batch]
+        elif options['increment']:
+            try:
+                user_ids = [int(u) for u in options['users'].split(',')] if options['users'] else None
+            except ValueError:
+                raise CommandError("--users must be comma separated user ids")
+            batches = [CreditRepository.create_batch(options['increment'], user_ids=user_ids, reason=options['reason'])]
+        else:
+            raise CommandError("Pass --increment to start a batch, or --resume/--pending to continue one")
+
+        for batch in batches:
+            self.stdout.write(f"Applying credit batch {batch.id} ({batch.delta:+d})")
+            batch = UserService.apply_bulk_credit(batch.id, chunk_size=options['chunk_size'])
+            self.stdout.write(f"Batch {batch.id}: {batch.applied_count} balances credited")
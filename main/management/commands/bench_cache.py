@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from main.mmapcache import MmapCache
+
+
+def _backends(tmpdir):
+    return {
+        'locmem': lambda: LocMemCache('bench', {'OPTIONS': {'MAX_ENTRIES': 100000}}),
+        'filebased': lambda: FileBasedCache(os.path.join(tmpdir, 'files'), {'OPTIONS': {'MAX_ENTRIES': 100000}}),
+        'mmap': lambda: MmapCache(os.path.join(tmpdir, 'cache.bin'), {'OPTIONS': {'SLOTS': 16384, 'SLOT_SIZE': 4096}}),
+    }
+
+
+def _payload():
+    return {
+        'id': '6f1c2a9e-8d0b-4a57-9a43-3c1b2f0e7d11',
+        'title': 'Intro to Distributed Systems',
+        'instructor': 'Jane Doe',
+        'topics': ['distributed', 'systems', 'python'],
+        'price': 150000,
+        'description': 'x' * 800,
+    }
+
+
+def _reader(args):
+    name, tmpdir, keys, rounds = args
+    cache = _backends(tmpdir)[name]()
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for k in keys:
+            hits += cache.get(k) is not None
+    return hits, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Benchmark the mmap cache backend against LocMemCache and FileBasedCache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        keys = [f'course:{i}' for i in range(options['keys'])]
+        rounds = options['rounds']
+        value = _payload()
+        tmpdir = tempfile.mkdtemp(prefix='cachebench-')
+        try:
+            self.stdout.write(f"{'backend':<10} {'set/s':>10} {'get/s':>10} {'worker hit rate':>16}")
+            for name, factory in _backends(tmpdir).items():
+                cache = factory()
+                start = time.perf_counter()
+                for k in keys:
+                    cache.set(k, value)
+                set_rate = len(keys) / (time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for k in keys:
+                        cache.get(k)
+                get_rate = len(keys) * rounds / (time.perf_counter() - start)
+
+                # Fresh processes stand in for gunicorn workers: they only
+                # see what the parent stored if the backend is shared.
+                ctx = multiprocessing.get_context('spawn')
+                with ctx.Pool(options['workers']) as pool:
+                    results = pool.map(_reader, [(name, tmpdir, keys, 1)] * options['workers'])
+                hit_rate = sum(h for h, _ in results) / (len(keys) * options['workers'])
+
+                self.stdout.write(f"{name:<10} {set_rate:>10.0f} {get_rate:>10.0f} {hit_rate:>15.0%}")
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from main.db import backoff_delays, is_lock_error
+
+PROFILES = {
+    # Django's stock SQLite setup: rollback journal, DEFERRED transactions, no retry.
+    'default': {'pragmas': [], 'begin': 'BEGIN', 'retries': 1},
+    # The profile configured in settings.DATABASES plus retry_on_locked.
+    'tuned': {
+        'pragmas': [c.strip() for c in settings.DATABASES['default'].get('OPTIONS', {}).get('init_command', '').split(';') if c.strip()],
+        'begin': 'BEGIN IMMEDIATE',
+        'retries': 5,
+    },
+}
+
+
+def _connect(path, profile, timeout):
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    for pragma in PROFILES[profile]['pragmas']:
+        conn.execute(pragma)
+    return conn
+
+
+def _writer(args):
+    path, profile, transactions, accounts, timeout, seed = args
+    conf = PROFILES[profile]
+    conn = _connect(path, profile, timeout)
+    committed = failed = 0
+    for i in range(transactions):
+        account = (seed * 7919 + i) % accounts + 1
+        delays = backoff_delays(conf['retries'])
+        while True:
+            try:
+                # Same shape as a purchase: read the balance, then debit and record.
+                conn.execute(conf['begin'])
+                (balance,) = conn.execute('SELECT balance FROM account WHERE id = ?', (account,)).fetchone()
+                conn.execute('UPDATE account SET balance = ? WHERE id = ?', (balance - 1, account))
+                conn.execute('INSERT INTO ledger (account_id, delta) VALUES (?, -1)', (account,))
+                conn.execute('COMMIT')
+                committed += 1
+                break
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                delay = next(delays, None)
+                if not is_lock_error(e) or delay is None:
+                    failed += 1
+                    break
+                time.sleep(delay)
+    conn.close()
+    return committed, failed
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent SQLite writers with the stock and the tuned profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--transactions', type=int, default=200, help="Write transactions per worker")
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--timeout', type=float, default=5.0, help="SQLite busy timeout in seconds")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':<10} {'tx/s':>10} {'committed':>10} {'failed':>8} {'seconds':>8}")
+        for profile in PROFILES:
+            with tempfile.TemporaryDirectory(prefix='sqlitebench-') as tmpdir:
+                path = os.path.join(tmpdir, 'bench.sqlite3')
+                conn = _connect(path, profile, options['timeout'])
+                conn.execute('CREATE TABLE account (id INTEGER PRIMARY KEY, balance INTEGER NOT NULL)')
+                conn.execute('CREATE TABLE ledger (id INTEGER PRIMARY KEY, account_id INTEGER, delta INTEGER)')
+                conn.executemany('INSERT INTO account (id, balance) VALUES (?, 1000000)',
+                                 [(i,) for i in range(1, options['accounts'] + 1)])
+                conn.close()
+
+                jobs = [(path, profile, options['transactions'], options['accounts'], options['timeout'], n)
+                        for n in range(options['workers'])]
+                start = time.perf_counter()
+                with multiprocessing.get_context('spawn').Pool(options['workers']) as pool:
+                    results = pool.map(_writer, jobs)
+                elapsed = time.perf_counter() - start
+
+                committed = sum(c for c, _ in results)
+                failed = sum(f for _, f in results)
+                self.stdout.write(f"{profile:<10} {committed / elapsed:>10.0f} {committed:>10} {failed:>8} {elapsed:>8.2f}")
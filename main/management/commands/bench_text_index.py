@@ -0,0 +1,81 @@
+import itertools
+import os
+import random
+import tempfile
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from main.textindex import TextIndex, build
+
+
+def _corpus(count, vocabulary, seed):
+    # Word frequencies follow a Zipf distribution, like real course text.
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    for _ in range(count):
+        yield (
+            uuid.UUID(int=rng.getrandbits(128)),
+            ' '.join(rng.choices(words, cum_weights=cumulative, k=6)),
+            ' '.join(rng.choices(words, cum_weights=cumulative, k=80)),
+            rng.choices(words[:200], k=3),
+        )
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+class Command(BaseCommand):
+    help = "Benchmark building and querying the TF-IDF course index on a synthetic corpus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000)
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        with tempfile.TemporaryDirectory(prefix='textindex-bench-') as tmp:
+            docs = list(_corpus(options['courses'], options['vocabulary'], options['seed']))
+            start = time.perf_counter()
+            stats = build(docs, path=tmp)
+            build_seconds = time.perf_counter() - start
+            size = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, names in os.walk(tmp) for name in names
+            )
+
+            index = TextIndex(path=tmp)
+            index.ensure_loaded()
+            rng = random.Random(options['seed'])
+            sample = [str(d[0]) for d in rng.sample(docs, min(options['queries'], len(docs)))]
+            texts = [d[1] for d in rng.sample(docs, min(options['queries'], len(docs)))]
+
+            similar, search = [], []
+            for cid, text in zip(sample, texts):
+                start = time.perf_counter()
+                index.similar([cid], limit)
+                similar.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                index.search(text, limit)
+                search.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            index.similar(sample, limit)
+            batched = time.perf_counter() - start
+
+        self.stdout.write(
+            f"Built {stats['courses']} courses, {stats['terms']} terms, {stats['nonzeros']} non-zeros "
+            f"in {build_seconds:.2f}s ({size / 1e6:.1f} MB on disk)"
+        )
+        self.stdout.write(f"{'query':<16} {'p50 ms':>8} {'p95 ms':>8}")
+        self.stdout.write(f"{'similar':<16} {_percentile(similar, 0.5):>8.2f} {_percentile(similar, 0.95):>8.2f}")
+        self.stdout.write(f"{'search':<16} {_percentile(search, 0.5):>8.2f} {_percentile(search, 0.95):>8.2f}")
+        self.stdout.write(
+            f"Batched similar: {len(sample)} courses in {batched * 1000:.0f} ms "
+            f"({len(sample) / batched:.0f} courses/s)"
+        )
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from main.services import CourseService
+
+
+class Command(BaseCommand):
+    help = "Compute co-purchase neighbours for every course and write the recommendations file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=20, help="Neighbours stored per course")
+        parser.add_argument('--batch-size', type=int, default=256, help="Courses per similarity batch")
+        parser.add_argument('--min-support', type=int, default=1,
+                            help="Minimum number of shared buyers for a neighbour")
+        parser.add_argument('--output', help="Path to write (default: settings.RECOMMENDATIONS_PATH)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stats = CourseService.build_recommendations(
+            path=options['output'], top_k=options['top_k'],
+            batch_size=options['batch_size'], min_support=options['min_support'],
+        )
+        self.stdout.write(
+            f"Indexed {stats['courses']} courses from {stats['purchases']} purchases by {stats['users']} users "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from main.services import CourseService
+
+
+class Command(BaseCommand):
+    help = "Build the TF-IDF course index used for similar courses and text search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-terms', type=int, default=200000, help="Vocabulary size, most frequent terms first")
+        parser.add_argument('--output', help="Index directory (default: settings.TEXT_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stats = CourseService.build_text_index(path=options['output'], max_terms=options['max_terms'])
+        self.stdout.write(
+            f"Indexed {stats['courses']} courses over {stats['terms']} terms ({stats['nonzeros']} non-zeros) "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
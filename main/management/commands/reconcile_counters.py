@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from main.services import CourseService
+
+
+class Command(BaseCommand):
+    help = "Recount per-course module and purchase counters and repair any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        drifted = CourseService.reconcile_counters(dry_run=options['dry_run'])
+        for row in drifted:
+            modules, purchases = row['module_count'], row['purchase_count']
+            self.stdout.write(
+                f"{row['course_id']}: modules {modules[0]} -> {modules[1]}, purchases {purchases[0]} -> {purchases[1]}"
+            )
+        action = "found" if options['dry_run'] else "repaired"
+        self.stdout.write(f"{len(drifted)} course(s) with drifted counters {action}")
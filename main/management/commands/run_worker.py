@@ -0,0 +1,55 @@
+import datetime
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from main import changes, invalidation, tasks
+from main.repositories import JobRepository
+
+
+class Command(BaseCommand):
+    help = "Process queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--visibility-timeout', type=int, default=60,
+                            help="Seconds a claimed job stays invisible to other workers")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--purge-after', type=int, default=7,
+                            help="Delete finished jobs older than this many days (0 disables)")
+        parser.add_argument('--prune-interval', type=float, default=300,
+                            help="Seconds between purges of finished jobs and expired events")
+        parser.add_argument('--once', action='store_true', help="Process one batch and exit")
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        last_prune = None
+        while not self._stopping:
+            close_old_connections()
+            if last_prune is None or time.monotonic() - last_prune >= options['prune_interval']:
+                self._prune(options['purge_after'])
+                last_prune = time.monotonic()
+            jobs = tasks.run_batch(options['batch_size'], options['visibility_timeout'])
+            if jobs:
+                self.stdout.write(f"Processed {len(jobs)} jobs")
+            if options['once']:
+                break
+            if not jobs:
+                time.sleep(options['poll_interval'])
+
+    def _prune(self, purge_after: int) -> None:
+        if purge_after:
+            purged = JobRepository.purge_done(timezone.now() - datetime.timedelta(days=purge_after))
+            if purged:
+                self.stdout.write(f"Purged {purged} finished jobs")
+        invalidation.prune(getattr(settings, 'INVALIDATION_RETENTION', 3600))
+        changes.prune()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
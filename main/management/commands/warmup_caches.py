@@ -0,0 +1,21 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from main import warmup
+
+
+class Command(BaseCommand):
+    help = "Replay the most common reads through the services to warm the shared caches after a deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=getattr(settings, 'WARMUP_TOP_COURSES', 50),
+                            help="Most purchased courses to replay")
+        parser.add_argument('--page-size', type=int, default=15, help="Catalog and module page size")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        stats = warmup.replay(options['top'], page_size=options['page_size'])
+        self.stdout.write(
+            f"Warmed {stats['catalog_pages']} catalog pages, {stats['courses']} courses and "
+            f"{stats['modules']} modules in {time.perf_counter() - start:.2f}s"
+        )
@@ -0,0 +1,229 @@
+"""
+Optional local storage for course thumbnails and module content.
+
+With MEDIA_LOCAL_STORAGE enabled, uploads are written under MEDIA_ROOT with
+their SHA-256 as the file name. A file's name therefore never changes
+content, which makes the hash a strong ETag and every response cacheable
+forever, and uploading the same file twice stores it once.
+
+Thumbnail derivatives for THUMBNAIL_SIZES are generated once at upload
+time. Pillow is optional; without it only the original image is kept.
+
+Files are served with FileResponse, which gunicorn hands to sendfile(2).
+A single byte range is served as 206 from a file positioned at its start
+with the range's length as Content-Length, which gunicorn's sendfile also
+honours.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from typing import Dict, Optional, Tuple
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+
+logger = logging.getLogger(__name__)
+
+KINDS = {
+    'pdf': ('modules', {'.pdf'}),
+    'video': ('modules', {'.mp4', '.webm', '.m4v', '.mov'}),
+    'image': ('thumbnails', {'.jpg', '.jpeg', '.png', '.webp', '.gif'}),
+}
+SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'image': (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'RIFF', b'GIF87a', b'GIF89a'),
+}
+NAME = re.compile(r'^(?:modules|thumbnails)/([0-9a-f]{64})(?:_\d+)?\.[a-z0-9]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def enabled() -> bool:
+    return getattr(settings, 'MEDIA_LOCAL_STORAGE', False)
+
+
+def _root() -> str:
+    return str(settings.MEDIA_ROOT)
+
+
+def url(name: str) -> str:
+    return f"{settings.MEDIA_URL}{name}"
+
+
+def check(upload, kind: str) -> None:
+    """
+    Raises ValueError when the upload is not an acceptable file of that kind,
+    judging by its extension, size and leading bytes.
+    """
+    _, extensions = KINDS[kind]
+    ext = os.path.splitext(upload.name or '')[1].lower()
+    if ext not in extensions:
+        raise ValueError(f"{kind} must be one of: {', '.join(sorted(extensions))}")
+    if upload.size > getattr(settings, 'MEDIA_MAX_UPLOAD_SIZE', 512 * 1024 * 1024):
+        raise ValueError("File too large")
+    if kind in SIGNATURES:
+        upload.seek(0)
+        head = upload.read(16)
+        upload.seek(0)
+        if not head.startswith(SIGNATURES[kind]):
+            raise ValueError(f"Not a valid {kind} file")
+
+
+def store(upload, kind: str) -> str:
+    """
+    Writes an uploaded file under its content hash and returns its storage
+    name. Raises ValueError when it is not an acceptable file of that kind.
+    """
+    check(upload, kind)
+    folder, _ = KINDS[kind]
+    ext = os.path.splitext(upload.name or '')[1].lower()
+    target_dir = os.path.join(_root(), folder)
+    os.makedirs(target_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=target_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in upload.chunks():
+                digest.update(chunk)
+                f.write(chunk)
+        name = f"{folder}/{digest.hexdigest()}{ext}"
+        os.replace(tmp, os.path.join(_root(), name))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return name
+
+
+def make_thumbnails(name: str) -> Dict[int, str]:
+    """
+    Width-bounded JPEG derivatives of a stored image, keyed by width. An
+    image that cannot be decoded, or has more than MEDIA_MAX_IMAGE_PIXELS
+    pixels, is removed along with its derivatives and raises ValueError.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow is not installed, storing %s without thumbnails", name)
+        return {}
+
+    max_pixels = getattr(settings, 'MEDIA_MAX_IMAGE_PIXELS', 40_000_000)
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    base = os.path.splitext(name)[0]
+    widths = getattr(settings, 'THUMBNAIL_SIZES', (320, 640))
+    derivatives: Dict[int, str] = {}
+    try:
+        with Image.open(os.path.join(_root(), name)) as image:
+            if image.width * image.height > max_pixels:
+                raise ValueError("Image too large")
+            image = image.convert('RGB')
+            for width in widths:
+                derivative = f"{base}_{width}.jpg"
+                path = os.path.join(_root(), derivative)
+                if not os.path.exists(path):
+                    copy = image.copy()
+                    copy.thumbnail((width, width * 4))
+                    copy.save(f"{path}.part", 'JPEG', quality=85, optimize=True)
+                    os.replace(f"{path}.part", path)
+                derivatives[width] = derivative
+    except (ValueError, OSError, Image.DecompressionBombError) as e:
+        # Content-addressed, so nothing else can be using these files.
+        for stale in [name] + [f"{base}_{width}.jpg{suffix}" for width in widths for suffix in ('', '.part')]:
+            try:
+                os.unlink(os.path.join(_root(), stale))
+            except FileNotFoundError:
+                pass
+        if isinstance(e, ValueError):
+            raise
+        raise ValueError("Not a valid image file") from e
+    return derivatives
+
+
+def _byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end inclusive) of a single-range Range header. Returns None for
+    headers that are ignored, and (size, size) when it is unsatisfiable.
+    """
+    match = RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if length == 0:
+            return size, size
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return size, size
+    if end < start:
+        return None
+    return start, end
+
+
+class _RangeFile:
+    """
+    A file positioned at the start of a range that reads no further than its
+    end, for servers without sendfile.
+    """
+
+    def __init__(self, f, length: int):
+        self.f = f
+        self.remaining = length
+
+    def fileno(self) -> int:
+        return self.f.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def serve(request, name: str):
+    if not enabled() or not NAME.match(name):
+        return HttpResponse(status=404)
+    try:
+        f = open(safe_join(_root(), name), 'rb')
+    except (OSError, ValueError):
+        return HttpResponse(status=404)
+
+    size = os.fstat(f.fileno()).st_size
+    etag = f'"{os.path.splitext(os.path.basename(name))[0]}"'
+    headers = {'Accept-Ranges': 'bytes', 'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+    if_none_match = [t.strip() for t in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    if etag in if_none_match or '*' in if_none_match:
+        f.close()
+        return HttpResponseNotModified(headers=headers)
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = _byte_range(request.META['HTTP_RANGE'], size)
+    if byte_range is not None and byte_range[0] >= size:
+        f.close()
+        return HttpResponse(status=416, headers=dict(headers, **{'Content-Range': f'bytes */{size}'}))
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    status, body, length = 200, f, size
+    if byte_range is not None:
+        start, end = byte_range
+        f.seek(start)
+        status, length = 206, end - start + 1
+        body = _RangeFile(f, length)
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if request.method == 'HEAD':
+        f.close()
+        response = HttpResponse(status=status, content_type=content_type, headers=headers)
+    else:
+        response = FileResponse(body, status=status, content_type=content_type, headers=headers)
+    response['Content-Length'] = str(length)
+    return response
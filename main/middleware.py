@@ -0,0 +1,301 @@
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse, QueryDict
+from django.urls import Resolver404, resolve
+from django.utils.functional import empty
+from main import batch, entity_cache, invalidation, tracing
+from main.factories import EntityFactory
+from main.tokens import decode_token
+
+RATE_LIMIT_DEFAULTS = {
+    'ENABLED': True,
+    'CAPACITY': 60,
+    'REFILL_PER_SECOND': 2.0,
+    'ROUTE_COSTS': {},
+    'SEARCH_COST': 0,
+    'SEARCH_ROUTES': [],
+    'MAX_CLIENTS': 10000,
+    'TRUST_X_FORWARDED_FOR': False,
+    'LATENCY_THRESHOLD': 2.0,
+    'LATENCY_PERCENTILE': 0.9,
+    'LATENCY_WINDOW': 50,
+    'LATENCY_MIN_SAMPLES': 20,
+    'SHED_SECONDS': 5,
+}
+
+ACCESS_LOG_DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.1,
+    'SLOW_MS': 500,
+}
+
+access_logger = logging.getLogger('main.access')
+
+
+class InvalidationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        invalidation.poll()
+        return self.get_response(request)
+
+
+class EntityCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with entity_cache.request_scope():
+            return self.get_response(request)
+
+
+class TracingMiddleware:
+    """
+    Opens a trace around the request (see main.tracing) with a span for the
+    whole request, one for the view and one per SQL query, and returns the
+    trace id in the TRACING['HEADER'] response header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        header = tracing.conf()['HEADER']
+        incoming = tracing.incoming_trace_id(request.META, header)
+        # A caller that sends a trace id has already decided to sample it.
+        with tracing.start_trace(incoming, force=incoming is not None) as trace:
+            if trace is None:
+                return self.get_response(request)
+            with contextlib.ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(tracing.sql_span))
+                with tracing.span(f"{request.method} {request.path}", 'request'):
+                    try:
+                        response = self.get_response(request)
+                    finally:
+                        tracing.end_span(getattr(request, 'trace_view_span', None))
+
+            match = request.resolver_match
+            trace.summary.update(
+                method=request.method,
+                path=request.path,
+                route=match.route if match else None,
+                view=match.url_name if match else None,
+                status=response.status_code,
+            )
+            response[header] = trace.trace_id
+            return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request.trace_view_span = tracing.begin_span(f"view {match.url_name or view_func.__name__}", 'view')
+        return None
+
+
+class AccessLogMiddleware:
+    """
+    One structured record per request on the 'main.access' logger, which
+    settings.LOGGING routes to a queued, batched file handler.
+
+    Requests that fail (status >= 400) or take SLOW_MS or longer are always
+    logged; the rest are sampled at SAMPLE_RATE. Queries are counted on this
+    thread's connections, so reads a batch runs on its pool are not included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = {**ACCESS_LOG_DEFAULTS, **getattr(settings, 'ACCESS_LOG', {})}
+
+    def __call__(self, request):
+        if not self.conf['ENABLED']:
+            return self.get_response(request)
+
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(count))
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        status = response.status_code
+        if status < 400 and elapsed_ms < self.conf['SLOW_MS'] and random.random() >= self.conf['SAMPLE_RATE']:
+            return response
+        match = request.resolver_match
+        access_logger.info('%s %s %s', request.method, request.path, status, extra={'access': {
+            'method': request.method,
+            'path': request.path,
+            'route': match.route if match else None,
+            'view': match.url_name if match else None,
+            'user_id': self._user_id(request),
+            'status': status,
+            'latency_ms': round(elapsed_ms, 1),
+            'queries': queries[0],
+            'bytes': self._size(response),
+            'trace_id': tracing.current_trace_id(),
+        }})
+        return response
+
+    @staticmethod
+    def _user_id(request):
+        # Only users the request already loaded; loading one here would add
+        # a query to every logged request.
+        user = getattr(request, 'token_user', None)
+        if user is None:
+            session_user = getattr(request, 'user', None)
+            if session_user is not None and getattr(session_user, '_wrapped', empty) is not empty:
+                user = session_user
+        return user.id if user is not None and user.is_authenticated else None
+
+    @staticmethod
+    def _size(response):
+        if not response.streaming:
+            return len(response.content)
+        length = response.get('Content-Length')
+        return int(length) if length else None
+
+
+class RateLimitMiddleware:
+    """
+    Per-client token buckets plus process-wide load shedding.
+
+    Clients are keyed by the user id in their bearer token, their session
+    user, or their IP. Each route costs ROUTE_COSTS[url_name] tokens (default
+    1), plus SEARCH_COST when a search route gets a q parameter. A batch costs
+    the sum of its sub-requests. Buckets hold CAPACITY tokens and refill at
+    REFILL_PER_SECOND.
+
+    Independently, the process sheds load with 503 + Retry-After for
+    SHED_SECONDS once the LATENCY_PERCENTILE of its last LATENCY_WINDOW
+    request durations exceeds LATENCY_THRESHOLD seconds. At least
+    LATENCY_MIN_SAMPLES durations are needed, so a single slow request does
+    not trip it. Gunicorn's sync workers run one request at a time, so the
+    queue in front of them is not visible here; latency is the signal.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = {**RATE_LIMIT_DEFAULTS, **getattr(settings, 'RATE_LIMIT', {})}
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.durations = deque(maxlen=self.conf['LATENCY_WINDOW'])
+        self.shed_until = 0.0
+
+    def __call__(self, request):
+        if not self.conf['ENABLED']:
+            return self.get_response(request)
+
+        start = time.monotonic()
+        if start < self.shed_until:
+            return self._overloaded(max(self.shed_until - start, 1))
+
+        try:
+            return self.get_response(request)
+        finally:
+            self._record(time.monotonic() - start)
+
+    def _record(self, elapsed: float) -> None:
+        with self.lock:
+            self.durations.append(elapsed)
+            if len(self.durations) < self.conf['LATENCY_MIN_SAMPLES']:
+                return
+            ordered = sorted(self.durations)
+            latency = ordered[max(math.ceil(len(ordered) * self.conf['LATENCY_PERCENTILE']) - 1, 0)]
+            if latency > self.conf['LATENCY_THRESHOLD']:
+                self.shed_until = time.monotonic() + self.conf['SHED_SECONDS']
+                # Start over once the shedding window ends, so recovery is
+                # judged on fresh requests only.
+                self.durations.clear()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.conf['ENABLED']:
+            return None
+
+        cost = self._cost(request)
+        key = self._client_key(request)
+        capacity = self.conf['CAPACITY']
+        rate = self.conf['REFILL_PER_SECOND']
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.conf['MAX_CLIENTS']:
+                self.buckets.popitem(last=False)
+
+        if allowed:
+            return None
+        retry_after = math.ceil((cost - tokens) / rate) if rate > 0 else 60
+        response = JsonResponse({'status': 'error', 'message': 'Too many requests', 'data': None}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def _cost(self, request) -> int:
+        match = request.resolver_match
+        name = match.url_name if match else None
+        if name == 'api_batch' and request.method == 'POST':
+            return self._batch_cost(request)
+        return self._route_cost(name, request.GET)
+
+    def _route_cost(self, name: Optional[str], query) -> int:
+        cost = self.conf['ROUTE_COSTS'].get(name, 1)
+        if name in self.conf['SEARCH_ROUTES'] and query.get('q'):
+            cost += self.conf['SEARCH_COST']
+        return cost
+
+    def _batch_cost(self, request) -> int:
+        try:
+            entries = EntityFactory.build_batch(json.loads(request.body), max_items=batch.MAX_REQUESTS)
+        except ValueError:
+            # Rejected by the view without running anything.
+            return 1
+        cost = 0
+        for entry in entries:
+            url = urlsplit(entry['path'])
+            try:
+                name = resolve(url.path).url_name
+            except Resolver404:
+                name = None
+            cost += self._route_cost(name, QueryDict(url.query))
+        return max(cost, 1)
+
+    def _client_key(self, request) -> str:
+        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+        if auth_header.startswith('Bearer '):
+            token = auth_header.split(' ', 1)[1]
+            try:
+                return f"user:{decode_token(token)['id']}"
+            except Exception:
+                return 'token:' + hashlib.sha1(token.encode()).hexdigest()[:16]
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            user_id = request.session.get('_auth_user_id')
+            if user_id:
+                return f"user:{user_id}"
+        if self.conf['TRUST_X_FORWARDED_FOR'] and request.META.get('HTTP_X_FORWARDED_FOR'):
+            return 'ip:' + request.META['HTTP_X_FORWARDED_FOR'].split(',')[0].strip()
+        return 'ip:' + request.META.get('REMOTE_ADDR', '')
+
+    def _overloaded(self, retry_after: float):
+        response = JsonResponse({'status': 'error', 'message': 'Service overloaded', 'data': None}, status=503)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
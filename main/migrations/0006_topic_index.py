@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_topics(apps, schema_editor):
+    CourseEntry = apps.get_model('main', 'CourseEntry')
+    Topic = apps.get_model('main', 'Topic')
+    CourseTopic = apps.get_model('main', 'CourseTopic')
+
+    topic_ids = {}
+    links = []
+    for course_id, topics in CourseEntry.objects.values_list('id', 'topics').iterator():
+        if isinstance(topics, str):
+            topics = [topics]
+        names = {str(t).strip().lower() for t in (topics or []) if str(t).strip()}
+        for name in names:
+            if name not in topic_ids:
+                topic_ids[name] = Topic.objects.get_or_create(name=name[:100])[0].id
+            links.append(CourseTopic(course_id=course_id, topic_id=topic_ids[name]))
+    CourseTopic.objects.bulk_create(links, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_creditbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Topic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='courseentry',
+            index=models.Index(fields=['instructor'], name='course_instructor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='courseentry',
+            index=models.Index(fields=['price'], name='course_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='coursetopic',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_topics', to='main.courseentry'),
+        ),
+        migrations.AddField(
+            model_name='coursetopic',
+            name='topic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_topics', to='main.topic'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetopic',
+            index=models.Index(fields=['topic', 'course'], name='coursetopic_topic_course_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='coursetopic',
+            unique_together={('course', 'topic')},
+        ),
+        migrations.RunPython(backfill_topics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_invalidationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moduleprogress',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='moduleprogress',
+            name='last_position',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='moduleprogress',
+            name='watched_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ModuleActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.FloatField()),
+                ('watched_seconds', models.FloatField()),
+                ('events', models.PositiveIntegerField()),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.moduleentry')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'module', 'ended_at'], name='activity_user_module_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    CourseEntry = apps.get_model('main', 'CourseEntry')
+    ModuleEntry = apps.get_model('main', 'ModuleEntry')
+    CoursePurchase = apps.get_model('main', 'CoursePurchase')
+
+    def count_of(model):
+        rows = model.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(rows), Value(0))
+
+    CourseEntry.objects.update(module_count=count_of(ModuleEntry), purchase_count=count_of(CoursePurchase))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_revokedcertificate'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='courseentry',
+            name='course_price_idx',
+        ),
+        migrations.AddField(
+            model_name='courseentry',
+            name='module_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='courseentry',
+            name='purchase_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='courseentry',
+            index=models.Index(fields=['price', '-created_at'], name='course_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='courseentry',
+            index=models.Index(fields=['-created_at'], name='course_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='courseentry',
+            index=models.Index(fields=['-purchase_count', '-created_at'], name='course_popular_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
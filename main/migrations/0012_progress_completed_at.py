@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:38
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill_completed_at(apps, schema_editor):
+    # The best record of when a module was completed is its last activity;
+    # rows without any date are treated as completed now.
+    ModuleProgress = apps.get_model('main', 'ModuleProgress')
+    ModuleProgress.objects.filter(is_completed=True).update(
+        completed_at=Coalesce(F('last_activity_at'), Value(timezone.now()))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_changes_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moduleprogress',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
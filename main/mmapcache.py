@@ -0,0 +1,413 @@
+"""
+Django cache backend on a memory-mapped file shared by every process on the host.
+
+The file holds a fixed-size, set-associative hash table. Each key hashes to a
+bucket of WAYS slots; a full bucket evicts with a per-bucket CLOCK sweep over
+the slots' reference bits. Readers never take a lock: every slot carries a
+sequence counter that writers make odd while they modify the slot, and a
+reader retries when it sees an odd or changed counter. Writers serialize with
+a thread lock plus flock() on the file.
+
+A value too large for one slot is split over up to MAX_CHUNKS slots under
+derived keys, and its own slot holds a manifest with the chunk count, length
+and digest. A reader that finds a chunk missing, or chunks from two writes,
+treats the value as a miss. Larger values are not cached; they are counted
+in `oversized` and logged.
+
+Values are pickled, so the file must only be writable by the application:
+it is created with mode 0600 in a 0700 directory, and a file owned by
+another user or readable by others is refused.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GROCACH1'
+# magic, slots, slot size, ways, generation
+FILE_HEADER = struct.Struct('<8sIIII')
+# seq, generation, key hash, expires at, reference bit, flags, key length, value length
+SLOT_HEADER = struct.Struct('<IIQdBBHI')
+SEQ = struct.Struct('<I')
+REF_OFFSET = struct.calcsize('<IIQd')
+# chunk count, value length, value digest
+MANIFEST = struct.Struct('<II16s')
+CHUNKED = 1
+READ_RETRIES = 4
+OPEN_RETRIES = 5
+
+
+def _hash_key(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+def _chunk_key(key: bytes, i: int) -> bytes:
+    # Cache keys never contain NUL, so chunk keys cannot collide with them.
+    return b'%s\0%d' % (key, i)
+
+
+class MmapCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._slots = int(options.get('SLOTS', 16384))
+        self._slot_size = int(options.get('SLOT_SIZE', 4096))
+        self._ways = int(options.get('WAYS', 8))
+        self._max_chunks = int(options.get('MAX_CHUNKS', 32))
+        if self._slots % self._ways:
+            raise ValueError("SLOTS must be a multiple of WAYS")
+        self._buckets = self._slots // self._ways
+        self._hands_offset = FILE_HEADER.size
+        self._slots_offset = self._hands_offset + self._buckets
+        self._size = self._slots_offset + self._slots * self._slot_size
+        self._lock = threading.Lock()
+        self._fd = None
+        self._mm = None
+        self._pid = None
+        self.oversized = 0
+
+    # -- file management -------------------------------------------------
+
+    def _map(self) -> mmap.mmap:
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+        with self._lock:
+            if self._mm is None or self._pid != os.getpid():
+                if self._fd is not None:
+                    # Inherited across a fork: the child opens its own.
+                    os.close(self._fd)
+                    self._fd = None
+                fd = self._open()
+                self._fd = fd
+                self._mm = mmap.mmap(fd, self._size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                self._pid = os.getpid()
+        return self._mm
+
+    def _open(self) -> int:
+        """
+        Opens the cache file with this geometry, creating it if needed, and
+        returns its descriptor. Values are unpickled from this file, so it
+        must belong to the current user and be private to it.
+        """
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        for _ in range(OPEN_RETRIES):
+            try:
+                fd = os.open(self._path, os.O_RDWR | os.O_NOFOLLOW)
+            except FileNotFoundError:
+                self._create(directory, replace=None)
+                continue
+            try:
+                stat = os.fstat(fd)
+                if stat.st_uid != os.geteuid() or stat.st_mode & 0o077:
+                    raise ImproperlyConfigured(
+                        f"Cache file {self._path} must be owned by this user and not accessible to others"
+                    )
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if self._path_is(fd) and self._valid(fd):
+                        return fd
+                    if self._path_is(fd):
+                        # A different geometry: swap in a new file. Processes
+                        # still mapping the old one keep using it.
+                        self._create(directory, replace=fd)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+        raise ImproperlyConfigured(f"Could not open cache file {self._path}")
+
+    def _path_is(self, fd: int) -> bool:
+        try:
+            return os.stat(self._path, follow_symlinks=False).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _valid(self, fd: int) -> bool:
+        header = os.pread(fd, FILE_HEADER.size, 0)
+        return (
+            os.fstat(fd).st_size == self._size
+            and len(header) == FILE_HEADER.size
+            and FILE_HEADER.unpack(header)[:4] == (MAGIC, self._slots, self._slot_size, self._ways)
+        )
+
+    def _create(self, directory: str, replace) -> None:
+        """
+        Writes a fully initialised (sparse) file next to the cache file and
+        moves it into place. Without replace it only appears if no file
+        exists yet; with replace (the locked descriptor of the current file)
+        it takes that file's place.
+        """
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.cache-')
+        try:
+            os.ftruncate(fd, self._size)
+            os.pwrite(fd, FILE_HEADER.pack(MAGIC, self._slots, self._slot_size, self._ways, 1), 0)
+            if replace is None:
+                try:
+                    os.link(tmp, self._path)
+                except FileExistsError:
+                    pass
+            else:
+                os.replace(tmp, self._path)
+        finally:
+            os.close(fd)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _generation(self, mm) -> int:
+        return FILE_HEADER.unpack_from(mm, 0)[4]
+
+    def _slot_offset(self, index: int) -> int:
+        return self._slots_offset + index * self._slot_size
+
+    def _bucket_slots(self, key_hash: int):
+        first = (key_hash % self._buckets) * self._ways
+        return range(first, first + self._ways)
+
+    # -- lock-free read path ---------------------------------------------
+
+    def _read_slot(self, mm, index: int, key: bytes, key_hash: int):
+        """
+        Returns (found, expires, flags, value_bytes) for the slot if it holds key.
+        """
+        off = self._slot_offset(index)
+        for _ in range(READ_RETRIES):
+            seq, gen, h, expires, _, flags, klen, vlen = SLOT_HEADER.unpack_from(mm, off)
+            if seq & 1:
+                continue
+            if h != key_hash:
+                return False, 0, 0, None
+            start = off + SLOT_HEADER.size
+            data = mm[start:start + klen + vlen]
+            if SEQ.unpack_from(mm, off)[0] != seq:
+                continue
+            if gen != self._generation(mm) or data[:klen] != key:
+                return False, 0, 0, None
+            return True, expires, flags, data[klen:]
+        return False, 0, 0, None
+
+    def _lookup_slot(self, mm, key: bytes):
+        key_hash = _hash_key(key)
+        for index in self._bucket_slots(key_hash):
+            found, expires, flags, value = self._read_slot(mm, index, key, key_hash)
+            if found:
+                if expires and expires <= time.time():
+                    return None
+                mm[self._slot_offset(index) + REF_OFFSET] = 1
+                return flags, value
+        return None
+
+    def _lookup(self, key: bytes):
+        mm = self._map()
+        found = self._lookup_slot(mm, key)
+        if found is None:
+            return None
+        flags, value = found
+        if not flags & CHUNKED:
+            return value
+        count, length, digest = MANIFEST.unpack(value)
+        chunks = []
+        for i in range(count):
+            chunk = self._lookup_slot(mm, _chunk_key(key, i))
+            if chunk is None:
+                return None
+            chunks.append(chunk[1])
+        value = b''.join(chunks)
+        # Chunks are read without the lock and may come from two writes.
+        if len(value) != length or hashlib.blake2b(value, digest_size=16).digest() != digest:
+            return None
+        return value
+
+    # -- locked write path -----------------------------------------------
+
+    @contextlib.contextmanager
+    def _locked(self):
+        mm = self._map()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield mm
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write_slot(self, mm, index: int, key_hash: int, expires: float, key: bytes, value: bytes, flags: int = 0):
+        off = self._slot_offset(index)
+        seq = SEQ.unpack_from(mm, off)[0]
+        SEQ.pack_into(mm, off, seq + 1)
+        start = off + SLOT_HEADER.size
+        mm[start:start + len(key) + len(value)] = key + value
+        SLOT_HEADER.pack_into(
+            mm, off, seq + 1, self._generation(mm), key_hash, expires, 1, flags, len(key), len(value)
+        )
+        SEQ.pack_into(mm, off, seq + 2)
+
+    def _clear_slot(self, mm, index: int):
+        off = self._slot_offset(index)
+        seq = SEQ.unpack_from(mm, off)[0]
+        SEQ.pack_into(mm, off, seq + 1)
+        SLOT_HEADER.pack_into(mm, off, seq + 1, 0, 0, 0.0, 0, 0, 0, 0)
+        SEQ.pack_into(mm, off, seq + 2)
+
+    def _drop_chunks(self, mm, index: int, key: bytes):
+        """
+        Clears the chunks of the value in key's slot, if it is chunked. Must
+        be called with the write lock held.
+        """
+        found, _, flags, value = self._read_slot(mm, index, key, _hash_key(key))
+        if not found or not flags & CHUNKED:
+            return
+        for i in range(MANIFEST.unpack(value)[0]):
+            chunk_key = _chunk_key(key, i)
+            chunk_hash = _hash_key(chunk_key)
+            for chunk_index in self._bucket_slots(chunk_hash):
+                if self._read_slot(mm, chunk_index, chunk_key, chunk_hash)[0]:
+                    self._clear_slot(mm, chunk_index)
+
+    def _find_slot(self, mm, key: bytes, key_hash: int):
+        """
+        Returns (index, live) for key's slot, or for the slot to evict.
+        Must be called with the write lock held.
+        """
+        gen = self._generation(mm)
+        now = time.time()
+        free = None
+        for index in self._bucket_slots(key_hash):
+            off = self._slot_offset(index)
+            _, slot_gen, h, expires, _, _, klen, _ = SLOT_HEADER.unpack_from(mm, off)
+            live = h != 0 and slot_gen == gen and not (expires and expires <= now)
+            if h == key_hash and slot_gen == gen:
+                start = off + SLOT_HEADER.size
+                if mm[start:start + klen] == key:
+                    return index, live
+            if not live and free is None:
+                free = index
+        if free is not None:
+            return free, False
+        return self._clock_victim(mm, key_hash), False
+
+    def _clock_victim(self, mm, key_hash: int) -> int:
+        bucket = key_hash % self._buckets
+        slots = self._bucket_slots(key_hash)
+        hand = mm[self._hands_offset + bucket] % self._ways
+        while True:
+            index = slots[hand]
+            ref_at = self._slot_offset(index) + REF_OFFSET
+            hand = (hand + 1) % self._ways
+            if mm[ref_at]:
+                mm[ref_at] = 0
+                continue
+            mm[self._hands_offset + bucket] = hand
+            return index
+
+    def _split(self, key: bytes, value: bytes):
+        """
+        Returns value's chunks, [] if it fits in one slot, or None if it
+        needs more than MAX_CHUNKS.
+        """
+        if SLOT_HEADER.size + len(key) + len(value) <= self._slot_size:
+            return []
+        longest_key = len(_chunk_key(key, self._max_chunks - 1))
+        room = self._slot_size - SLOT_HEADER.size - longest_key
+        if room <= 0 or SLOT_HEADER.size + len(key) + MANIFEST.size > self._slot_size:
+            return None
+        chunks = [value[i:i + room] for i in range(0, len(value), room)]
+        return chunks if len(chunks) <= self._max_chunks else None
+
+    def _store(self, key: str, value, timeout, only_if_missing: bool = False) -> bool:
+        kb = key.encode()
+        vb = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        key_hash = _hash_key(kb)
+        expires = self.get_backend_timeout(timeout)
+        expires = float(expires) if expires is not None else 0.0
+        chunks = self._split(kb, vb)
+        if chunks is None:
+            self.oversized += 1
+            logger.warning("Not caching %s: %d bytes do not fit in %d slots of %d bytes",
+                           key, len(vb), self._max_chunks, self._slot_size)
+        with self._locked() as mm:
+            index, live = self._find_slot(mm, kb, key_hash)
+            if only_if_missing and live:
+                return False
+            if live:
+                self._drop_chunks(mm, index, kb)
+            if chunks is None:
+                if live:
+                    self._clear_slot(mm, index)
+                return False
+            if not chunks:
+                self._write_slot(mm, index, key_hash, expires, kb, vb)
+                return True
+            for i, chunk in enumerate(chunks):
+                chunk_key = _chunk_key(kb, i)
+                chunk_hash = _hash_key(chunk_key)
+                chunk_index, _ = self._find_slot(mm, chunk_key, chunk_hash)
+                self._write_slot(mm, chunk_index, chunk_hash, expires, chunk_key, chunk)
+            # A chunk may have taken the key's own slot; look it up again.
+            index, _ = self._find_slot(mm, kb, key_hash)
+            manifest = MANIFEST.pack(len(chunks), len(vb), hashlib.blake2b(vb, digest_size=16).digest())
+            self._write_slot(mm, index, key_hash, expires, kb, manifest, flags=CHUNKED)
+            return True
+
+    # -- BaseCache API ---------------------------------------------------
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._store(key, value, timeout, only_if_missing=True)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._lookup(key.encode())
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._store(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value = self._lookup(key.encode())
+        if value is None:
+            return False
+        return self._store(key, pickle.loads(value), timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        kb = key.encode()
+        key_hash = _hash_key(kb)
+        with self._locked() as mm:
+            index, live = self._find_slot(mm, kb, key_hash)
+            if not live:
+                return False
+            self._drop_chunks(mm, index, kb)
+            self._clear_slot(mm, index)
+            return True
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._lookup(key.encode()) is not None
+
+    def clear(self):
+        with self._locked() as mm:
+            magic, slots, slot_size, ways, gen = FILE_HEADER.unpack_from(mm, 0)
+            FILE_HEADER.pack_into(mm, 0, magic, slots, slot_size, ways, (gen + 1) & 0xFFFFFFFF or 1)
+
+    def close(self, **kwargs):
+        # The mapping is kept for the life of the process; Django calls
+        # close() at the end of every request.
+        pass
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 import uuid
 
 class CustomUser(AbstractUser):
@@ -16,9 +17,39 @@ class CourseEntry(models.Model):
     topics = models.JSONField()
     price = models.IntegerField()
     thumbnail_image = models.URLField(blank=True, null=True)
+    # Maintained by the repositories and purchase strategies; repaired by
+    # the reconcile_counters command.
+    module_count = models.PositiveIntegerField(default=0)
+    purchase_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    COUNTER_FIELDS = ('module_count', 'purchase_count')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['instructor'], name='course_instructor_idx'),
+            models.Index(fields=['price', '-created_at'], name='course_price_idx'),
+            models.Index(fields=['-created_at'], name='course_newest_idx'),
+            models.Index(fields=['-purchase_count', '-created_at'], name='course_popular_idx'),
+            models.Index(fields=['updated_at', 'id'], name='course_updated_idx'),
+        ]
+
+
+class Topic(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+
+class CourseTopic(models.Model):
+    course = models.ForeignKey(CourseEntry, on_delete=models.CASCADE, related_name='course_topics')
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='course_topics')
+
+    class Meta:
+        unique_together = ('course', 'topic')
+        indexes = [
+            models.Index(fields=['topic', 'course'], name='coursetopic_topic_course_idx'),
+        ]
+
 class CoursePurchase(models.Model):
     user = models.ForeignKey('CustomUser', on_delete=models.CASCADE)
     course = models.ForeignKey('CourseEntry', on_delete=models.CASCADE)
@@ -38,11 +69,127 @@ class ModuleEntry(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='module_updated_idx'),
+        ]
+
 class ModuleProgress(models.Model):
     user = models.ForeignKey('CustomUser', on_delete=models.CASCADE)
     module = models.ForeignKey('ModuleEntry', on_delete=models.CASCADE)
     is_completed = models.BooleanField(default=False)
+    last_position = models.FloatField(default=0)
+    watched_seconds = models.FloatField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    # When the module was first completed; certificates carry the latest
+    # of these for a course.
+    completed_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('user', 'module')
 
+
+class ModuleActivity(models.Model):
+    """
+    Append-only log of learning activity. Each row is the heartbeats one
+    worker received for a (user, module) pair within one flush interval.
+    """
+    user = models.ForeignKey('CustomUser', on_delete=models.CASCADE)
+    module = models.ForeignKey('ModuleEntry', on_delete=models.CASCADE)
+    position = models.FloatField()
+    watched_seconds = models.FloatField()
+    events = models.PositiveIntegerField()
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'module', 'ended_at'], name='activity_user_module_idx'),
+        ]
+
+
+class Job(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    lock_token = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+
+class CreditBatch(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=200, blank=True, default='')
+    user_ids = models.JSONField(blank=True, null=True)
+    max_user_id = models.BigIntegerField(default=0)
+    cursor = models.BigIntegerField(default=0)
+    applied_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created_by = models.ForeignKey('CustomUser', on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+
+class InvalidationEvent(models.Model):
+    entity = models.CharField(max_length=30)
+    entity_id = models.CharField(max_length=64)
+    origin = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class RevokedCertificate(models.Model):
+    """
+    Revokes every certificate issued to a user for a course. Plain ids rather
+    than foreign keys, so a revocation outlives the rows it refers to.
+    """
+    user_id = models.IntegerField()
+    course_id = models.UUIDField()
+    reason = models.CharField(max_length=255, blank=True, default='')
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user_id', 'course_id')
+
+
+class Tombstone(models.Model):
+    """
+    A deleted course or module, kept so delta sync clients learn about the
+    deletion. course_id is the course itself for a course tombstone.
+    """
+    entity = models.CharField(max_length=30)
+    entity_id = models.UUIDField()
+    course_id = models.UUIDField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ]
@@ -0,0 +1,181 @@
+"""
+"Learners who bought this also bought" recommendations.
+
+build() runs offline (manage.py build_recommendations). It streams every
+purchase into a sparse user x course matrix, computes cosine similarity
+between courses in dense batches of rows, and writes the top-k neighbours
+of every course to RECOMMENDATIONS_PATH. NumPy and SciPy are only imported
+there.
+
+At serve time the file is memory-mapped and read with struct, so a lookup
+is a binary search over the sorted course ids plus two row reads, with no
+database access. Workers pick up a rebuilt file on their next lookup after
+RECOMMENDATIONS_RELOAD_INTERVAL seconds.
+
+File layout, little endian:
+    header   8s magic, uint32 course count n, uint32 neighbours per course k
+    ids      n x 16 bytes, course UUIDs in ascending byte order
+    indexes  n x k int32, rows into ids, -1 where there are fewer than k
+    scores   n x k float32, cosine similarity, descending per row
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from main.repositories import CourseRepository, PurchaseRepository
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GRREC\x00\x00\x01'
+HEADER = struct.Struct('<8sII')
+ID_BYTES = 16
+
+
+def _path() -> str:
+    return str(settings.RECOMMENDATIONS_PATH)
+
+
+def build(path: Optional[str] = None, top_k: int = 20, batch_size: int = 256, min_support: int = 1) -> Dict[str, int]:
+    import numpy as np
+    from scipy import sparse
+
+    course_keys = sorted(cid.bytes for cid in CourseRepository.all_ids())
+    column = {uuid.UUID(bytes=key): i for i, key in enumerate(course_keys)}
+    n = len(course_keys)
+
+    user_ids: List[int] = []
+    columns: List[int] = []
+    for user_id, course_id in PurchaseRepository.iter_pairs():
+        if course_id in column:
+            user_ids.append(user_id)
+            columns.append(column[course_id])
+    _, rows = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+    cols = np.asarray(columns, dtype=np.int32)
+    n_users = int(rows.max()) + 1 if len(rows) else 0
+
+    # Binary purchases: the (user, course) pair is unique.
+    purchases = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.float32), (rows, cols)), shape=(n_users, n)
+    )
+    by_course = purchases.T.tocsr()
+    degree = np.asarray(purchases.sum(axis=0), dtype=np.float32).ravel()
+    norm = np.sqrt(degree)
+    norm[norm == 0] = 1
+
+    k = max(min(top_k, n - 1), 0)
+    indexes = np.full((n, top_k), -1, dtype='<i4')
+    scores = np.zeros((n, top_k), dtype='<f4')
+    for start in range(0, n if k else 0, batch_size):
+        end = min(start + batch_size, n)
+        co = (by_course[start:end] @ purchases).toarray()
+        co[np.arange(end - start), np.arange(start, end)] = 0
+        co[co < min_support] = 0
+        sim = co / norm[start:end, None] / norm[None, :]
+
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        top_sim = np.take_along_axis(sim, top, axis=1)
+        order = np.argsort(-top_sim, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_sim = np.take_along_axis(top_sim, order, axis=1)
+        top[top_sim <= 0] = -1
+        top_sim[top_sim <= 0] = 0
+        indexes[start:end, :k] = top
+        scores[start:end, :k] = top_sim
+
+    path = str(path or _path())
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # mkstemp creates the file itself, so a name planted in the directory
+    # cannot redirect the write.
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, n, top_k))
+            f.write(b''.join(course_keys))
+            f.write(indexes.tobytes())
+            f.write(scores.tobytes())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return {'courses': n, 'users': n_users, 'purchases': len(cols), 'neighbours': top_k}
+
+
+class RecommendationIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (map, course count, neighbours per course), swapped as one value.
+        self.current: Optional[Tuple[mmap.mmap, int, int]] = None
+        self.identity: Optional[Tuple[int, int]] = None
+        self.checked = 0.0
+
+    def _current(self) -> Optional[Tuple[mmap.mmap, int, int]]:
+        now = time.monotonic()
+        if now - self.checked < getattr(settings, 'RECOMMENDATIONS_RELOAD_INTERVAL', 5):
+            return self.current
+        with self.lock:
+            self.checked = now
+            try:
+                stat = os.stat(_path())
+            except FileNotFoundError:
+                self.current, self.identity = None, None
+                return None
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            if identity != self.identity:
+                try:
+                    self._open(identity)
+                except (OSError, ValueError, struct.error):
+                    logger.exception("Could not load recommendations, keeping the previous ones")
+                    self.identity = identity
+            return self.current
+
+    def _open(self, identity: Tuple[int, int]) -> None:
+        with open(_path(), 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, k = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or len(mm) != HEADER.size + n * (ID_BYTES + 8 * k):
+            mm.close()
+            raise ValueError(f"{_path()} is not a recommendations file")
+        # Readers still holding the previous map keep it alive until done.
+        self.current, self.identity = (mm, n, k), identity
+
+    def similar(self, course_id: Any, limit: int = 10) -> List[Dict[str, Any]]:
+        current = self._current()
+        if current is None:
+            return []
+        mm, n, k = current
+        try:
+            key = uuid.UUID(str(course_id)).bytes
+        except ValueError:
+            return []
+
+        ids_at = HEADER.size
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[ids_at + mid * ID_BYTES:ids_at + (mid + 1) * ID_BYTES] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == n or mm[ids_at + lo * ID_BYTES:ids_at + (lo + 1) * ID_BYTES] != key:
+            return []
+
+        count = min(limit, k)
+        indexes_at = ids_at + n * ID_BYTES + lo * k * 4
+        scores_at = ids_at + n * ID_BYTES + n * k * 4 + lo * k * 4
+        indexes = struct.unpack_from(f'<{count}i', mm, indexes_at)
+        scores = struct.unpack_from(f'<{count}f', mm, scores_at)
+        return [
+            {'course_id': str(uuid.UUID(bytes=mm[ids_at + j * ID_BYTES:ids_at + (j + 1) * ID_BYTES])), 'score': round(s, 4)}
+            for j, s in zip(indexes, scores) if j >= 0
+        ]
+
+
+index = RecommendationIndex()
@@ -1,13 +1,27 @@
+import datetime
+import uuid
 from typing import Tuple, List, Optional, Dict, Any
 from django.db import transaction
-from django.db.models import Q, QuerySet
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from main.models import (
     CourseEntry,
+    CourseTopic,
+    Topic,
     ModuleEntry,
     CustomUser,
     ModuleProgress,
+    ModuleActivity,
     CoursePurchase,
+    Job,
+    CreditBatch,
+    RevokedCertificate,
+    Tombstone,
 )
+from main import entity_cache, invalidation
+from main.db import retry_on_locked
+from main.tracing import traced
 
 
 def _paginate(qs: QuerySet, page: int, limit: int) -> Tuple[List[Any], int]:
@@ -17,96 +31,341 @@ def _paginate(qs: QuerySet, page: int, limit: int) -> Tuple[List[Any], int]:
     return list(qs[start:end]), total
 
 
+def _after(qs: QuerySet, field: str, position: Optional[Tuple[Any, Any]], limit: int) -> List[Any]:
+    """
+    Up to limit rows ordered by (field, id) that come after position, a
+    (value, id) pair, or from the start when position is None.
+    """
+    if position is not None:
+        value, pk = position
+        qs = qs.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+    return list(qs.order_by(field, 'id')[:limit])
+
+
+def normalize_topics(topics: Any) -> List[str]:
+    if isinstance(topics, str):
+        topics = [topics]
+    names: List[str] = []
+    for t in topics or []:
+        name = str(t).strip().lower()[:100]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _course_queryset(q: str = '', topic: Optional[str] = None, instructor: Optional[str] = None,
+                     min_price: Optional[int] = None, max_price: Optional[int] = None) -> QuerySet:
+    qs = CourseEntry.objects.all()
+    if q:
+        topic_match = CourseTopic.objects.filter(course=OuterRef('pk'), topic__name__icontains=q.strip().lower())
+        qs = qs.filter(
+            Q(title__icontains=q) |
+            Q(instructor__icontains=q) |
+            Exists(topic_match)
+        )
+    if topic:
+        qs = qs.filter(course_topics__topic__name=topic.strip().lower())
+    if instructor:
+        qs = qs.filter(instructor=instructor)
+    if min_price is not None:
+        qs = qs.filter(price__gte=min_price)
+    if max_price is not None:
+        qs = qs.filter(price__lte=max_price)
+    return qs
+
+
+# Each ordering matches one of the CourseEntry indexes.
+COURSE_ORDERINGS = {
+    'newest': ('-created_at',),
+    'popular': ('-purchase_count', '-created_at'),
+    'price': ('price', '-created_at'),
+}
+
+
+@traced
 class CourseRepository:
     @staticmethod
-    def list(q: str = '', page: int = 1, limit: int = 15) -> Tuple[List[CourseEntry], int]:
-        qs = CourseEntry.objects.all()  
-        if q:  
-            qs = qs.filter(
-                Q(title__icontains=q) |
-                Q(instructor__icontains=q) |
-                Q(topics__icontains=q)
-            )
-        qs = qs.order_by('-created_at')
+    def list(q: str = '', page: int = 1, limit: int = 15, columns: Optional[List[str]] = None,
+             sort: str = 'newest', **filters) -> Tuple[List[CourseEntry], int]:
+        qs = _course_queryset(q, **filters).order_by(*COURSE_ORDERINGS[sort])
+        if columns is not None:
+            qs = qs.only(*columns)
         return _paginate(qs, page, limit)
 
+    @staticmethod
+    def facets(q: str = '', limit: int = 20, **filters) -> Dict[str, Any]:
+        """
+        Facet counts over the filtered catalog, grouped on the topic and
+        instructor indexes rather than by loading the matching courses.
+        """
+        qs = _course_queryset(q, **filters)
+        topics = (
+            CourseTopic.objects.filter(course__in=qs.values('pk'))
+            .values('topic__name')
+            .annotate(count=Count('course_id'))
+            .order_by('-count', 'topic__name')[:limit]
+        )
+        instructors = (
+            qs.values('instructor')
+            .annotate(count=Count('id'))
+            .order_by('-count', 'instructor')[:limit]
+        )
+        prices = qs.aggregate(min=Min('price'), max=Max('price'))
+        return {
+            'topics': [{'value': t['topic__name'], 'count': t['count']} for t in topics],
+            'instructors': [{'value': i['instructor'], 'count': i['count']} for i in instructors],
+            'price': prices,
+        }
+
     @staticmethod
     def get(course_id: str) -> Optional[CourseEntry]:
-        return CourseEntry.objects.filter(id=course_id).first()
+        return entity_cache.get('course', course_id, lambda: CourseEntry.objects.filter(id=course_id).first())
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def create(data: Dict[str, Any]) -> CourseEntry:
-        return CourseEntry.objects.create(**data)
+        course = CourseEntry.objects.create(**data)
+        CourseRepository.sync_topics(course)
+        invalidation.publish('course', course.id)
+        return course
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def update(course: CourseEntry, data: Dict[str, Any]) -> CourseEntry:
         for k, v in data.items():
             setattr(course, k, v)
-        course.save()
+        # The instance may come from the entity cache; never write its
+        # possibly stale counters back.
+        course.save(update_fields=[
+            f.name for f in CourseEntry._meta.concrete_fields
+            if not f.primary_key and f.name not in CourseEntry.COUNTER_FIELDS
+        ])
+        if 'topics' in data:
+            CourseRepository.sync_topics(course)
+        invalidation.publish('course', course.id)
         return course
 
     @staticmethod
+    def all_ids() -> List[Any]:
+        return list(CourseEntry.objects.values_list('id', flat=True))
+
+    @staticmethod
+    def get_many(course_ids: List[Any]) -> Dict[str, CourseEntry]:
+        return {str(pk): course for pk, course in CourseEntry.objects.in_bulk(course_ids).items()}
+
+    @staticmethod
+    def iter_text(chunk_size: int = 2000):
+        return CourseEntry.objects.values_list('id', 'title', 'description', 'topics').iterator(chunk_size=chunk_size)
+
+    @staticmethod
+    def adjust_counters(course_id: Any, modules: int = 0, purchases: int = 0) -> None:
+        """
+        Applies counter deltas in SQL. Call inside the transaction that makes
+        the change being counted.
+        """
+        changes = {
+            'module_count': F('module_count') + modules,
+            'purchase_count': F('purchase_count') + purchases,
+        }
+        if modules:
+            # The module count is catalog content for delta sync; purchases
+            # are not, and would make every sale a course change.
+            changes['updated_at'] = timezone.now()
+        CourseEntry.objects.filter(pk=course_id).update(**changes)
+        invalidation.publish('course.counters', course_id)
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def recount_purchases(course_id: Any) -> None:
+        """
+        Sets the purchase counter from the purchase table, so a job that runs
+        twice or out of order still leaves the right count.
+        """
+        purchases = (
+            CoursePurchase.objects.filter(course_id=OuterRef('pk')).order_by()
+            .values('course_id').annotate(n=Count('id')).values('n')
+        )
+        CourseEntry.objects.filter(pk=course_id).update(purchase_count=Coalesce(Subquery(purchases), 0))
+        invalidation.publish('course.counters', course_id)
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def reconcile_counters(dry_run: bool = False) -> List[Dict[str, Any]]:
+        """
+        Recounts modules and purchases for every course and repairs the
+        counters that drifted. Returns the drifted courses.
+        """
+        drifted = []
+        rows = CourseEntry.objects.annotate(
+            actual_modules=Count('modules', distinct=True),
+            actual_purchases=Count('coursepurchase', distinct=True),
+        ).values_list('id', 'module_count', 'actual_modules', 'purchase_count', 'actual_purchases')
+        for course_id, modules, actual_modules, purchases, actual_purchases in rows.iterator():
+            if (modules, purchases) == (actual_modules, actual_purchases):
+                continue
+            drifted.append({
+                'course_id': course_id,
+                'module_count': (modules, actual_modules),
+                'purchase_count': (purchases, actual_purchases),
+            })
+            if not dry_run:
+                CourseEntry.objects.filter(pk=course_id).update(
+                    module_count=actual_modules, purchase_count=actual_purchases
+                )
+                invalidation.publish('course.counters', course_id)
+        return drifted
+
+    @staticmethod
+    def sync_topics(course: CourseEntry) -> None:
+        names = normalize_topics(course.topics)
+        if names:
+            Topic.objects.bulk_create([Topic(name=n) for n in names], ignore_conflicts=True)
+        topic_ids = set(Topic.objects.filter(name__in=names).values_list('id', flat=True))
+        existing = set(CourseTopic.objects.filter(course=course).values_list('topic_id', flat=True))
+        stale = existing - topic_ids
+        if stale:
+            CourseTopic.objects.filter(course=course, topic_id__in=stale).delete()
+        CourseTopic.objects.bulk_create(
+            [CourseTopic(course=course, topic_id=tid) for tid in topic_ids - existing],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def delete(course: CourseEntry) -> None:
+        module_ids = list(ModuleEntry.objects.filter(course=course).values_list('id', flat=True))
+        invalidation.publish('course', course.id)
+        # The cascade deletes the modules without going through their delete.
+        invalidation.publish_many('module', module_ids)
+        TombstoneRepository.record([('course', course.id)] + [('module', mid) for mid in module_ids], course.id)
         course.delete()
 
+    @staticmethod
+    def changed_after(position: Optional[Tuple[Any, Any]], limit: int) -> List[CourseEntry]:
+        return _after(CourseEntry.objects.all(), 'updated_at', position, limit)
+
 
+@traced
 class ModuleRepository:
     @staticmethod
-    def list_by_course(course: CourseEntry, page: int = 1, limit: int = 15) -> Tuple[List[ModuleEntry], int]:
+    def list_by_course(course: CourseEntry, page: int = 1, limit: int = 15,
+                       columns: Optional[List[str]] = None) -> Tuple[List[ModuleEntry], int]:
         qs = ModuleEntry.objects.filter(course=course).order_by('order', 'created_at')
+        if columns is not None:
+            qs = qs.only(*columns)
         return _paginate(qs, page, limit)
 
+    @staticmethod
+    def list_with_completion(course: CourseEntry, user: Optional[CustomUser]) -> List[ModuleEntry]:
+        """
+        All modules of the course in order, each annotated with is_completed
+        for the given user, in a single query.
+        """
+        if user is None:
+            completed = Value(False)
+        else:
+            completed = Exists(ModuleProgress.objects.filter(module=OuterRef('pk'), user=user, is_completed=True))
+        qs = ModuleEntry.objects.filter(course=course).annotate(is_completed=completed).order_by('order', 'created_at')
+        return list(qs)
+
     @staticmethod
     def get(module_id: str) -> Optional[ModuleEntry]:
-        return ModuleEntry.objects.filter(id=module_id).first()
+        def load():
+            module = ModuleEntry.objects.select_related('course').filter(id=module_id).first()
+            if module is not None:
+                entity_cache.prime('course', module.course)
+            return module
+
+        module = entity_cache.get('module', module_id, load)
+        if module is not None and not ModuleEntry.course.is_cached(module):
+            module.course = CourseRepository.get(module.course_id)
+        return module
 
     @staticmethod
+    def course_ids_for(module_ids: List[Any]) -> Dict[Any, Any]:
+        return dict(ModuleEntry.objects.filter(id__in=module_ids).values_list('id', 'course_id'))
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def create(course: CourseEntry, data: Dict[str, Any]) -> ModuleEntry:
         data['course'] = course
-        return ModuleEntry.objects.create(**data)
+        module = ModuleEntry.objects.create(**data)
+        CourseRepository.adjust_counters(course.id, modules=1)
+        invalidation.publish('module', module.id)
+        return module
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def update(module: ModuleEntry, data: Dict[str, Any]) -> ModuleEntry:
         for k, v in data.items():
             setattr(module, k, v)
         module.save()
+        invalidation.publish('module', module.id)
         return module
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def delete(module: ModuleEntry) -> None:
+        invalidation.publish('module', module.id)
+        CourseRepository.adjust_counters(module.course_id, modules=-1)
+        TombstoneRepository.record([('module', module.id)], module.course_id)
         module.delete()
 
     @staticmethod
+    def changed_after(position: Optional[Tuple[Any, Any]], limit: int) -> List[ModuleEntry]:
+        return _after(ModuleEntry.objects.all(), 'updated_at', position, limit)
+
+    @staticmethod
+    @retry_on_locked
     @transaction.atomic
     def reorder(course: CourseEntry, module_order: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         module_order: [{'id': '<module_id>', 'order': 1}, ...]
         Returns list of {'id': ..., 'order': ...} that were updated.
         """
-        result = []
+        new_orders = {}
         for item in module_order:
             mid = item.get('id')
             new_order = item.get('order')
             if mid is None or new_order is None:
                 continue
-            module = ModuleEntry.objects.filter(id=mid, course=course).first()
-            if module:
-                module.order = new_order
-                module.save()
-                result.append({'id': str(module.id), 'order': module.order})
-        return result
-
-
+            new_orders[str(mid)] = new_order
+        modules = list(ModuleEntry.objects.filter(id__in=list(new_orders), course=course))
+        now = timezone.now()
+        for module in modules:
+            module.order = new_orders[str(module.id)]
+            module.updated_at = now
+        ModuleEntry.objects.bulk_update(modules, ['order', 'updated_at'])
+        invalidation.publish_many('module', [module.id for module in modules])
+        position = {mid: i for i, mid in enumerate(new_orders)}
+        modules.sort(key=lambda module: position[str(module.id)])
+        return [{'id': str(module.id), 'order': module.order} for module in modules]
+
+
+@traced
 class UserRepository:
     @staticmethod
     def get_by_id(user_id: str) -> Optional[CustomUser]:
-        return CustomUser.objects.filter(id=user_id).first()
+        return entity_cache.get('user', user_id, lambda: CustomUser.objects.filter(id=user_id).first())
+
+    @staticmethod
+    def existing_ids(user_ids: List[Any]) -> List[int]:
+        return list(CustomUser.objects.filter(id__in=user_ids).values_list('id', flat=True))
 
     @staticmethod
     def get_by_username_or_email(username_or_email: str) -> Optional[CustomUser]:
         return CustomUser.objects.filter(Q(username=username_or_email) | Q(email=username_or_email)).first()
 
     @staticmethod
+    @retry_on_locked
     def create_user(data: Dict[str, Any]) -> CustomUser:
         password = data.pop('password', None)
         user = CustomUser.objects.create(**{k: v for k, v in data.items() if k != 'password'})
@@ -116,6 +375,8 @@ class UserRepository:
         return user
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def update(user: CustomUser, data: Dict[str, Any]) -> CustomUser:
         password = data.pop('password', None)
         for k, v in data.items():
@@ -123,53 +384,196 @@ class UserRepository:
         if password:
             user.set_password(password)
         user.save()
+        invalidation.publish('user', user.id)
         return user
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def delete(user: CustomUser) -> None:
+        invalidation.publish('user', user.id)
         user.delete()
 
     @staticmethod
-    def list(q: str = '', page: int = 1, limit: int = 15) -> Tuple[List[CustomUser], int]:
+    def list(q: str = '', page: int = 1, limit: int = 15,
+             columns: Optional[List[str]] = None) -> Tuple[List[CustomUser], int]:
         qs = CustomUser.objects.filter(
             Q(username__icontains=q) | Q(email__icontains=q) | Q(first_name__icontains=q) | Q(last_name__icontains=q)
         ).order_by('-date_joined')
+        if columns is not None:
+            qs = qs.only(*columns)
         return _paginate(qs, page, limit)
 
     @staticmethod
+    @retry_on_locked
+    @transaction.atomic
     def change_balance(user: CustomUser, delta: int) -> CustomUser:
-        user.balance = int(user.balance or 0) + int(delta)
-        user.save()
+        CustomUser.objects.filter(pk=user.pk).update(balance=F('balance') + int(delta))
+        user.refresh_from_db(fields=['balance'])
+        invalidation.publish('user', user.id)
         return user
 
 
+@traced
+class CreditRepository:
+    @staticmethod
+    @retry_on_locked
+    def create_batch(delta: int, user_ids: Optional[List[int]] = None, reason: str = '',
+                     created_by: Optional[CustomUser] = None) -> CreditBatch:
+        max_user_id = CustomUser.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        return CreditBatch.objects.create(
+            delta=delta,
+            user_ids=sorted(set(user_ids)) if user_ids is not None else None,
+            max_user_id=max_user_id,
+            reason=reason,
+            created_by=created_by,
+        )
+
+    @staticmethod
+    def get(batch_id: str) -> Optional[CreditBatch]:
+        return CreditBatch.objects.filter(id=batch_id).first()
+
+    @staticmethod
+    def list_pending() -> List[CreditBatch]:
+        return list(CreditBatch.objects.filter(status=CreditBatch.STATUS_PENDING).order_by('created_at'))
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def apply_chunk(batch_id: Any, chunk_size: int = 1000) -> CreditBatch:
+        """
+        Credits the next chunk of users after the batch cursor with one
+        UPDATE ... SET balance = balance + delta and advances the cursor in the
+        same transaction, so an interrupted run resumes without double credits.
+        """
+        batch = CreditBatch.objects.select_for_update().get(id=batch_id)
+        if batch.status == CreditBatch.STATUS_DONE:
+            return batch
+
+        if batch.user_ids is not None:
+            ids = [uid for uid in batch.user_ids if uid > batch.cursor][:chunk_size]
+        else:
+            ids = list(
+                CustomUser.objects
+                .filter(id__gt=batch.cursor, id__lte=batch.max_user_id, is_active=True)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+
+        if ids:
+            batch.applied_count += CustomUser.objects.filter(id__in=ids).update(balance=F('balance') + batch.delta)
+            batch.cursor = ids[-1]
+            invalidation.publish('user', invalidation.ALL)
+        if len(ids) < chunk_size:
+            batch.status = CreditBatch.STATUS_DONE
+            batch.completed_at = timezone.now()
+        batch.save(update_fields=['cursor', 'applied_count', 'status', 'completed_at'])
+        return batch
+
+
+@traced
 class PurchaseRepository:
     @staticmethod
     def exists(user: CustomUser, course: CourseEntry) -> bool:
         return CoursePurchase.objects.filter(user=user, course=course).exists()
 
     @staticmethod
+    def purchased_course_ids(user: CustomUser, course_ids: List[Any]) -> set:
+        return set(CoursePurchase.objects.filter(user=user, course_id__in=course_ids).values_list('course_id', flat=True))
+
+    @staticmethod
+    def iter_pairs(chunk_size: int = 10000):
+        """
+        Streams every (user_id, course_id) purchase without loading them all.
+        """
+        return CoursePurchase.objects.values_list('user_id', 'course_id').order_by().iterator(chunk_size=chunk_size)
+
+    @staticmethod
+    @retry_on_locked
     def create(user: CustomUser, course: CourseEntry) -> CoursePurchase:
         return CoursePurchase.objects.create(user=user, course=course)
 
     @staticmethod
-    def list_user_purchases(user: CustomUser, q: str = '', page: int = 1, limit: int = 15) -> Tuple[List[CoursePurchase], int]:
-        qs = CoursePurchase.objects.filter(user=user, course__title__icontains=q).order_by('-purchased_at')
+    def list_user_purchases(user: CustomUser, q: str = '', page: int = 1, limit: int = 15,
+                            columns: Optional[List[str]] = None) -> Tuple[List[CoursePurchase], int]:
+        qs = (
+            CoursePurchase.objects
+            .filter(user=user, course__title__icontains=q)
+            .select_related('course')
+            .order_by('-purchased_at')
+        )
+        if columns is not None:
+            # select_related needs the foreign key itself loaded.
+            qs = qs.only('course', *columns)
         return _paginate(qs, page, limit)
 
 
+@traced
 class ProgressRepository:
     @staticmethod
+    @retry_on_locked
     def get_or_create(user: CustomUser, module: ModuleEntry) -> ModuleProgress:
         progress, _ = ModuleProgress.objects.get_or_create(user=user, module=module)
         return progress
 
     @staticmethod
-    def mark_completed(user: CustomUser, module: ModuleEntry) -> ModuleProgress:
+    @retry_on_locked
+    def mark_completed(user: CustomUser, module: ModuleEntry) -> Tuple[ModuleProgress, bool]:
+        """
+        Returns the progress row and whether this call changed it to completed.
+        """
         progress = ProgressRepository.get_or_create(user, module)
+        if progress.is_completed:
+            return progress, False
         progress.is_completed = True
+        progress.completed_at = timezone.now()
         progress.save()
-        return progress
+        return progress, True
+
+    @staticmethod
+    @retry_on_locked
+    def bulk_mark_completed(user_ids: List[int], module_ids: List[Any]) -> None:
+        # Rows that are already completed keep their completion time.
+        now = timezone.now()
+        ModuleProgress.objects.filter(user_id__in=user_ids, module_id__in=module_ids, is_completed=False).update(
+            is_completed=True, completed_at=now
+        )
+        rows = [
+            ModuleProgress(user_id=u, module_id=m, is_completed=True, completed_at=now)
+            for u in user_ids for m in module_ids
+        ]
+        ModuleProgress.objects.bulk_create(rows, ignore_conflicts=True)
+
+    @staticmethod
+    def get(user: CustomUser, module: ModuleEntry) -> Optional[ModuleProgress]:
+        return ModuleProgress.objects.filter(user=user, module=module).first()
+
+    @staticmethod
+    def is_completed(user: CustomUser, module: ModuleEntry) -> bool:
+        return ModuleProgress.objects.filter(user=user, module=module, is_completed=True).exists()
+
+    @staticmethod
+    def completed_module_ids(user: CustomUser, module_ids: List[Any]) -> set:
+        return set(
+            ModuleProgress.objects
+            .filter(user=user, module_id__in=module_ids, is_completed=True)
+            .values_list('module_id', flat=True)
+        )
+
+    @staticmethod
+    def total_modules_by_course(course_ids: List[Any]) -> Dict[Any, int]:
+        rows = ModuleEntry.objects.filter(course_id__in=course_ids).values('course_id').annotate(total=Count('id'))
+        return {r['course_id']: r['total'] for r in rows}
+
+    @staticmethod
+    def completed_counts(user_ids: List[int], course_ids: List[Any]) -> Dict[Tuple[int, Any], int]:
+        rows = (
+            ModuleProgress.objects
+            .filter(user_id__in=user_ids, module__course_id__in=course_ids, is_completed=True)
+            .values('user_id', 'module__course_id')
+            .annotate(done=Count('id'))
+        )
+        return {(r['user_id'], r['module__course_id']): r['done'] for r in rows}
 
     @staticmethod
     def total_modules(course: CourseEntry) -> int:
@@ -177,4 +581,188 @@ class ProgressRepository:
 
     @staticmethod
     def completed_modules_count(user: CustomUser, course: CourseEntry) -> int:
-        return ModuleProgress.objects.filter(user=user, module__course=course, is_completed=True).count()
\ No newline at end of file
+        return ModuleProgress.objects.filter(user=user, module__course=course, is_completed=True).count()
+
+    @staticmethod
+    def completion(user: CustomUser, course: CourseEntry) -> Tuple[int, Optional[datetime.datetime]]:
+        """
+        The number of completed modules of the course and when the last of
+        them was completed.
+        """
+        row = ModuleProgress.objects.filter(user=user, module__course=course, is_completed=True).aggregate(
+            done=Count('id'), last=Max('completed_at')
+        )
+        return row['done'], row['last']
+
+
+@traced
+class ActivityRepository:
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def record(entries: List[Dict[str, Any]]) -> List[Tuple[int, Any]]:
+        """
+        Appends one activity row per coalesced entry and folds it into the
+        matching progress rows. Returns the (user, module) pairs whose entry
+        reached completion while their progress is not completed yet.
+        Entries of users or modules deleted since they were buffered are
+        dropped.
+        """
+        user_ids = set(CustomUser.objects.filter(id__in={e['user_id'] for e in entries}).values_list('id', flat=True))
+        module_ids = set(
+            ModuleEntry.objects.filter(id__in={e['module_id'] for e in entries}).values_list('id', flat=True)
+        )
+        entries = [e for e in entries if e['user_id'] in user_ids and e['module_id'] in module_ids]
+        if not entries:
+            return []
+        ModuleActivity.objects.bulk_create([
+            ModuleActivity(
+                user_id=e['user_id'], module_id=e['module_id'], position=e['position'],
+                watched_seconds=e['watched_seconds'], events=e['events'],
+                started_at=e['started_at'], ended_at=e['ended_at'],
+            )
+            for e in entries
+        ])
+
+        existing = {
+            (p.user_id, p.module_id): p
+            for p in ModuleProgress.objects.filter(
+                user_id__in={e['user_id'] for e in entries},
+                module_id__in={e['module_id'] for e in entries},
+            )
+        }
+        rows = []
+        newly_completed = []
+        for e in entries:
+            key = (e['user_id'], e['module_id'])
+            current = existing.get(key)
+            is_completed = bool(current and current.is_completed)
+            rows.append(ModuleProgress(
+                user_id=e['user_id'], module_id=e['module_id'], is_completed=is_completed,
+                last_position=e['position'],
+                watched_seconds=(current.watched_seconds if current else 0) + e['watched_seconds'],
+                last_activity_at=e['ended_at'],
+            ))
+            if e['completed'] and not is_completed:
+                newly_completed.append(key)
+        ModuleProgress.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['user', 'module'],
+            update_fields=['last_position', 'watched_seconds', 'last_activity_at'],
+        )
+        return newly_completed
+
+
+@traced
+class CertificateRepository:
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def revoke(user_id: int, course_id: Any, reason: str = '') -> RevokedCertificate:
+        revoked, _ = RevokedCertificate.objects.update_or_create(
+            user_id=user_id, course_id=course_id, defaults={'reason': reason}
+        )
+        invalidation.publish('certificate', invalidation.ALL)
+        return revoked
+
+    @staticmethod
+    def revoked_pairs() -> set:
+        return set(RevokedCertificate.objects.values_list('user_id', 'course_id'))
+
+
+@traced
+class TombstoneRepository:
+    @staticmethod
+    def record(entities: List[Tuple[str, Any]], course_id: Any) -> None:
+        """
+        entities: [(entity, entity_id), ...] of one course. Call inside the
+        transaction that deletes them.
+        """
+        Tombstone.objects.bulk_create([
+            Tombstone(entity=entity, entity_id=entity_id, course_id=course_id) for entity, entity_id in entities
+        ])
+
+    @staticmethod
+    def deleted_after(position: Optional[Tuple[Any, Any]], limit: int) -> List[Tombstone]:
+        return _after(Tombstone.objects.all(), 'deleted_at', position, limit)
+
+    @staticmethod
+    def prune(older_than: datetime.datetime) -> int:
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=older_than).delete()
+        return deleted
+
+
+@traced
+class JobRepository:
+    @staticmethod
+    @retry_on_locked
+    def create(name: str, payload: Dict[str, Any], delay: int = 0, max_attempts: int = 5) -> Job:
+        run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        return Job.objects.create(name=name, payload=payload, run_after=run_after, max_attempts=max_attempts)
+
+    @staticmethod
+    @retry_on_locked
+    def claim(batch_size: int, visibility_timeout: int) -> List[Job]:
+        """
+        Leases up to batch_size due jobs for visibility_timeout seconds.
+        A lease that is not finished before it expires makes the job claimable again.
+        """
+        now = timezone.now()
+        claimable = Q(status=Job.STATUS_PENDING, run_after__lte=now) & (
+            Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+        )
+        ids = list(Job.objects.filter(claimable).order_by('run_after', 'id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        Job.objects.filter(claimable, id__in=ids).update(
+            locked_until=now + datetime.timedelta(seconds=visibility_timeout),
+            lock_token=token,
+        )
+        return list(Job.objects.filter(lock_token=token, status=Job.STATUS_PENDING).order_by('run_after', 'id'))
+
+    @staticmethod
+    @retry_on_locked
+    def start(job: Job) -> bool:
+        """
+        Counts an attempt for a claimed job about to run. Returns False, and
+        counts nothing, once its lease has run out.
+        """
+        started = Job.objects.filter(id=job.id, lock_token=job.lock_token, locked_until__gt=timezone.now()).update(
+            attempts=F('attempts') + 1
+        )
+        if started:
+            job.attempts += 1
+        return bool(started)
+
+    @staticmethod
+    @retry_on_locked
+    def mark_done(jobs: List[Job]) -> int:
+        if not jobs:
+            return 0
+        return Job.objects.filter(id__in=[j.id for j in jobs], lock_token=jobs[0].lock_token).update(
+            status=Job.STATUS_DONE, locked_until=None, last_error='', updated_at=timezone.now()
+        )
+
+    @staticmethod
+    @retry_on_locked
+    def mark_failed(job: Job, error: str, retry_delay: int) -> bool:
+        """
+        Schedules another attempt after retry_delay seconds, or gives up once
+        max_attempts is reached. Returns True if the job will be retried.
+        """
+        retry = job.attempts < job.max_attempts
+        changes: Dict[str, Any] = {'locked_until': None, 'last_error': error, 'updated_at': timezone.now()}
+        if retry:
+            changes['run_after'] = timezone.now() + datetime.timedelta(seconds=retry_delay)
+        else:
+            changes['status'] = Job.STATUS_FAILED
+        Job.objects.filter(id=job.id, lock_token=job.lock_token).update(**changes)
+        return retry
+
+    @staticmethod
+    @retry_on_locked
+    def purge_done(older_than: datetime.datetime) -> int:
+        deleted, _ = Job.objects.filter(status=Job.STATUS_DONE, updated_at__lt=older_than).delete()
+        return deleted
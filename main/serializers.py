@@ -0,0 +1,87 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Getter = Callable[[Any, Dict[str, Any]], Any]
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+class FieldSet:
+    """
+    The fields an endpoint can return. Each field maps to the model column
+    it needs (None for derived fields) and a getter. Only requested fields
+    are loaded, computed and serialized.
+    """
+
+    def __init__(self, fields: Dict[str, Tuple[Optional[str], Getter]]):
+        self.fields = fields
+
+    def parse(self, raw: Optional[str], default: Optional[List[str]] = None) -> List[str]:
+        if not raw:
+            return list(default or self.fields)
+        names = list(dict.fromkeys(f.strip() for f in raw.split(',') if f.strip()))
+        unknown = [f for f in names if f not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+        return names
+
+    def columns(self, names: List[str]) -> List[str]:
+        return [self.fields[n][0] for n in names if self.fields[n][0]]
+
+    def serialize(self, obj, names: List[str], ctx: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        ctx = ctx or {}
+        return {n: self.fields[n][1](obj, ctx) for n in names}
+
+
+COURSE_FIELDS = FieldSet({
+    'id': ('id', lambda c, ctx: str(c.id)),
+    'title': ('title', lambda c, ctx: c.title),
+    'description': ('description', lambda c, ctx: c.description),
+    'instructor': ('instructor', lambda c, ctx: c.instructor),
+    'topics': ('topics', lambda c, ctx: c.topics),
+    'price': ('price', lambda c, ctx: c.price),
+    'thumbnail_image': ('thumbnail_image', lambda c, ctx: c.thumbnail_image),
+    'total_modules': ('module_count', lambda c, ctx: c.module_count),
+    'purchase_count': ('purchase_count', lambda c, ctx: c.purchase_count),
+    'created_at': ('created_at', lambda c, ctx: _iso(c.created_at)),
+    'updated_at': ('updated_at', lambda c, ctx: _iso(c.updated_at)),
+})
+
+MODULE_FIELDS = FieldSet({
+    'id': ('id', lambda m, ctx: str(m.id)),
+    'course_id': ('course', lambda m, ctx: str(m.course_id)),
+    'title': ('title', lambda m, ctx: m.title),
+    'description': ('description', lambda m, ctx: m.description),
+    'order': ('order', lambda m, ctx: m.order),
+    'pdf_content': ('pdf_content', lambda m, ctx: m.pdf_content),
+    'video_content': ('video_content', lambda m, ctx: m.video_content),
+    'is_completed': (None, lambda m, ctx: ctx['is_completed'](m)),
+    'created_at': ('created_at', lambda m, ctx: _iso(m.created_at)),
+    'updated_at': ('updated_at', lambda m, ctx: _iso(m.updated_at)),
+})
+
+USER_FIELDS = FieldSet({
+    'id': ('id', lambda u, ctx: str(u.id)),
+    'username': ('username', lambda u, ctx: u.username),
+    'email': ('email', lambda u, ctx: u.email),
+    'first_name': ('first_name', lambda u, ctx: u.first_name),
+    'last_name': ('last_name', lambda u, ctx: u.last_name),
+    'balance': ('balance', lambda u, ctx: u.balance),
+    'courses_purchased': (None, lambda u, ctx: ctx['courses_purchased'](u)),
+})
+
+PURCHASE_FIELDS = FieldSet({
+    'id': ('course', lambda p, ctx: str(p.course_id)),
+    'title': ('course__title', lambda p, ctx: p.course.title),
+    'instructor': ('course__instructor', lambda p, ctx: p.course.instructor),
+    'topics': ('course__topics', lambda p, ctx: p.course.topics),
+    'thumbnail_image': ('course__thumbnail_image', lambda p, ctx: p.course.thumbnail_image),
+    'progress_percentage': (None, lambda p, ctx: ctx['progress_percentage'](p)),
+    'purchased_at': ('purchased_at', lambda p, ctx: _iso(p.purchased_at)),
+})
+
+# Defaults for endpoints that do not return every field unless asked.
+USER_LIST_FIELDS = ['id', 'username', 'email', 'first_name', 'last_name', 'balance']
+PURCHASE_SUMMARY_FIELDS = ['id', 'title', 'purchased_at']
+SYNC_MODULE_FIELDS = [f for f in MODULE_FIELDS.fields if f != 'is_completed']
@@ -1,19 +1,67 @@
-from typing import Tuple, Optional, Dict, Any, List
+from typing import Tuple, Optional, Dict, Any, List, Callable
 from django.db import transaction
+from django.utils import timezone
 from main.repositories import (
     CourseRepository,
     ModuleRepository,
     UserRepository,
     PurchaseRepository,
     ProgressRepository,
+    CreditRepository,
+    ActivityRepository,
+    CertificateRepository,
 )
+from main import certificates, changes, media, recommendations
+from main.textindex import text_index, build as build_text_index
 from main.strategies import get_purchase_strategy
+from main.autocomplete import course_index
+from main.db import retry_on_locked
+from main.tracing import traced
+from main.tasks import enqueue
 
 
+@traced
 class CourseService:
     @staticmethod
-    def list_courses(q: str = '', page: int = 1, limit: int = 15) -> Tuple[List[Any], int]:
-        return CourseRepository.list(q=q, page=page, limit=limit)
+    def list_courses(q: str = '', page: int = 1, limit: int = 15, columns: Optional[List[str]] = None,
+                     sort: str = 'newest', **filters) -> Tuple[List[Any], int]:
+        return CourseRepository.list(q=q, page=page, limit=limit, columns=columns, sort=sort, **filters)
+
+    @staticmethod
+    def recommendations(course_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return recommendations.index.similar(course_id, limit)
+
+    @staticmethod
+    def build_recommendations(**options) -> Dict[str, int]:
+        return recommendations.build(**options)
+
+    @staticmethod
+    def similar_courses(course_ids: List[str], limit: int = 10) -> Dict[str, List[Dict[str, Any]]]:
+        return text_index.similar(course_ids, limit)
+
+    @staticmethod
+    def search_courses(q: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return text_index.search(q, limit)
+
+    @staticmethod
+    def get_courses(course_ids: List[str]) -> Dict[str, Any]:
+        return CourseRepository.get_many(course_ids)
+
+    @staticmethod
+    def build_text_index(**options) -> Dict[str, Any]:
+        return build_text_index(CourseRepository.iter_text(), **options)
+
+    @staticmethod
+    def reconcile_counters(dry_run: bool = False) -> List[Dict[str, Any]]:
+        return CourseRepository.reconcile_counters(dry_run=dry_run)
+
+    @staticmethod
+    def course_facets(q: str = '', **filters) -> Dict[str, Any]:
+        return CourseRepository.facets(q=q, **filters)
+
+    @staticmethod
+    def autocomplete(prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return course_index.search(prefix, limit)
 
     @staticmethod
     def get_course(course_id: str):
@@ -30,28 +78,88 @@ class CourseService:
     @staticmethod
     def delete_course(course):
         return CourseRepository.delete(course)
+
+    @staticmethod
+    def catalog_changes(cursor: Optional[str], limit: int) -> Dict[str, Any]:
+        return changes.since(cursor, limit)
     
-    def certificate_accessible(user, course) -> bool:
-        if not user.is_authenticated:
-            return False
-        modules = ModuleService.list_modules(course, page=1, limit=100)[0]
-        completed_modules = ModuleService.completed_modules_count(user, course)
-        return completed_modules == len(modules)
-    
-    def progress_percentage(user, course) -> int:
-        if not user.is_authenticated:
-            return 0
-        total = ModuleService.total_modules(course)
-        if total == 0:
-            return 0
-        done = ModuleService.completed_modules_count(user, course)
-        return int((done / total) * 100)
+    @staticmethod
+    def get_course_view(user, course_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Everything a course page renders, in at most three queries: the
+        course (skipped on an entity cache hit), its modules with the user's
+        completion, and the purchase check.
+        """
+        course = CourseRepository.get(course_id)
+        if not course:
+            return None
+        if user is not None and not user.is_authenticated:
+            user = None
+
+        modules = ModuleRepository.list_with_completion(course, user)
+        is_purchased = user is not None and PurchaseRepository.exists(user, course)
+        done = sum(1 for m in modules if m.is_completed)
+        return {
+            'course': course,
+            'modules': modules,
+            'is_purchased': is_purchased,
+            'progress_percentage': int((done / len(modules)) * 100) if modules else 0,
+            'certificate_available': is_purchased and done == len(modules),
+        }
 
 
+    @staticmethod
+    def issue_certificate(user, course) -> Optional[Dict[str, Any]]:
+        """
+        A signed certificate for a purchased course the user has completed
+        every module of, or None.
+        """
+        total = ProgressRepository.total_modules(course)
+        if not total or not PurchaseRepository.exists(user, course):
+            return None
+        done, completed_at = ProgressRepository.completion(user, course)
+        if done != total or completed_at is None:
+            return None
+        # The date the last module was completed, so the id stays the same
+        # for as long as the completion does.
+        completed_on = timezone.localdate(completed_at)
+        return {
+            'certificate_id': certificates.sign(user.id, course.id, completed_on),
+            'course_id': course.id,
+            'completed_on': completed_on,
+        }
+
+    @staticmethod
+    def verify_certificate(certificate_id: str) -> Optional[Dict[str, Any]]:
+        return certificates.verify(certificate_id)
+
+    @staticmethod
+    def revoke_certificate(certificate_id: str, reason: str = '') -> Optional[Dict[str, Any]]:
+        fields = certificates.decode(certificate_id)
+        if fields is None:
+            return None
+        CertificateRepository.revoke(fields['user_id'], fields['course_id'], reason)
+        return fields
+
+    @staticmethod
+    def upload_thumbnail(course, upload, absolute_url: Callable[[str], str]) -> Dict[str, Any]:
+        """
+        Stores the image with its pre-sized derivatives and points the
+        course's thumbnail at the largest one. Raises ValueError for files
+        that are not images.
+        """
+        name = media.store(upload, 'image')
+        sizes = {width: absolute_url(media.url(n)) for width, n in media.make_thumbnails(name).items()}
+        original = absolute_url(media.url(name))
+        CourseRepository.update(course, {'thumbnail_image': sizes[max(sizes)] if sizes else original})
+        return {'original': original, 'sizes': sizes}
+
+
+@traced
 class ModuleService:
     @staticmethod
-    def list_modules(course, page: int = 1, limit: int = 15):
-        return ModuleRepository.list_by_course(course, page=page, limit=limit)
+    def list_modules(course, page: int = 1, limit: int = 15, columns: Optional[List[str]] = None):
+        return ModuleRepository.list_by_course(course, page=page, limit=limit, columns=columns)
 
     @staticmethod
     def get_module(module_id: str):
@@ -70,11 +178,26 @@ class ModuleService:
         return ModuleRepository.delete(module)
 
     @staticmethod
+    def upload_content(module, uploads: Dict[str, Any], absolute_url: Callable[[str], str]):
+        """
+        Stores uploaded 'pdf' and 'video' files and points the module at them.
+        The module is left unchanged unless every file is valid.
+        """
+        for kind, upload in uploads.items():
+            media.check(upload, kind)
+        urls = {f"{kind}_content": absolute_url(media.url(media.store(upload, kind))) for kind, upload in uploads.items()}
+        return ModuleRepository.update(module, urls)
+
+    @staticmethod
+    @retry_on_locked
     def mark_completed(user, module):
-        ProgressRepository.mark_completed(user, module)
-        total = ProgressRepository.total_modules(module.course)
-        done = ProgressRepository.completed_modules_count(user, module.course)
-        percentage = int((done / total) * 100) if total > 0 else 0
+        with transaction.atomic():
+            _, changed = ProgressRepository.mark_completed(user, module)
+            total = ProgressRepository.total_modules(module.course)
+            done = ProgressRepository.completed_modules_count(user, module.course)
+            percentage = int((done / total) * 100) if total > 0 else 0
+            if changed and percentage == 100:
+                enqueue('course.completed', {'user_id': str(user.id), 'course_id': str(module.course.id)})
         cert = f"/api/courses/{module.course.id}/certificate" if percentage == 100 else None
         return {
             'total_modules': total,
@@ -82,10 +205,90 @@ class ModuleService:
             'percentage': percentage
         }, cert
 
+    @staticmethod
+    @retry_on_locked
+    def mark_completed_bulk(user_ids: List[int], module_ids: List[Any]) -> Dict[str, Any]:
+        """
+        Completes every module for every user in one upsert and recomputes
+        progress once per affected (user, course) pair.
+        """
+        module_courses = ModuleRepository.course_ids_for(module_ids)
+        user_ids = UserRepository.existing_ids(user_ids)
+        found = [m for m in module_ids if m in module_courses]
+        course_ids = list(dict.fromkeys(module_courses[m] for m in found))
+        if not found or not user_ids:
+            return {'completed_module_ids': [], 'not_found': [str(m) for m in module_ids if m not in module_courses], 'progress': []}
+
+        with transaction.atomic():
+            before = ProgressRepository.completed_counts(user_ids, course_ids)
+            ProgressRepository.bulk_mark_completed(user_ids, found)
+            after = ProgressRepository.completed_counts(user_ids, course_ids)
+            totals = ProgressRepository.total_modules_by_course(course_ids)
+
+            progress = []
+            for uid in user_ids:
+                for cid in course_ids:
+                    total = totals.get(cid, 0)
+                    done = after.get((uid, cid), 0)
+                    percentage = int((done / total) * 100) if total > 0 else 0
+                    if percentage == 100 and before.get((uid, cid), 0) < total:
+                        enqueue('course.completed', {'user_id': str(uid), 'course_id': str(cid)})
+                    progress.append({
+                        'user_id': str(uid),
+                        'course_id': str(cid),
+                        'total_modules': total,
+                        'completed_modules': done,
+                        'percentage': percentage,
+                        'certificate_url': f"/api/courses/{cid}/certificate" if percentage == 100 else None,
+                    })
+
+        return {
+            'completed_module_ids': [str(m) for m in found],
+            'not_found': [str(m) for m in module_ids if m not in module_courses],
+            'progress': progress,
+        }
+
+    @staticmethod
+    @retry_on_locked
+    @transaction.atomic
+    def record_activity(entries: List[Dict[str, Any]]) -> None:
+        """
+        Persists coalesced heartbeat entries and completes the modules they
+        finished, going through mark_completed_bulk so course completion is
+        detected the same way as for explicit completions.
+        """
+        finished: Dict[int, List[Any]] = {}
+        for user_id, module_id in ActivityRepository.record(entries):
+            finished.setdefault(user_id, []).append(module_id)
+        for user_id, module_ids in finished.items():
+            ModuleService.mark_completed_bulk([user_id], module_ids)
+
+    @staticmethod
+    def get_progress(user, module):
+        return ProgressRepository.get(user, module)
+
+    @staticmethod
+    def purchased_module_ids(user, module_ids: List[Any]) -> List[Any]:
+        module_courses = ModuleRepository.course_ids_for(module_ids)
+        purchased = PurchaseRepository.purchased_course_ids(user, list(set(module_courses.values())))
+        return [m for m in module_ids if module_courses.get(m) in purchased]
+
     @staticmethod
     def get_module_status(user, module):
-        progress = ProgressRepository.get_or_create(user, module) if user else None
-        return bool(progress and getattr(progress, 'is_completed', False))
+        return bool(user) and ProgressRepository.is_completed(user, module)
+
+    @staticmethod
+    def completed_module_ids(user, module_ids: List[Any]):
+        return ProgressRepository.completed_module_ids(user, module_ids) if user else set()
+
+    @staticmethod
+    def progress_by_course(user, course_ids: List[Any]) -> Dict[Any, int]:
+        totals = ProgressRepository.total_modules_by_course(course_ids)
+        done = ProgressRepository.completed_counts([user.id], course_ids)
+        return {
+            cid: int((done.get((user.id, cid), 0) / totals[cid]) * 100) if totals.get(cid) else 0
+            for cid in course_ids
+        }
 
     @staticmethod
     def reorder(course, module_order: List[Dict[str, Any]]):
@@ -100,6 +303,7 @@ class ModuleService:
         return ProgressRepository.completed_modules_count(user, course)
 
 
+@traced
 class PurchaseService:
     @staticmethod
     def purchase_course(user, course):
@@ -108,19 +312,28 @@ class PurchaseService:
         if not ok:
             return False, err, None
         try:
-            purchase = strategy.execute(user, course)
+            purchase = PurchaseService._execute(strategy, user, course)
             return True, None, purchase
         except Exception as e:
             return False, str(e), None
 
     @staticmethod
-    def list_user_purchases(user, q: str = '', page: int = 1, limit: int = 15):
-        return PurchaseRepository.list_user_purchases(user, q=q, page=page, limit=limit)
+    @retry_on_locked
+    @transaction.atomic
+    def _execute(strategy, user, course):
+        purchase = strategy.execute(user, course)
+        enqueue('purchase.created', {'user_id': str(user.id), 'course_id': str(course.id)})
+        return purchase
+
+    @staticmethod
+    def list_user_purchases(user, q: str = '', page: int = 1, limit: int = 15, columns: Optional[List[str]] = None):
+        return PurchaseRepository.list_user_purchases(user, q=q, page=page, limit=limit, columns=columns)
     
     def has_purchased(user, course) -> bool:
         return PurchaseRepository.exists(user, course)
 
 
+@traced
 class UserService:
     @staticmethod
     def get_user_by_id(uid: str):
@@ -152,5 +365,24 @@ class UserService:
         return UserRepository.change_balance(user, delta)
 
     @staticmethod
-    def list_users(q: str = '', page: int = 1, limit: int = 15):
-        return UserRepository.list(q=q, page=page, limit=limit)
\ No newline at end of file
+    @retry_on_locked
+    def start_bulk_credit(delta: int, user_ids: Optional[List[int]] = None, reason: str = '', created_by=None):
+        with transaction.atomic():
+            batch = CreditRepository.create_batch(delta, user_ids=user_ids, reason=reason, created_by=created_by)
+            enqueue('credits.apply', {'batch_id': str(batch.id)})
+        return batch
+
+    @staticmethod
+    def apply_bulk_credit(batch_id, chunk_size: int = 1000):
+        batch = CreditRepository.get(batch_id)
+        while batch and batch.status != batch.STATUS_DONE:
+            batch = CreditRepository.apply_chunk(batch.id, chunk_size)
+        return batch
+
+    @staticmethod
+    def get_credit_batch(batch_id):
+        return CreditRepository.get(batch_id)
+
+    @staticmethod
+    def list_users(q: str = '', page: int = 1, limit: int = 15, columns: Optional[List[str]] = None):
+        return UserRepository.list(q=q, page=page, limit=limit, columns=columns)
\ No newline at end of file
@@ -26,8 +26,7 @@ class BalancePurchaseStrategy(PurchaseStrategy):
     def execute(self, user, course):
         with transaction.atomic():
             UserRepository.change_balance(user, -int(getattr(course, 'price', 0) or 0))
-            purchase = PurchaseRepository.create(user, course)
-            return purchase
+            return PurchaseRepository.create(user, course)
 
 
 class FreePurchaseStrategy(PurchaseStrategy):
@@ -37,7 +36,8 @@ class FreePurchaseStrategy(PurchaseStrategy):
         return True, None
 
     def execute(self, user, course):
-        return PurchaseRepository.create(user, course)
+        with transaction.atomic():
+            return PurchaseRepository.create(user, course)
 
 
 def get_purchase_strategy(course) -> PurchaseStrategy:
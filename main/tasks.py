@@ -0,0 +1,95 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from main import certificates
+from main.repositories import CourseRepository, CreditRepository, JobRepository, UserRepository
+
+logger = logging.getLogger(__name__)
+
+_registry: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def task(name: str):
+    def decorator(func: Callable[[Dict[str, Any]], None]):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def get_handler(name: str) -> Optional[Callable[[Dict[str, Any]], None]]:
+    return _registry.get(name)
+
+
+def enqueue(name: str, payload: Optional[Dict[str, Any]] = None, delay: int = 0, max_attempts: int = 5):
+    """
+    Writes the job into the outbox table on the current connection. Inside an
+    atomic block the row is only visible to workers once the surrounding
+    transaction commits, and it disappears with it on rollback.
+    """
+    if name not in _registry:
+        raise ValueError(f"Unknown task: {name}")
+    return JobRepository.create(name, payload or {}, delay=delay, max_attempts=max_attempts)
+
+
+def retry_delay(attempts: int, base: int = 5, cap: int = 600) -> int:
+    return min(base * (2 ** max(attempts - 1, 0)), cap)
+
+
+def run_batch(batch_size: int = 20, visibility_timeout: int = 60) -> List[Any]:
+    """
+    Runs one leased batch, marking each job as it finishes. Jobs still
+    waiting when the lease runs out are left alone, since another worker
+    may already have claimed them again.
+    """
+    jobs = JobRepository.claim(batch_size, visibility_timeout)
+    ran = []
+    for job in jobs:
+        if not JobRepository.start(job):
+            break
+        handler = get_handler(job.name)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for {job.name}")
+            handler(job.payload)
+            JobRepository.mark_done([job])
+        except Exception as e:
+            logger.exception("Job %s (%s) failed on attempt %s", job.id, job.name, job.attempts)
+            JobRepository.mark_failed(job, str(e), retry_delay(job.attempts))
+        ran.append(job)
+    return ran
+
+
+@task('purchase.created')
+def count_purchase(payload: Dict[str, Any]) -> None:
+    CourseRepository.recount_purchases(payload['course_id'])
+
+
+@task('course.completed')
+def prepare_certificate(payload: Dict[str, Any]) -> None:
+    """
+    Renders the certificate PDF so its first download is a file read.
+    """
+    # Services enqueue tasks, so they can only be imported once both exist.
+    from main.services import CourseService
+
+    user = UserRepository.get_by_id(payload['user_id'])
+    course = CourseRepository.get(payload['course_id'])
+    if user is None or course is None:
+        return
+    certificate = CourseService.issue_certificate(user, course)
+    if certificate:
+        certificates.prepare_certificate(user, course, certificate)
+
+
+@task('credits.apply')
+def apply_credit_batch(payload: Dict[str, Any]) -> None:
+    """
+    Applies a bounded number of chunks per job so a single lease never outlives
+    the visibility timeout; the remainder is handed to a follow-up job.
+    """
+    batch_id = payload['batch_id']
+    chunk_size = int(payload.get('chunk_size', 1000))
+    for _ in range(int(payload.get('max_chunks', 20))):
+        batch = CreditRepository.apply_chunk(batch_id, chunk_size)
+        if batch.status == batch.STATUS_DONE:
+            return
+    enqueue('credits.apply', payload)
@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from main import activity, batch, certificates, entity_cache, invalidation, tasks, tracing, warmup
+from main.mmapcache import SEQ, SLOT_HEADER, MmapCache, _hash_key
+from main.autocomplete import PrefixIndex, course_index
+from main.db import retry_on_locked
+from main.middleware import RATE_LIMIT_DEFAULTS, RateLimitMiddleware
+from main.models import (
+    CourseEntry, CoursePurchase, CreditBatch, CustomUser, InvalidationEvent, Job, ModuleActivity, ModuleEntry,
+    ModuleProgress,
+)
+from main.repositories import CourseRepository, CreditRepository, JobRepository, ModuleRepository
+from main.services import CourseService, ModuleService, PurchaseService
+from main.textindex import TextIndex
+from main.tokens import encode_token
 
-# Create your tests here.
+# Cumulative import time of the URLconf (and therefore every view) in a fresh
+# interpreter, and process start to first catalog response.
+URLCONF_IMPORT_BUDGET_MS = 300
+FIRST_REQUEST_BUDGET_MS = 1500
+# Rarely used dependencies that must only load on first use.
+LAZY_MODULES = ('reportlab', 'jwt', 'numpy', 'scipy')
+
+FIRST_REQUEST_SCRIPT = """
+import time
+start = time.perf_counter()
+import django
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = ':memory:'
+django.setup()
+setup = time.perf_counter() - start
+from django.core.management import call_command
+call_command('migrate', verbosity=0)
+from django.test import Client
+start = time.perf_counter()
+response = Client(HTTP_HOST='localhost').get('/api/courses')
+assert response.status_code == 200, response.status_code
+print((setup + time.perf_counter() - start) * 1000)
+"""
+
+
+def _python(*args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'groacademy.settings', 'CACHE_FILE': os.path.join(tmp, 'cache.bin')}
+        return subprocess.run([sys.executable, *args], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+
+
+def _import_times():
+    result = _python('-X', 'importtime', '-c', 'import django; django.setup(); import groacademy.urls')
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S.*)$', line)
+        if match:
+            times[match.group(2).strip()] = int(match.group(1)) / 1000
+    return times
+
+
+class StartupBudgetTests(SimpleTestCase):
+    def test_rarely_used_dependencies_load_lazily(self):
+        times = _import_times()
+        eager = sorted(m for m in times if m.split('.')[0] in LAZY_MODULES)
+        self.assertEqual(eager, [], f"Imported at startup: {', '.join(eager)}")
+
+    def test_urlconf_import_time_within_budget(self):
+        times = _import_times()
+        self.assertIn('groacademy.urls', times)
+        self.assertLessEqual(
+            times['groacademy.urls'], URLCONF_IMPORT_BUDGET_MS,
+            f"groacademy.urls took {times['groacademy.urls']:.0f} ms to import",
+        )
+
+    def test_time_to_first_request_within_budget(self):
+        result = _python('-c', FIRST_REQUEST_SCRIPT)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        elapsed = float(result.stdout.strip().splitlines()[-1])
+        self.assertLessEqual(elapsed, FIRST_REQUEST_BUDGET_MS, f"First request after {elapsed:.0f} ms")
+
+
+class RuntimePathTests(SimpleTestCase):
+    def test_generated_files_default_to_the_app_var_directory(self):
+        var = os.path.join(settings.BASE_DIR, 'var') + os.sep
+        for path in (
+            settings.RECOMMENDATIONS_PATH,
+            settings.TEXT_INDEX_PATH,
+            settings.CERTIFICATE_DIR,
+            settings.LOGGING['handlers']['access']['filename'],
+        ):
+            with self.subTest(path=path):
+                self.assertTrue(str(path).startswith(var))
+
+
+class WarmupTests(SimpleTestCase):
+    def test_failed_preload_is_logged_and_the_master_still_starts(self):
+        with mock.patch.object(warmup.invalidation, 'mark_synced', side_effect=OperationalError('no such table')), \
+                mock.patch.object(warmup.connections, 'close_all') as close_all, \
+                self.assertLogs('main.warmup', 'ERROR') as logs:
+            warmup.preload()
+        self.assertIn('Preload failed', logs.output[0])
+        close_all.assert_called_once_with()
+
+
+class PrivateCacheMixin:
+    """
+    Points the default cache at a file of the test's own, so a test run
+    neither reads nor clears the cache of a server running on the host.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        tmp = cls.enterClassContext(tempfile.TemporaryDirectory())
+        location = os.path.join(tmp, 'cache.bin')
+        cls.enterClassContext(override_settings(CACHES={'default': {**settings.CACHES['default'], 'LOCATION': location}}))
+        super().setUpClass()
+
+
+class MmapCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = os.path.join(self.tmp, 'cache.bin')
+
+    def _cache(self, slots=64, ways=4, slot_size=256, path=None, max_chunks=8):
+        return MmapCache(path or self.path, {'OPTIONS': {
+            'SLOTS': slots, 'WAYS': ways, 'SLOT_SIZE': slot_size, 'MAX_CHUNKS': max_chunks,
+        }})
+
+    def _used_slots(self, c):
+        mm = c._map()
+        return sum(1 for i in range(c._slots) if SLOT_HEADER.unpack_from(mm, c._slot_offset(i))[2])
+
+    def test_values_are_shared_between_instances(self):
+        self._cache().set('k', {'a': 1})
+        self.assertEqual(self._cache().get('k'), {'a': 1})
+
+    def test_file_is_private(self):
+        self._cache().set('k', 1)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_refuses_a_file_others_can_access(self):
+        self._cache().set('k', 1)
+        os.chmod(self.path, 0o644)
+        with self.assertRaises(ImproperlyConfigured):
+            self._cache().get('k')
+
+    def test_refuses_a_symlink(self):
+        target = os.path.join(self.tmp, 'target.bin')
+        self._cache(path=target).set('k', 1)
+        os.symlink(target, self.path)
+        with self.assertRaises(OSError):
+            self._cache().get('k')
+
+    def test_new_geometry_replaces_the_file_without_touching_open_maps(self):
+        old = self._cache(slots=64)
+        old.set('k', 'old')
+        new = self._cache(slots=128)
+        self.assertIsNone(new.get('k'))
+        new.set('k', 'new')
+        self.assertEqual(old.get('k'), 'old')
+        self.assertEqual(self._cache(slots=128).get('k'), 'new')
+
+    def test_expired_values_are_misses(self):
+        c = self._cache()
+        c.set('k', 1, timeout=0.05)
+        self.assertEqual(c.get('k'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(c.get('k'))
+        self.assertTrue(c.add('k', 2))
+
+    def test_clear_hides_every_value(self):
+        c = self._cache()
+        c.set_many({'a': 1, 'b': 2})
+        c.clear()
+        self.assertEqual(c.get_many(['a', 'b']), {})
+
+    def test_values_larger_than_a_slot_are_stored_in_chunks(self):
+        c = self._cache()
+        big = 'x' * 1000
+        c.set('k', big)
+        self.assertEqual(self._cache().get('k'), big)
+        self.assertGreater(self._used_slots(c), 1)
+        c.set('k', 'small')
+        self.assertEqual(c.get('k'), 'small')
+        self.assertEqual(self._used_slots(c), 1)
+        c.set('k', big)
+        self.assertTrue(c.delete('k'))
+        self.assertEqual(self._used_slots(c), 0)
+
+    def test_value_with_a_missing_chunk_is_a_miss(self):
+        c = self._cache()
+        c.set('k', 'x' * 1000)
+        with c._locked() as mm:
+            key = c.make_and_validate_key('k').encode()
+            c._drop_chunks(mm, c._find_slot(mm, key, _hash_key(key))[0], key)
+        self.assertIsNone(c.get('k'))
+
+    def test_values_past_the_chunk_limit_are_counted_and_logged(self):
+        c = self._cache(max_chunks=2)
+        c.set('k', 'small')
+        with self.assertLogs('main.mmapcache', 'WARNING'):
+            c.set('k', 'x' * 1000)
+        self.assertIsNone(c.get('k'))
+        self.assertEqual(c.oversized, 1)
+
+    def test_clock_gives_referenced_slots_a_second_chance(self):
+        # A single bucket of four slots.
+        c = self._cache(slots=4, ways=4)
+        for key in 'abcd':
+            c.set(key, key)
+        # Every slot is referenced, so the sweep clears all of them and
+        # evicts the slot it started from.
+        c.set('e', 'e')
+        self.assertIsNone(c.get('a'))
+        # b is read again and survives; c, unreferenced, goes.
+        self.assertEqual(c.get('b'), 'b')
+        c.set('f', 'f')
+        self.assertEqual(c.get_many(['b', 'c', 'd', 'e', 'f']), {'b': 'b', 'd': 'd', 'e': 'e', 'f': 'f'})
+
+    def test_reader_does_not_return_a_slot_being_written(self):
+        c = self._cache(slots=4, ways=4)
+        c.set('k', 'v')
+        mm = c._map()
+        offset = next(
+            c._slot_offset(i) for i in range(4) if SLOT_HEADER.unpack_from(mm, c._slot_offset(i))[2]
+        )
+        seq = SEQ.unpack_from(mm, offset)[0]
+        # A writer makes the counter odd for the duration of its write.
+        SEQ.pack_into(mm, offset, seq + 1)
+        self.assertIsNone(c.get('k'))
+        SEQ.pack_into(mm, offset, seq + 2)
+        self.assertEqual(c.get('k'), 'v')
+
+    def test_forked_child_maps_the_file_again(self):
+        c = self._cache()
+        c.set('k', 'parent')
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                ok = c.get('k') == 'parent' and c._pid == os.getpid()
+                c.set('k', 'child')
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(c.get('k'), 'child')
+
+
+class RateLimitTests(SimpleTestCase):
+    def _middleware(self, **conf):
+        with override_settings(RATE_LIMIT={**RATE_LIMIT_DEFAULTS, 'REFILL_PER_SECOND': 0, **conf}):
+            return RateLimitMiddleware(lambda request: HttpResponse())
+
+    def _request(self, path, ip='10.0.0.1', body=None):
+        factory = RequestFactory(REMOTE_ADDR=ip)
+        if body is None:
+            request = factory.get(path)
+        else:
+            request = factory.post(path, json.dumps(body), content_type='application/json')
+        request.resolver_match = resolve(request.path)
+        return request
+
+    def _allowed(self, middleware, request):
+        return middleware.process_view(request, request.resolver_match.func, (), {}) is None
+
+    def test_bucket_empties_per_client(self):
+        middleware = self._middleware(CAPACITY=3)
+        self.assertEqual([self._allowed(middleware, self._request('/api/courses')) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(self._allowed(middleware, self._request('/api/courses', ip='10.0.0.2')))
+        response = middleware.process_view(self._request('/api/courses'), None, (), {})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_search_costs_more(self):
+        middleware = self._middleware(CAPACITY=5, SEARCH_COST=4, SEARCH_ROUTES=['api_courses'])
+        self.assertTrue(self._allowed(middleware, self._request('/api/courses?q=python')))
+        self.assertFalse(self._allowed(middleware, self._request('/api/courses?q=python')))
+
+    def test_batch_costs_the_sum_of_its_sub_requests(self):
+        middleware = self._middleware(CAPACITY=10, SEARCH_COST=4, SEARCH_ROUTES=['api_courses'])
+        searches = {'requests': [{'path': '/api/courses?q=x'} for _ in range(3)]}
+        self.assertFalse(self._allowed(middleware, self._request('/api/batch', body=searches)))
+        reads = {'requests': [{'path': '/api/courses'} for _ in range(2)]}
+        self.assertTrue(self._allowed(middleware, self._request('/api/batch', body=reads)))
+        self.assertEqual(middleware.buckets['ip:10.0.0.1'][0], 8)
+
+    def test_one_slow_request_does_not_shed(self):
+        middleware = self._middleware(LATENCY_THRESHOLD=1.0)
+        for elapsed in [10.0] + [0.01] * (RATE_LIMIT_DEFAULTS['LATENCY_MIN_SAMPLES'] - 1):
+            middleware._record(elapsed)
+        self.assertEqual(middleware(self._request('/api/courses')).status_code, 200)
+
+    def test_sustained_latency_sheds_until_the_window_passes(self):
+        middleware = self._middleware(LATENCY_THRESHOLD=1.0, LATENCY_MIN_SAMPLES=5, LATENCY_WINDOW=10)
+        for _ in range(5):
+            middleware._record(3.0)
+        response = middleware(self._request('/api/courses'))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        middleware.shed_until = 0
+        self.assertEqual(middleware(self._request('/api/courses')).status_code, 200)
+
+
+# (courses, modules per course, purchases by the learner, page size). Every
+# route must run the same number of queries against both datasets.
+SMALL = (3, 2, 2, 2)
+LARGE = (14, 9, 12, 10)
+
+
+SAVEPOINT = re.compile(r'^(RELEASE |ROLLBACK TO )?SAVEPOINT ')
+
+
+PASSWORD = 'correct horse'
+# Hashed once; hashing per dataset would dominate the run time.
+PASSWORD_HASH = make_password(PASSWORD)
+STORED_PDF = f'modules/{"0" * 64}.pdf'
+
+
+class Dataset:
+    def __init__(self, courses: int, modules: int, purchases: int, limit: int):
+        self.limit = limit
+        self.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_administrator=True)
+        self.learner = CustomUser.objects.create(
+            username='learner', email='learner@example.com', balance=10 ** 6, password=PASSWORD_HASH,
+        )
+        for i in range(courses):
+            CustomUser.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+        self.courses = [
+            CourseEntry.objects.create(
+                title=f'Course {i}', description='Learn things', instructor=f'Instructor {i % 3}',
+                topics=['python', f'topic{i % 4}'], price=100, module_count=modules,
+            )
+            for i in range(courses)
+        ]
+        self.modules = {
+            course.id: [
+                ModuleEntry.objects.create(course=course, title=f'Module {j}', description='Watch this', order=j + 1)
+                for j in range(modules)
+            ]
+            for course in self.courses
+        }
+        # The learner owns the first `purchases` courses and has finished the first one.
+        for course in self.courses[:purchases]:
+            CoursePurchase.objects.create(user=self.learner, course=course)
+        CourseEntry.objects.filter(id__in=[c.id for c in self.courses[:purchases]]).update(purchase_count=1)
+        self.completed_at = timezone.now() - datetime.timedelta(days=3)
+        ModuleProgress.objects.bulk_create(
+            ModuleProgress(user=self.learner, module=m, is_completed=True, completed_at=self.completed_at)
+            for m in self.modules[self.owned.id]
+        )
+        self.certificate_id = certificates.sign(self.learner.id, self.owned.id, self.completed_at.date())
+        self.credit_batch = CreditBatch.objects.create(delta=5, reason='test', created_by=self.admin)
+        self.trace_id = uuid.uuid4().hex
+        tracing.buffer.add(tracing.Trace(self.trace_id, max_spans=10))
+        self.anonymous = Client(HTTP_HOST='localhost')
+        self.admin_api = self._api_client(self.admin)
+        self.learner_api = self._api_client(self.learner)
+        self.learner_web = Client(HTTP_HOST='localhost')
+        self.learner_web.force_login(self.learner)
+
+    @property
+    def owned(self):
+        return self.courses[0]
+
+    @property
+    def unowned(self):
+        return self.courses[-1]
+
+    def module_ids(self, course=None):
+        return [str(m.id) for m in self.modules[(course or self.owned).id]]
+
+    @staticmethod
+    def _api_client(user):
+        token = encode_token({'id': str(user.id), 'username': user.username, 'is_admin': user.is_administrator})
+        return Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+
+def _json(client, method, path, body):
+    return getattr(client, method)(path, json.dumps(body), content_type='application/json')
+
+def _png(width: int = 800, height: int = 600) -> bytes:
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(out, 'PNG')
+    return out.getvalue()
+
+
+# name -> (query budget, request). Each request gets a freshly seeded dataset.
+ROUTES = {
+    'home': (2, lambda d: d.anonymous.get(f'/?limit={d.limit}')),
+    'course_detail': (5, lambda d: d.learner_web.get(f'/course/{d.owned.id}/')),
+    'course_detail_buy': (11, lambda d: d.learner_web.post(f'/course/{d.unowned.id}/')),
+    'course_modules': (5, lambda d: d.learner_web.get(f'/course/{d.owned.id}/modules/')),
+    'my_courses': (4, lambda d: d.learner_web.get(f'/my-courses/?limit={d.limit}')),
+    'profile': (2, lambda d: d.learner_web.get('/profile/')),
+    'mark_module_complete': (8, lambda d: d.learner_web.post(
+        f'/module/{d.module_ids(d.courses[1])[0]}/complete/')),
+    'download_certificate': (6, lambda d: d.learner_web.get(f'/course/{d.owned.id}/certificate/')),
+    'api_self': (1, lambda d: d.learner_api.get('/api/auth/self')),
+    'api_courses': (5, lambda d: d.anonymous.get(f'/api/courses?limit={d.limit}&sort=popular')),
+    'api_courses_create': (7, lambda d: _json(d.admin_api, 'post', '/api/courses', {
+        'title': 'New', 'description': 'New course', 'instructor': 'Someone', 'topics': ['python', 'new'], 'price': 10,
+    })),
+    'api_my_courses': (5, lambda d: d.learner_api.get(f'/api/courses/my-courses?limit={d.limit}')),
+    'api_course_autocomplete': (0, lambda d: d.anonymous.get('/api/courses/autocomplete?q=cou')),
+    'api_course_search': (1, lambda d: d.anonymous.get('/api/courses/search?q=learn')),
+    'api_courses_similar': (1, lambda d: d.anonymous.get(f'/api/courses/similar?ids={d.owned.id},{d.unowned.id}')),
+    'api_changes': (3, lambda d: d.anonymous.get(f'/api/changes?limit={d.limit}')),
+    'api_course_detail': (1, lambda d: d.anonymous.get(f'/api/courses/{d.owned.id}')),
+    'api_course_update': (8, lambda d: _json(d.admin_api, 'put', f'/api/courses/{d.owned.id}', {
+        'title': 'Renamed', 'topics': ['python', 'renamed'],
+    })),
+    'api_course_delete': (13, lambda d: d.admin_api.delete(f'/api/courses/{d.owned.id}')),
+    'api_course_view': (4, lambda d: d.learner_api.get(f'/api/courses/{d.owned.id}/view')),
+    'api_course_recommendations': (0, lambda d: d.anonymous.get(f'/api/courses/{d.owned.id}/recommendations')),
+    'api_course_similar': (1, lambda d: d.anonymous.get(f'/api/courses/{d.owned.id}/similar')),
+    'api_course_modules': (5, lambda d: d.learner_api.get(f'/api/courses/{d.owned.id}/modules?limit={d.limit}')),
+    'api_course_modules_create': (6, lambda d: _json(d.admin_api, 'post', f'/api/courses/{d.owned.id}/modules', {
+        'title': 'Extra', 'description': 'More', 'order': 99,
+    })),
+    'api_module_detail': (3, lambda d: d.learner_api.get(f'/api/modules/{d.module_ids()[0]}')),
+    'api_module_update': (4, lambda d: _json(d.admin_api, 'put', f'/api/modules/{d.module_ids()[0]}', {
+        'title': 'Renamed',
+    })),
+    'api_module_delete': (9, lambda d: d.admin_api.delete(f'/api/modules/{d.module_ids()[0]}')),
+    'api_module_complete': (7, lambda d: d.learner_api.patch(f'/api/modules/{d.module_ids(d.courses[1])[0]}/complete')),
+    'api_module_complete_batch': (9, lambda d: _json(d.learner_api, 'patch', '/api/modules/complete', {
+        'module_ids': d.module_ids(d.courses[1]),
+    })),
+    'api_module_resume': (3, lambda d: d.learner_api.get(f'/api/modules/{d.module_ids()[0]}/resume')),
+    'api_module_reorder': (5, lambda d: _json(d.admin_api, 'patch', f'/api/courses/{d.owned.id}/modules/reorder', {
+        'module_order': [{'id': m, 'order': i + 1} for i, m in enumerate(reversed(d.module_ids()))],
+    })),
+    'api_activity': (3, lambda d: _json(d.learner_api, 'post', '/api/activity', {
+        'events': [{'module_id': m, 'position': 10, 'watched': 5} for m in d.module_ids()],
+    })),
+    'api_buy_course': (8, lambda d: d.learner_api.post(f'/api/courses/{d.unowned.id}/buy')),
+    'api_course_purchase_status': (3, lambda d: d.learner_api.get(f'/api/courses/{d.owned.id}/purchase')),
+    'api_course_certificate': (5, lambda d: d.learner_api.get(f'/api/courses/{d.owned.id}/certificate')),
+    'api_certificate_verify': (0, lambda d: d.anonymous.get(f'/api/certificates/{d.certificate_id}')),
+    'api_certificate_revoke': (4, lambda d: _json(d.admin_api, 'post', '/api/certificates/revoke', {
+        'certificate_id': d.certificate_id,
+    })),
+    'api_batch': (7, lambda d: _json(d.learner_api, 'post', '/api/batch', {'requests': [
+        {'method': 'GET', 'path': f'/api/courses/{course.id}'} for course in d.courses[:2]
+    ] + [{'method': 'GET', 'path': f'/api/courses/my-courses?limit={d.limit}'}]})),
+    'api_users': (3, lambda d: d.admin_api.get(f'/api/users?limit={d.limit}')),
+    'api_user_detail': (4, lambda d: d.admin_api.get(f'/api/users/{d.learner.id}')),
+    'api_user_balance': (5, lambda d: _json(d.admin_api, 'post', f'/api/users/{d.learner.id}/balance', {
+        'increment': 5,
+    })),
+    'api_bulk_credit': (5, lambda d: _json(d.admin_api, 'post', '/api/users/balance/bulk', {
+        'increment': 5, 'user_ids': list(CustomUser.objects.values_list('id', flat=True)),
+    })),
+    'api_bulk_credit_detail': (2, lambda d: d.admin_api.get(f'/api/users/balance/bulk/{d.credit_batch.id}')),
+    'api_traces': (1, lambda d: d.admin_api.get('/api/traces')),
+    'api_trace_detail': (1, lambda d: d.admin_api.get(f'/api/traces/{d.trace_id}')),
+    'api_course_thumbnail': (4, lambda d: d.admin_api.post(f'/api/courses/{d.owned.id}/thumbnail', {
+        'file': SimpleUploadedFile('cover.png', _png()),
+    })),
+    'api_module_content': (4, lambda d: d.admin_api.post(f'/api/modules/{d.module_ids()[0]}/content', {
+        'pdf': SimpleUploadedFile('notes.pdf', b'%PDF-1.4 notes'),
+    })),
+    'api_register': (4, lambda d: _json(d.anonymous, 'post', '/api/auth/register', {
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'first_name': 'New', 'last_name': 'Comer',
+        'password': PASSWORD, 'confirm_password': PASSWORD,
+    })),
+    'api_login': (1, lambda d: _json(d.anonymous, 'post', '/api/auth/login', {
+        'identifier': 'learner', 'password': PASSWORD,
+    })),
+    'register': (8, lambda d: d.anonymous.post('/register/', {
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'password': PASSWORD,
+    })),
+    'login': (5, lambda d: d.anonymous.post('/login/', {'username': 'learner', 'password': PASSWORD})),
+    'logout': (4, lambda d: d.learner_web.get('/logout/')),
+    'media_file': (0, lambda d: d.anonymous.get(f'/media/{STORED_PDF}')),
+}
+
+# Routes answered from an offline index, with the part of the response that
+# must not be empty. An empty answer means the index was never consulted.
+INDEXED = {
+    'api_course_search': lambda data: data,
+    'api_courses_similar': lambda data: all(data.values()),
+    'api_course_similar': lambda data: data['similar'],
+    'api_course_recommendations': lambda data: data['recommendations'],
+}
+
+
+@override_settings(
+    INVALIDATION_POLL_INTERVAL=None,
+    ACTIVITY_FLUSH_INTERVAL=60,
+    RATE_LIMIT={'ENABLED': False},
+    ACCESS_LOG={'ENABLED': False},
+    TRACING={'ENABLED': False},
+)
+class QueryCountTests(PrivateCacheMixin, TestCase):
+    """
+    Runs every route against a small and a large dataset with cold caches
+    and fails when the query count grows with the data or the page size, or
+    exceeds the route's budget.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        tmp = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(
+            TEXT_INDEX_PATH=os.path.join(tmp, 'text-index'),
+            TEXT_INDEX_RELOAD_INTERVAL=0,
+            RECOMMENDATIONS_PATH=os.path.join(tmp, 'recommendations.bin'),
+            RECOMMENDATIONS_RELOAD_INTERVAL=0,
+            MEDIA_LOCAL_STORAGE=True,
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+        ))
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'modules'))
+        with open(os.path.join(settings.MEDIA_ROOT, STORED_PDF), 'wb') as f:
+            f.write(b'%PDF-1.4 stored')
+        super().setUpClass()
+
+    def _capture(self, name, size):
+        budget, call = ROUTES[name]
+        with transaction.atomic():
+            data = Dataset(*size)
+            cache.clear()
+            # In-process indexes are built at preload and the others offline,
+            # not by requests.
+            course_index.build()
+            CourseService.build_text_index()
+            CourseService.build_recommendations()
+            certificates.revocations.refresh()
+            with CaptureQueriesContext(connection) as queries:
+                response = call(data)
+            # Buffered activity belongs to this dataset, not the next one.
+            activity.buffer.flush()
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 500, f"{name} failed with {response.status_code}")
+        if name in INDEXED:
+            self.assertTrue(INDEXED[name](response.json()['data']), f"{name} answered without its index")
+        # Savepoints only appear because the test runs inside a transaction.
+        return budget, [q['sql'] for q in queries.captured_queries if not SAVEPOINT.match(q['sql'])]
+
+    def test_query_counts_are_constant_and_within_budget(self):
+        for name in ROUTES:
+            with self.subTest(route=name):
+                budget, small = self._capture(name, SMALL)
+                _, large = self._capture(name, LARGE)
+                report = '\n'.join(f'  {i + 1}. {sql}' for i, sql in enumerate(large))
+                self.assertEqual(
+                    len(small), len(large),
+                    f"{name}: {len(small)} queries on the small dataset, {len(large)} on the large one:\n{report}",
+                )
+                self.assertLessEqual(len(large), budget, f"{name}: over its budget of {budget}:\n{report}")
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None, ACTIVITY_FLUSH_INTERVAL=60)
+class ActivityFlushTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 1, 5)
+        self.buffer = activity.ActivityBuffer(ModuleService.record_activity)
+        self.addCleanup(self.buffer.stopped.set)
+
+    def _heartbeat(self, user, module):
+        self.assertTrue(self.buffer.add(user.id, [
+            {'module_id': module.id, 'position': 30.0, 'watched': 10.0, 'duration': None, 'ended': False},
+        ]))
+
+    def test_entries_of_deleted_modules_and_users_are_dropped(self):
+        kept, deleted = self.data.modules[self.data.owned.id]
+        other = CustomUser.objects.create(username='gone', email='gone@example.com')
+        self._heartbeat(self.data.learner, kept)
+        self._heartbeat(self.data.learner, deleted)
+        self._heartbeat(other, kept)
+        deleted.delete()
+        other.delete()
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending, {})
+        self.assertEqual(
+            list(ModuleActivity.objects.values_list('user_id', 'module_id')), [(self.data.learner.id, kept.id)]
+        )
+        self._heartbeat(self.data.learner, kept)
+        self.assertEqual(self.buffer.flush(), 1)
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class CertificateTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 2, 5)
+
+    def test_id_carries_the_completion_date_and_is_stable(self):
+        issued = CourseService.issue_certificate(self.data.learner, self.data.owned)
+        self.assertEqual(issued['completed_on'], self.data.completed_at.date())
+        self.assertEqual(issued['certificate_id'], self.data.certificate_id)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=30)):
+            again = CourseService.issue_certificate(self.data.learner, self.data.owned)
+        self.assertEqual(again['certificate_id'], issued['certificate_id'])
+
+    def test_completing_the_last_module_dates_the_certificate(self):
+        course = self.data.unowned
+        self.assertIsNone(CourseService.issue_certificate(self.data.learner, course))
+        ModuleService.mark_completed_bulk([self.data.learner.id], [m.id for m in self.data.modules[course.id]])
+        issued = CourseService.issue_certificate(self.data.learner, course)
+        self.assertEqual(issued['completed_on'], timezone.localdate())
+
+    def test_requires_a_purchase_and_at_least_one_module(self):
+        empty = CourseEntry.objects.create(title='Empty', topics=[], price=0)
+        CoursePurchase.objects.create(user=self.data.learner, course=empty)
+        self.assertIsNone(CourseService.issue_certificate(self.data.learner, empty))
+
+        stranger = CustomUser.objects.create(username='stranger', email='stranger@example.com')
+        ModuleService.mark_completed_bulk([stranger.id], self.data.module_ids())
+        self.assertIsNone(CourseService.issue_certificate(stranger, self.data.owned))
+
+    def test_pdf_prints_the_completion_date(self):
+        from reportlab.pdfgen.canvas import Canvas
+
+        with mock.patch.object(Canvas, 'drawString', autospec=True) as draw:
+            response = self.data.learner_web.get(f'/course/{self.data.owned.id}/certificate/')
+        self.assertEqual(response.status_code, 200)
+        printed = [call.args[3] for call in draw.call_args_list]
+        self.assertIn(f"Date: {self.data.completed_at.date().strftime('%B %d, %Y')}", printed)
+        self.assertIn(f"Certificate ID: {self.data.certificate_id}", printed)
+
+    def test_verify_and_revoke_round_trip(self):
+        certificate_id = self.data.certificate_id
+        fields = certificates.verify(certificate_id)
+        self.assertEqual(
+            (fields['user_id'], fields['course_id'], fields['completed_on'], fields['revoked']),
+            (self.data.learner.id, self.data.owned.id, self.data.completed_at.date(), False),
+        )
+        tampered = certificate_id[:-2] + ('A' if certificate_id[-2] != 'A' else 'B') + certificate_id[-1]
+        self.assertIsNone(certificates.verify(tampered))
+        self.assertIsNone(certificates.verify('not-a-certificate'))
+
+        CourseService.revoke_certificate(certificate_id, 'test')
+        certificates.revocations.refresh()
+        self.assertTrue(certificates.verify(certificate_id)['revoked'])
+        other = certificates.sign(self.data.learner.id, self.data.courses[1].id, self.data.completed_at.date())
+        self.assertFalse(certificates.verify(other)['revoked'])
+
+
+class PrefixIndexTests(TestCase):
+    def test_upsert_takes_popularity_from_the_course(self):
+        data = Dataset(3, 1, 1, 5)
+        index = PrefixIndex()
+        index.build()
+        self.assertEqual(index.search('course', 1)[0]['id'], str(data.owned.id))
+
+        course = data.courses[2]
+        CourseEntry.objects.filter(id=course.id).update(purchase_count=5)
+        index.on_course_changed(str(course.id))
+        self.assertEqual(index.search('course', 1)[0]['id'], str(course.id))
+
+
+class TextIndexTests(TestCase):
+    def test_build_refuses_a_directory_others_can_write(self):
+        path = self.enterContext(tempfile.TemporaryDirectory())
+        os.chmod(path, 0o777)
+        with self.assertRaises(ImproperlyConfigured):
+            CourseService.build_text_index(path=path)
+
+    def test_delta_only_takes_courses_whose_text_changed(self):
+        data = Dataset(3, 1, 1, 5)
+        path = self.enterContext(tempfile.TemporaryDirectory())
+        CourseService.build_text_index(path=path)
+        index = TextIndex(path)
+        self.assertTrue(index.ensure_loaded())
+        sold, renamed, deleted = (str(c.id) for c in data.courses)
+
+        CourseEntry.objects.filter(id=sold).update(purchase_count=7)
+        index.on_course_changed(sold)
+        self.assertEqual(index.delta, {})
+
+        CourseEntry.objects.filter(id=renamed).update(title='Things things')
+        CourseEntry.objects.filter(id=deleted).delete()
+        index.on_course_changed(renamed)
+        index.on_course_changed(deleted)
+        self.assertEqual(set(index.delta), {renamed, deleted})
+        self.assertIsNone(index.delta[deleted][1])
+        self.assertEqual(index.search('things')[0]['course_id'], renamed)
+
+    def test_counter_updates_skip_the_index(self):
+        data = Dataset(1, 1, 1, 5)
+        from main.textindex import text_index
+
+        self.assertIn(text_index.on_course_changed, invalidation._listeners['course'])
+        self.assertNotIn(text_index.on_course_changed, invalidation._listeners['course.counters'])
+        CourseRepository.recount_purchases(data.owned.id)
+        self.assertEqual(InvalidationEvent.objects.latest('id').entity, 'course.counters')
+
+    def test_reset_rebuilds_the_delta_from_the_database(self):
+        data = Dataset(3, 1, 1, 5)
+        path = self.enterContext(tempfile.TemporaryDirectory())
+        CourseService.build_text_index(path=path)
+        index = TextIndex(path)
+        self.assertTrue(index.ensure_loaded())
+        _, renamed, deleted = data.courses
+        renamed_id, deleted_id = str(renamed.id), str(deleted.id)
+
+        CourseRepository.update(renamed, {'title': 'Things things'})
+        CourseRepository.delete(deleted)
+        index.reset()
+        self.assertEqual(set(index.delta), {renamed_id, deleted_id})
+        self.assertIsNone(index.delta[deleted_id][1])
+        found = [r['course_id'] for r in index.search('things')]
+        self.assertEqual(found[0], renamed_id)
+        self.assertNotIn(deleted_id, found)
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class MediaUploadTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(1, 1, 0, 5)
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_LOCAL_STORAGE=True, MEDIA_ROOT=self.root, THUMBNAIL_SIZES=(320,)))
+
+    def _stored(self):
+        return sorted(
+            os.path.relpath(os.path.join(d, f), self.root) for d, _, files in os.walk(self.root) for f in files
+        )
+
+    def _thumbnail(self, content: bytes):
+        upload = SimpleUploadedFile('cover.png', content, content_type='image/png')
+        return self.data.admin_api.post(f'/api/courses/{self.data.courses[0].id}/thumbnail', {'file': upload})
+
+    def test_thumbnail_is_stored_with_its_derivatives(self):
+        response = self._thumbnail(_png())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self._stored()), 2)
+        self.assertTrue(response.json()['data']['thumbnail_image'].endswith('_320.jpg'))
+
+    def test_undecodable_image_is_rejected_and_removed(self):
+        response = self._thumbnail(b'\x89PNG\r\n\x1a\n' + b'\0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._stored(), [])
+
+    def test_image_over_the_pixel_limit_is_rejected(self):
+        with override_settings(MEDIA_MAX_IMAGE_PIXELS=1000):
+            response = self._thumbnail(_png(100, 100))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._stored(), [])
+
+    def test_invalid_video_stores_nothing(self):
+        module = self.data.modules[self.data.courses[0].id][0]
+        response = self.data.admin_api.post(f'/api/modules/{module.id}/content', {
+            'pdf': SimpleUploadedFile('notes.pdf', b'%PDF-1.4 notes'),
+            'video': SimpleUploadedFile('lesson.exe', b'MZ'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._stored(), [])
+        module.refresh_from_db()
+        self.assertFalse(module.pdf_content)
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None, CHANGES_SAFETY_WINDOW=0, TOMBSTONE_RETENTION=60)
+class ChangesTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(3, 2, 1, 5)
+
+    def _sync(self, cursor=None, limit=2, at=None):
+        query = f'?limit={limit}' + (f'&since={cursor}' if cursor else '')
+        with mock.patch('django.utils.timezone.now', return_value=at or timezone.now()):
+            return self.data.anonymous.get(f'/api/changes{query}')
+
+    def _sync_all(self, cursor=None):
+        seen = {'courses': set(), 'modules': set(), 'deleted': set()}
+        while True:
+            body = self._sync(cursor).json()
+            for name, ids in seen.items():
+                ids.update(row['id'] for row in body['data'][name])
+            cursor = body['cursor']
+            if not body['has_more']:
+                return seen, cursor
+
+    def test_pages_through_the_catalog_then_only_new_changes(self):
+        seen, cursor = self._sync_all()
+        self.assertEqual(seen['courses'], {str(c.id) for c in self.data.courses})
+        self.assertEqual(seen['modules'], {m for c in self.data.courses for m in self.data.module_ids(c)})
+
+        seen, cursor = self._sync_all(cursor)
+        self.assertEqual(seen, {'courses': set(), 'modules': set(), 'deleted': set()})
+
+        course = self.data.unowned
+        self.data.admin_api.delete(f'/api/courses/{course.id}')
+        seen, _ = self._sync_all(cursor)
+        self.assertEqual(seen['deleted'], {str(course.id), *self.data.module_ids(course)})
+
+    def test_cursor_kept_in_use_does_not_expire(self):
+        now = timezone.now()
+        first = self._sync(at=now).json()['cursor']
+        cursor = first
+        for minutes in (1, 2, 3):
+            response = self._sync(cursor, at=now + datetime.timedelta(minutes=minutes))
+            self.assertEqual(response.status_code, 200)
+            cursor = response.json()['cursor']
+        self.assertEqual(self._sync(first, at=now + datetime.timedelta(minutes=3)).status_code, 410)
+
+    def test_malformed_cursor_is_rejected(self):
+        self.assertEqual(self._sync('not-a-cursor').status_code, 400)
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class FieldProjectionTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 1, 5)
+
+    def test_only_requested_fields_are_returned(self):
+        course = self.data.owned
+        body = self.data.anonymous.get('/api/courses?fields=title,id,title').json()
+        self.assertEqual([list(row) for row in body['data']], [['title', 'id']] * 2)
+
+        data = self.data.anonymous.get(f'/api/courses/{course.id}?fields=purchase_count').json()['data']
+        self.assertEqual(data, {'purchase_count': 1})
+
+        rows = self.data.learner_api.get(f'/api/courses/{course.id}/modules?fields=id,is_completed').json()['data']
+        self.assertEqual(rows, [{'id': m, 'is_completed': True} for m in self.data.module_ids(course)])
+
+    def test_unknown_field_is_rejected(self):
+        course = self.data.owned
+        for path, unknown in (('/api/courses?fields=title,bogus', 'bogus'),
+                              (f'/api/courses/{course.id}?fields=nope', 'nope')):
+            response = self.data.anonymous.get(path)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(response.json()['message'], f"Unknown field(s): {unknown}")
+        response = self.data.learner_api.get(f'/api/courses/{course.id}/modules?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class BatchTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 2, 5)
+        self.module_id = self.data.module_ids(self.data.courses[1])[0]
+
+    def _batch(self, *requests):
+        response = _json(self.data.learner_api, 'post', '/api/batch', {'requests': list(requests)})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_writes_run_in_order_between_reads(self):
+        path = f'/api/modules/{self.module_id}'
+        results = self._batch(
+            {'id': 'before', 'path': f'{path}?fields=is_completed'},
+            {'id': 'complete', 'method': 'PATCH', 'path': f'{path}/complete'},
+            {'id': 'after', 'path': f'{path}?fields=is_completed'},
+        )
+        self.assertEqual([r['id'] for r in results], ['before', 'complete', 'after'])
+        self.assertEqual([r['status'] for r in results], [200, 200, 200])
+        self.assertFalse(results[0]['body']['data']['is_completed'])
+        self.assertTrue(results[2]['body']['data']['is_completed'])
+
+    def test_runs_of_reads_go_to_the_pool_outside_a_transaction(self):
+        threads = {}
+
+        def call_in_thread(parent, user, entry):
+            threads[entry['id']] = threading.current_thread().name
+            return {'id': entry['id'], 'status': 200, 'body': None}
+
+        with mock.patch.object(batch, '_call_in_thread', call_in_thread), \
+                mock.patch.object(batch, 'connection', mock.Mock(in_atomic_block=False)):
+            results = self._batch(
+                {'id': 'a', 'path': '/api/courses'},
+                {'id': 'b', 'path': '/api/courses/my-courses'},
+                {'id': 'write', 'method': 'PATCH', 'path': f'/api/modules/{self.module_id}/complete'},
+                {'id': 'c', 'path': '/api/courses'},
+            )
+        self.assertEqual([r['id'] for r in results], ['a', 'b', 'write', 'c'])
+        self.assertEqual(set(threads), {'a', 'b'})
+        self.assertTrue(all(name.startswith('batch') for name in threads.values()))
+        self.assertTrue(ModuleProgress.objects.filter(module_id=self.module_id, is_completed=True).exists())
+
+    def test_each_sub_request_reports_its_own_status(self):
+        results = self._batch(
+            {'id': 'ok', 'path': f'/api/courses/{self.data.owned.id}'},
+            {'id': 'missing', 'path': f'/api/courses/{uuid.uuid4()}'},
+            {'id': 'no-route', 'path': '/api/nowhere'},
+            {'id': 'excluded', 'method': 'POST', 'path': '/api/auth/login', 'body': {}},
+            {'path': '/api/courses?fields=bogus'},
+        )
+        self.assertEqual(
+            [(r['id'], r['status']) for r in results],
+            [('ok', 200), ('missing', 404), ('no-route', 404), ('excluded', 404), (4, 400)],
+        )
+        self.assertEqual(results[0]['body']['data']['id'], str(self.data.owned.id))
+        self.assertIsNone(results[2]['body'])
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class TracingTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 1, 5)
+        tracing.buffer.clear()
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0})
+    def test_incoming_trace_id_is_kept_and_forces_sampling(self):
+        traceparent = f'00-{"a" * 32}-{"b" * 16}-01'
+        for headers, expected in (
+            ({'HTTP_X_TRACE_ID': 'client-42'}, 'client-42'),
+            ({'HTTP_TRACEPARENT': traceparent}, 'a' * 32),
+            ({'HTTP_X_TRACE_ID': 'client-42', 'HTTP_TRACEPARENT': traceparent}, 'client-42'),
+        ):
+            with self.subTest(headers=headers):
+                response = self.data.anonymous.get('/api/courses', **headers)
+                self.assertEqual(response['X-Trace-Id'], expected)
+                self.assertEqual(tracing.buffer.get(expected)['view'], 'api_courses')
+
+    @override_settings(TRACING={'SAMPLE_RATE': 0})
+    def test_malformed_trace_ids_are_ignored(self):
+        for headers in ({'HTTP_X_TRACE_ID': 'bad id!'}, {'HTTP_TRACEPARENT': '00-xyz-01'}):
+            with self.subTest(headers=headers):
+                self.assertIsNone(tracing.incoming_trace_id(headers, 'X-Trace-Id'))
+                self.assertNotIn('X-Trace-Id', self.data.anonymous.get('/api/courses', **headers))
+
+    @override_settings(TRACING={'MAX_SPANS': 2})
+    def test_spans_past_the_cap_are_counted_not_kept(self):
+        self.data.learner_api.get(f'/api/courses/{self.data.owned.id}/view', HTTP_X_TRACE_ID='capped')
+        trace = tracing.buffer.get('capped')
+        self.assertEqual(trace['span_count'], 2)
+        self.assertEqual(len(trace['spans']), 2)
+        self.assertGreater(trace['dropped_spans'], 0)
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class EntityCacheTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 1, 5)
+        cache.clear()
+
+    def test_identity_map_reuses_instances_within_a_request(self):
+        course_id = str(self.data.owned.id)
+        with entity_cache.request_scope(), self.assertNumQueries(1):
+            first = CourseRepository.get(course_id)
+            self.assertIs(CourseRepository.get(course_id), first)
+        with entity_cache.request_scope(), self.assertNumQueries(0):
+            again = CourseRepository.get(course_id)
+        self.assertIsNot(again, first)
+        self.assertEqual(again.title, first.title)
+
+    def test_change_from_another_worker_is_picked_up_by_polling(self):
+        course = self.data.owned
+        invalidation.mark_synced()
+        CourseRepository.get(str(course.id))
+        CourseEntry.objects.filter(id=course.id).update(title='Renamed elsewhere')
+        InvalidationEvent.objects.create(entity='course', entity_id=str(course.id), origin='elsewhere:1')
+        self.assertEqual(CourseRepository.get(str(course.id)).title, course.title)
+
+        self.assertEqual(invalidation.poll(force=True), 1)
+        self.assertEqual(CourseRepository.get(str(course.id)).title, 'Renamed elsewhere')
+
+    def test_course_delete_drops_its_cached_modules(self):
+        course = self.data.unowned
+        course_id, module_ids = str(course.id), self.data.module_ids(course)
+        for module_id in module_ids:
+            self.assertIsNotNone(ModuleRepository.get(module_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            CourseRepository.delete(course)
+        self.assertIsNone(CourseRepository.get(course_id))
+        for module_id in module_ids:
+            self.assertIsNone(ModuleRepository.get(module_id))
+        response = self.data.learner_api.patch(f'/api/modules/{module_ids[0]}/complete')
+        self.assertEqual(response.status_code, 404)
+
+
+def _failing(payload):
+    raise RuntimeError('boom')
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class JobQueueTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(2, 2, 1, 5)
+        self.enterContext(mock.patch.dict(tasks._registry, {'test.fail': _failing}))
+        # Jobs enqueued by the test are due by then.
+        self.now = timezone.now() + datetime.timedelta(seconds=1)
+
+    def _at(self, seconds):
+        return mock.patch('django.utils.timezone.now', return_value=self.now + datetime.timedelta(seconds=seconds))
+
+    def test_rollback_drops_the_enqueued_job(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            tasks.enqueue('test.fail')
+            raise RuntimeError
+        self.assertFalse(Job.objects.exists())
+
+    def test_lease_hides_a_job_until_it_expires(self):
+        tasks.enqueue('test.fail')
+        with self._at(0):
+            [job] = JobRepository.claim(10, visibility_timeout=60)
+            self.assertEqual(JobRepository.claim(10, visibility_timeout=60), [])
+        with self._at(61):
+            self.assertFalse(JobRepository.start(job))
+            [again] = JobRepository.claim(10, visibility_timeout=60)
+        self.assertEqual(again.id, job.id)
+        self.assertEqual(JobRepository.mark_done([job]), 0)
+        self.assertEqual(Job.objects.get(id=job.id).attempts, 0)
+
+    def test_failures_back_off_then_dead_letter(self):
+        job = tasks.enqueue('test.fail', max_attempts=2)
+        self.enterContext(self.assertLogs('main.tasks', 'ERROR'))
+        with self._at(0):
+            self.assertEqual(len(tasks.run_batch()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), (Job.STATUS_PENDING, 1, 'boom'))
+        self.assertEqual(job.run_after, self.now + datetime.timedelta(seconds=tasks.retry_delay(1)))
+
+        with self._at(tasks.retry_delay(1) - 1):
+            self.assertEqual(tasks.run_batch(), [])
+        with self._at(tasks.retry_delay(1)):
+            self.assertEqual(len(tasks.run_batch()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+    def test_purchase_job_recounts_the_course(self):
+        course = self.data.unowned
+        ok, _, _ = PurchaseService.purchase_course(self.data.learner, course)
+        self.assertTrue(ok)
+        self.assertEqual(Job.objects.get().name, 'purchase.created')
+        tasks.enqueue('purchase.created', {'course_id': str(course.id)})
+        self.assertEqual(len(tasks.run_batch()), 2)
+        course.refresh_from_db()
+        self.assertEqual(course.purchase_count, 1)
+
+    def test_completion_job_prepares_the_certificate(self):
+        self.enterContext(override_settings(CERTIFICATE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        course = self.data.unowned
+        CoursePurchase.objects.create(user=self.data.learner, course=course)
+        module_ids = [m.id for m in self.data.modules[course.id]]
+        ModuleService.mark_completed_bulk([self.data.learner.id], module_ids[:1])
+        self.assertFalse(Job.objects.exists())
+        ModuleService.mark_completed_bulk([self.data.learner.id], module_ids)
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['course.completed'])
+
+        tasks.run_batch()
+        certificate = CourseService.issue_certificate(self.data.learner, course)
+        self.assertIsNotNone(certificates.prepared_certificate(self.data.learner, course, certificate))
+        response = self.data.learner_web.get(f'/course/{course.id}/certificate/')
+        self.assertTrue(response.streaming)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class RequestBodyTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(1, 1, 1, 5)
+
+    def _rejects(self, client, method, path, body):
+        response = _json(client, method, path, body)
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json()['status'], 'error')
+        return response.json()['message']
+
+    def test_module_completion_needs_an_object_with_module_ids(self):
+        path = '/api/modules/complete'
+        self.assertEqual(self._rejects(self.data.learner_api, 'patch', path, []), "Request body must be a JSON object")
+        self._rejects(self.data.learner_api, 'patch', path, {'module_ids': 'x'})
+        self._rejects(self.data.learner_api, 'patch', path, {'module_ids': ['not-a-uuid']})
+
+    def test_bulk_credit_needs_an_object_with_an_increment(self):
+        path = '/api/users/balance/bulk'
+        self.assertEqual(self._rejects(self.data.admin_api, 'post', path, []), "Request body must be a JSON object")
+        self._rejects(self.data.admin_api, 'post', path, {'increment': 0})
+        self._rejects(self.data.admin_api, 'post', path, {'increment': 5, 'user_ids': ['x']})
+
+    def test_activity_rejects_non_finite_numbers(self):
+        module_id = self.data.module_ids(self.data.owned)[0]
+        for field in ('position', 'watched', 'duration'):
+            for value in (float('inf'), float('-inf'), float('nan')):
+                with self.subTest(field=field, value=value):
+                    event = {'module_id': module_id, field: value}
+                    message = self._rejects(self.data.learner_api, 'post', '/api/activity', {'events': [event]})
+                    self.assertEqual(message, "Invalid activity event")
+
+    def test_certificate_revocation_needs_an_object(self):
+        path = '/api/certificates/revoke'
+        self.assertEqual(self._rejects(self.data.admin_api, 'post', path, []), "Request body must be a JSON object")
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class BulkCreditTests(PrivateCacheMixin, TestCase):
+    def setUp(self):
+        self.data = Dataset(5, 1, 0, 5)
+        self.targets = list(CustomUser.objects.filter(username__startswith='user').values_list('id', flat=True))
+
+    def _balances(self):
+        return dict(CustomUser.objects.values_list('id', 'balance'))
+
+    def test_interrupted_batch_resumes_and_credits_each_user_once(self):
+        before = self._balances()
+        response = _json(self.data.admin_api, 'post', '/api/users/balance/bulk', {
+            'increment': 7, 'user_ids': self.targets + self.targets[:2],
+        })
+        self.assertEqual(response.status_code, 202)
+        batch_id = response.json()['data']['id']
+        Job.objects.update(payload={'batch_id': batch_id, 'chunk_size': 2})
+
+        apply_chunk = CreditRepository.apply_chunk
+        calls = []
+
+        def killed_after_first_chunk(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('worker killed')
+            return apply_chunk(*args, **kwargs)
+
+        with mock.patch.object(CreditRepository, 'apply_chunk', side_effect=killed_after_first_chunk), \
+                self.assertLogs('main.tasks', 'ERROR'):
+            tasks.run_batch()
+        credited = [uid for uid, balance in self._balances().items() if balance != before[uid]]
+        self.assertEqual(credited, sorted(self.targets)[:2])
+
+        later = timezone.now() + datetime.timedelta(seconds=tasks.retry_delay(1))
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            tasks.run_batch()
+        tasks.enqueue('credits.apply', {'batch_id': batch_id})
+        tasks.run_batch()
+
+        after = self._balances()
+        self.assertEqual({uid: after[uid] - before[uid] for uid in after}, {
+            uid: 7 if uid in self.targets else 0 for uid in after
+        })
+        detail = self.data.admin_api.get(f'/api/users/balance/bulk/{batch_id}').json()['data']
+        self.assertEqual((detail['status'], detail['applied_count']), ('done', len(self.targets)))
+
+
+@override_settings(INVALIDATION_POLL_INTERVAL=None)
+class InvalidationTests(TestCase):
+    def setUp(self):
+        self.seen = []
+        self.enterContext(mock.patch.dict(invalidation._listeners, {'thing': [self.seen.append]}))
+        invalidation.mark_synced()
+
+    def test_publish_dispatches_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidation.publish('thing', 1)
+            invalidation.publish_many('thing', [2, 3])
+            self.assertEqual(self.seen, [])
+        self.assertEqual(self.seen, ['1', '2', '3'])
+
+    def test_rolled_back_publish_leaves_no_event(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                invalidation.publish('thing', 1)
+                raise RuntimeError
+        self.assertEqual((callbacks, self.seen), ([], []))
+        self.assertFalse(InvalidationEvent.objects.exists())
+        self.assertEqual(invalidation.poll(force=True), 0)
+
+    def test_poll_applies_events_from_other_workers_only(self):
+        invalidation.publish('thing', 'mine')
+        InvalidationEvent.objects.create(entity='thing', entity_id='theirs', origin='elsewhere:1')
+        self.assertEqual(invalidation.poll(force=True), 1)
+        self.assertEqual(self.seen, ['theirs'])
+        self.assertEqual(invalidation.poll(force=True), 0)
+        self.assertEqual(self.seen, ['theirs'])
+
+    def test_prune_drops_events_past_retention(self):
+        InvalidationEvent.objects.create(entity='thing', entity_id='old', origin='elsewhere:1')
+        self.assertEqual(invalidation.prune(60), 0)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(seconds=61)):
+            self.assertEqual(invalidation.prune(60), 1)
+
+
+class RetryOnLockedTests(SimpleTestCase):
+    def setUp(self):
+        self.sleep = self.enterContext(mock.patch('main.db.time.sleep'))
+
+    def _failing(self, errors, message='database is locked'):
+        calls = []
+
+        @retry_on_locked(attempts=3)
+        def write():
+            calls.append(1)
+            if len(calls) <= errors:
+                raise OperationalError(message)
+            return 'written'
+        return write, calls
+
+    def test_retries_a_locked_write_with_backoff(self):
+        write, calls = self._failing(2)
+        self.assertEqual(write(), 'written')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_gives_up_after_its_attempts(self):
+        write, calls = self._failing(3)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self._failing(1, 'no such table: main_job')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual((len(calls), self.sleep.call_count), (1, 0))
+
+    def test_inside_an_atomic_block_the_error_goes_to_the_outer_retry(self):
+        write, calls = self._failing(1)
+        with mock.patch('main.db.connection', mock.Mock(in_atomic_block=True)), self.assertRaises(OperationalError):
+            write()
+        self.assertEqual((len(calls), self.sleep.call_count), (1, 0))
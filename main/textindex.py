@@ -0,0 +1,377 @@
+"""
+TF-IDF index over course titles, descriptions and topics, for "more like
+this" and relevance-ranked search.
+
+The base segment is built offline (manage.py build_text_index) into a new
+directory under TEXT_INDEX_PATH and published by swapping the `current`
+symlink. It holds L2-normalised TF-IDF rows as CSR arrays in .npy files,
+sorted by course id, which workers open with mmap_mode='r' so every worker
+on the host shares the same pages.
+
+Changes after the build arrive through the invalidation bus and go into a
+small per-worker delta segment, vectorised against the base vocabulary.
+Queries score the base and the delta together, skipping base rows the delta
+replaced, and answer several queries with one sparse matrix product. Once a
+newer base is published, delta entries older than its build are dropped.
+Counter updates go out as 'course.counters' events, which the index does not
+subscribe to. A reset rebuilds the delta from the courses changed or deleted
+since the base was built.
+
+NumPy and SciPy are imported on first use.
+"""
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from main import invalidation
+from main.models import CourseEntry, Tombstone
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[a-z0-9]{2,}')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by can for from has have in into is it its not of on or our '
+    'that the this to was were will with you your'.split()
+)
+TITLE_WEIGHT = 2
+QUERY_BATCH = 64
+KEEP_BUILDS = 2
+
+Vector = Tuple[Any, Any]
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall((text or '').lower()) if t not in STOP_WORDS]
+
+
+def document_terms(title: str, description: str, topics: Any) -> List[str]:
+    if isinstance(topics, str):
+        topics = [topics]
+    terms = tokenize(title) * TITLE_WEIGHT + tokenize(description)
+    for topic in topics or []:
+        terms += tokenize(str(topic))
+    return terms
+
+
+def _course_id(key: bytes) -> str:
+    # NumPy strips trailing NUL bytes from 'S16' items.
+    return str(uuid.UUID(bytes=bytes(key).ljust(16, b'\0')))
+
+
+def _root(path: Optional[str] = None) -> str:
+    return str(path or settings.TEXT_INDEX_PATH)
+
+
+def build(docs: Iterable[Tuple[Any, str, str, Any]], path: Optional[str] = None, max_terms: int = 200000) -> Dict[str, Any]:
+    """
+    Builds a base segment from (course_id, title, description, topics) rows
+    and publishes it as the current one.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    started = time.time()
+    vocab: Dict[str, int] = {}
+    keys: List[bytes] = []
+    indptr = array('q', [0])
+    columns = array('i')
+    for course_id, title, description, topics in docs:
+        keys.append(uuid.UUID(str(course_id)).bytes)
+        columns.extend(vocab.setdefault(term, len(vocab)) for term in document_terms(title, description, topics))
+        indptr.append(len(columns))
+
+    n = len(keys)
+    indptr_np = np.frombuffer(indptr, dtype=np.int64)
+    cols = np.frombuffer(columns, dtype=np.int32)
+    rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(indptr_np))
+    tf = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)), shape=(n, len(vocab)))
+    tf.sum_duplicates()
+
+    # Keep the max_terms most common terms.
+    df = np.bincount(tf.indices, minlength=len(vocab))
+    terms = np.array(list(vocab), dtype=object)
+    keep = np.sort(np.argsort(-df, kind='stable')[:max_terms])
+    tf = tf[:, keep].tocsr()
+    terms, df = terms[keep], df[keep]
+
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    tf.data = (1 + np.log(tf.data)) * idf[tf.indices]
+    row_of = np.repeat(np.arange(n), np.diff(tf.indptr))
+    norms = np.sqrt(np.bincount(row_of, weights=tf.data.astype(np.float64) ** 2, minlength=n)).astype(np.float32)
+    norms[norms == 0] = 1
+    tf.data /= norms[row_of]
+
+    ids = np.array(keys, dtype='S16')
+    order = np.argsort(ids, kind='stable')
+    matrix = tf[order].tocsr()
+    matrix.sort_indices()
+
+    root = _root(path)
+    os.makedirs(root, mode=0o700, exist_ok=True)
+    # Builds are published by symlink, so anyone who can write the root
+    # could point readers at their own arrays.
+    st = os.lstat(root)
+    if not os.path.isdir(root) or os.path.islink(root) or st.st_uid != os.geteuid() or st.st_mode & 0o022:
+        raise ImproperlyConfigured(f"Text index directory {root} must be owned by this user and not writable by others")
+    target = os.path.join(root, f"{int(started * 1000)}-{os.getpid()}")
+    os.makedirs(target)
+    np.save(os.path.join(target, 'ids.npy'), ids[order])
+    # SciPy casts indptr and indices to a common dtype, which would copy a
+    # memory-mapped array; store both in the one it will pick.
+    index_dtype = np.int32 if matrix.nnz < 2 ** 31 else np.int64
+    np.save(os.path.join(target, 'indptr.npy'), matrix.indptr.astype(index_dtype))
+    np.save(os.path.join(target, 'indices.npy'), matrix.indices.astype(index_dtype))
+    np.save(os.path.join(target, 'data.npy'), matrix.data.astype(np.float32))
+    np.save(os.path.join(target, 'idf.npy'), idf)
+    with open(os.path.join(target, 'vocab.json'), 'w') as f:
+        json.dump(terms.tolist(), f)
+    meta = {'built_at': started, 'courses': n, 'terms': len(terms), 'nonzeros': int(matrix.nnz)}
+    with open(os.path.join(target, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    link = os.path.join(root, 'current')
+    tmp_link = f"{link}.{os.getpid()}.tmp"
+    os.symlink(os.path.basename(target), tmp_link)
+    os.replace(tmp_link, link)
+
+    builds = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)) and d != 'current')
+    for old in builds[:-KEEP_BUILDS]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return meta
+
+
+def _same_vector(a: Optional[Vector], b: Optional[Vector]) -> bool:
+    import numpy as np
+
+    if a is None or b is None:
+        return a is b
+    return np.array_equal(a[0], b[0]) and np.allclose(a[1], b[1], rtol=1e-5, atol=0)
+
+
+class TextIndex:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.RLock()
+        self.base: Optional[Dict[str, Any]] = None
+        # course id -> (time of change, vector or None when deleted)
+        self.delta: Dict[str, Tuple[float, Optional[Vector]]] = {}
+        self._delta_matrix = None
+        self.checked = 0.0
+
+    def _current(self) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        if now - self.checked < getattr(settings, 'TEXT_INDEX_RELOAD_INTERVAL', 5):
+            return self.base
+        with self.lock:
+            self.checked = now
+            link = os.path.join(_root(self.path), 'current')
+            try:
+                target = os.path.join(_root(self.path), os.readlink(link))
+            except OSError:
+                return self.base
+            if self.base is None or self.base['dir'] != target:
+                try:
+                    self._load(target)
+                except (OSError, ValueError):
+                    logger.exception("Could not load text index %s, keeping the previous one", target)
+            return self.base
+
+    def _load(self, target: str) -> None:
+        import numpy as np
+        from scipy import sparse
+
+        def arr(name):
+            return np.load(os.path.join(target, name), mmap_mode='r')
+
+        with open(os.path.join(target, 'vocab.json')) as f:
+            terms = json.load(f)
+        with open(os.path.join(target, 'meta.json')) as f:
+            meta = json.load(f)
+        ids = arr('ids.npy')
+        matrix = sparse.csr_matrix(
+            (arr('data.npy'), arr('indices.npy'), arr('indptr.npy')), shape=(len(ids), len(terms)), copy=False
+        )
+        self.base = {
+            'dir': target,
+            'ids': ids,
+            'matrix': matrix,
+            'idf': arr('idf.npy'),
+            'vocab': {t: i for i, t in enumerate(terms)},
+            'built_at': meta['built_at'],
+        }
+        self.delta = {cid: entry for cid, entry in self.delta.items() if entry[0] >= meta['built_at']}
+        self._delta_matrix = None
+
+    def ensure_loaded(self) -> bool:
+        self.checked = 0.0
+        return self._current() is not None
+
+    def _vectorize(self, base: Dict[str, Any], terms: Sequence[str]) -> Vector:
+        import numpy as np
+
+        counts: Dict[int, int] = {}
+        for term in terms:
+            col = base['vocab'].get(term)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        cols = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+        vals = np.array([1 + math.log(counts[c]) for c in cols], dtype=np.float32) * base['idf'][cols]
+        norm = float(np.sqrt((vals.astype(np.float64) ** 2).sum()))
+        return cols, vals / norm if norm else vals
+
+    def on_course_changed(self, course_id: str) -> None:
+        if course_id == invalidation.ALL:
+            self.reset()
+            return
+        base = self._current()
+        if base is None:
+            return
+        row = CourseEntry.objects.filter(id=course_id).values_list('title', 'description', 'topics').first()
+        vector = self._vectorize(base, document_terms(*row)) if row else None
+        with self.lock:
+            # Price or thumbnail edits leave the indexed text alone and need
+            # no delta entry.
+            if _same_vector(self._vector_for(base, str(course_id)), vector):
+                return
+            self.delta[str(course_id)] = (time.time(), vector)
+            self._delta_matrix = None
+
+    def reset(self) -> None:
+        """
+        Rebuilds the delta from the database after this worker may have
+        missed events: every course updated or deleted since the base build.
+        """
+        with self.lock:
+            self.delta = {}
+            self._delta_matrix = None
+            self.checked = 0.0
+        base = self._current()
+        if base is None:
+            return
+        since = datetime.fromtimestamp(base['built_at'], tz=timezone.utc)
+        now = time.time()
+        delta: Dict[str, Tuple[float, Optional[Vector]]] = {
+            str(cid): (now, None)
+            for cid in Tombstone.objects.filter(entity='course', deleted_at__gte=since).values_list('entity_id', flat=True)
+        }
+        changed = CourseEntry.objects.filter(updated_at__gte=since).values_list('id', 'title', 'description', 'topics')
+        for cid, title, description, topics in changed.iterator():
+            delta[str(cid)] = (now, self._vectorize(base, document_terms(title, description, topics)))
+        with self.lock:
+            # Vectors are in the base's vocabulary; events handled meanwhile are newer.
+            if self.base is base:
+                self.delta = {**delta, **self.delta}
+                self._delta_matrix = None
+
+    def _delta(self, base: Dict[str, Any]):
+        import numpy as np
+        from scipy import sparse
+
+        with self.lock:
+            if self._delta_matrix is None:
+                live = [(cid, v) for cid, (_, v) in self.delta.items() if v is not None]
+                indptr = np.cumsum([0] + [len(v[0]) for _, v in live])
+                cols = np.concatenate([v[0] for _, v in live]) if live else np.zeros(0, dtype=np.int32)
+                vals = np.concatenate([v[1] for _, v in live]) if live else np.zeros(0, dtype=np.float32)
+                replaced = np.array([uuid.UUID(cid).bytes for cid in self.delta], dtype='S16')
+                pos = np.searchsorted(base['ids'], replaced)
+                found = pos < len(base['ids'])
+                found[found] = base['ids'][pos[found]] == replaced[found]
+                self._delta_matrix = (
+                    [cid for cid, _ in live],
+                    sparse.csr_matrix((vals, cols, indptr), shape=(len(live), len(base['vocab']))),
+                    pos[found],
+                )
+            return self._delta_matrix
+
+    def _vector_for(self, base: Dict[str, Any], course_id: str) -> Optional[Vector]:
+        import numpy as np
+
+        entry = self.delta.get(course_id)
+        if entry is not None:
+            return entry[1]
+        key = np.array([uuid.UUID(course_id).bytes], dtype='S16')
+        pos = int(np.searchsorted(base['ids'], key)[0])
+        if pos == len(base['ids']) or base['ids'][pos] != key[0]:
+            return None
+        row = base['matrix'][pos]
+        return row.indices, row.data
+
+    def _query(self, base: Dict[str, Any], vectors: List[Vector], limit: int,
+               exclude: Sequence[Optional[str]]) -> List[List[Dict[str, Any]]]:
+        import numpy as np
+        from scipy import sparse
+
+        delta_ids, delta_matrix, replaced_rows = self._delta(base)
+        results = []
+        for start in range(0, len(vectors), QUERY_BATCH):
+            chunk = vectors[start:start + QUERY_BATCH]
+            indptr = np.cumsum([0] + [len(v[0]) for v in chunk])
+            queries = sparse.csr_matrix(
+                (np.concatenate([v[1] for v in chunk]), np.concatenate([v[0] for v in chunk]), indptr),
+                shape=(len(chunk), len(base['vocab'])),
+            )
+            base_scores = (base['matrix'] @ queries.T).toarray()
+            base_scores[replaced_rows, :] = 0
+            delta_scores = (delta_matrix @ queries.T).toarray()
+
+            for q in range(len(chunk)):
+                column = base_scores[:, q]
+                k = min(limit + 1, len(column))
+                top = np.argpartition(-column, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+                candidates = [
+                    (float(column[i]), _course_id(base['ids'][i])) for i in top if column[i] > 0
+                ]
+                candidates += [(float(s), cid) for cid, s in zip(delta_ids, delta_scores[:, q]) if s > 0]
+                candidates.sort(key=lambda c: -c[0])
+                skip = exclude[start + q]
+                results.append([
+                    {'course_id': cid, 'score': round(score, 4)} for score, cid in candidates if cid != skip
+                ][:limit])
+        return results
+
+    def similar(self, course_ids: List[str], limit: int = 10) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Most similar courses for each id, answered as one batch. Ids that are
+        not indexed map to an empty list.
+        """
+        base = self._current()
+        result: Dict[str, List[Dict[str, Any]]] = {cid: [] for cid in course_ids}
+        if base is None:
+            return result
+        known = []
+        for cid in course_ids:
+            try:
+                vector = self._vector_for(base, str(uuid.UUID(cid)))
+            except ValueError:
+                continue
+            if vector is not None and len(vector[0]):
+                known.append((cid, vector))
+        if known:
+            answers = self._query(base, [v for _, v in known], limit, [str(uuid.UUID(c)) for c, _ in known])
+            result.update({cid: answer for (cid, _), answer in zip(known, answers)})
+        return result
+
+    def search(self, text: str, limit: int = 10) -> List[Dict[str, Any]]:
+        base = self._current()
+        if base is None:
+            return []
+        vector = self._vectorize(base, tokenize(text))
+        if not len(vector[0]):
+            return []
+        return self._query(base, [vector], limit, [None])[0]
+
+
+text_index = TextIndex()
+invalidation.subscribe('course', text_index.on_course_changed)
+invalidation.on_reset(text_index.reset)
@@ -0,0 +1,17 @@
+import datetime
+from typing import Any, Dict
+from django.conf import settings
+
+
+def encode_token(payload: Dict[str, Any], hours: int = 1) -> str:
+    import jwt
+
+    now = datetime.datetime.utcnow()
+    payload = {**payload, 'exp': now + datetime.timedelta(hours=hours), 'iat': now}
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    import jwt
+
+    return jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
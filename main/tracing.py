@@ -0,0 +1,232 @@
+"""
+In-process request tracing.
+
+TracingMiddleware opens a trace per request, taking its id from the
+TRACING['HEADER'] request header or a W3C traceparent when present. Inside
+it, spans are opened around every public method of the classes decorated
+with @traced (the services and repositories) and around each SQL query, and
+nest through contextvars, so they follow the request into the batch thread
+pool as well.
+
+Finished traces go to an in-memory ring buffer of the last BUFFER_SIZE
+traces per process, read through the admin /api/traces endpoints. Outside
+a trace a decorated method costs one context variable lookup.
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+
+TRACING_DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'HEADER': 'X-Trace-Id',
+    'BUFFER_SIZE': 200,
+    'MAX_SPANS': 500,
+    'SQL_LENGTH': 200,
+}
+
+TRACE_ID = re.compile(r'^[0-9A-Za-z_.-]{1,64}$')
+TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+
+_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+_parent: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('trace_parent', default=None)
+
+
+def conf() -> Dict[str, Any]:
+    return {**TRACING_DEFAULTS, **getattr(settings, 'TRACING', {})}
+
+
+class Trace:
+    def __init__(self, trace_id: str, max_spans: int):
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.max_spans = max_spans
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.ids = itertools.count(1)
+        self.summary: Dict[str, Any] = {}
+
+    def add(self, span: Dict[str, Any]) -> None:
+        # list.append is atomic, so batch threads can share a trace.
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def as_dict(self, spans: bool = True) -> Dict[str, Any]:
+        data = {
+            'trace_id': self.trace_id,
+            'started_at': self.started_at,
+            **self.summary,
+            'span_count': len(self.spans),
+            'dropped_spans': self.dropped,
+        }
+        if spans:
+            data['spans'] = sorted(self.spans, key=lambda s: s['start_ms'])
+        return data
+
+
+class TraceBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.traces: deque = deque(maxlen=TRACING_DEFAULTS['BUFFER_SIZE'])
+
+    def add(self, trace: Trace) -> None:
+        size = conf()['BUFFER_SIZE']
+        with self.lock:
+            if self.traces.maxlen != size:
+                self.traces = deque(self.traces, maxlen=size)
+            self.traces.append(trace)
+
+    def recent(self, limit: int = 50, min_ms: float = 0, path: str = '') -> List[Dict[str, Any]]:
+        with self.lock:
+            traces = list(self.traces)
+        matching = [
+            t for t in reversed(traces)
+            if t.summary.get('duration_ms', 0) >= min_ms and path in t.summary.get('path', '')
+        ]
+        return [t.as_dict(spans=False) for t in matching[:limit]]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            traces = list(self.traces)
+        for trace in reversed(traces):
+            if trace.trace_id == trace_id:
+                return trace.as_dict()
+        return None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.traces.clear()
+
+
+buffer = TraceBuffer()
+
+
+def incoming_trace_id(meta: Dict[str, Any], header: str) -> Optional[str]:
+    value = meta.get('HTTP_' + header.upper().replace('-', '_'), '')
+    if TRACE_ID.match(value):
+        return value
+    match = TRACEPARENT.match(meta.get('HTTP_TRACEPARENT', ''))
+    return match.group(1) if match else None
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextlib.contextmanager
+def start_trace(trace_id: Optional[str] = None, force: bool = False):
+    """
+    Opens a trace for the enclosed block and yields it, or yields None when
+    tracing is off or the trace is not sampled. Forced traces ignore the
+    sample rate.
+    """
+    options = conf()
+    if not options['ENABLED'] or not (force or random.random() < options['SAMPLE_RATE']):
+        yield None
+        return
+    trace = Trace(trace_id or uuid.uuid4().hex, options['MAX_SPANS'])
+    trace_token = _trace.set(trace)
+    parent_token = _parent.set(None)
+    try:
+        yield trace
+    finally:
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+        trace.summary.setdefault('duration_ms', round((time.perf_counter() - trace.start) * 1000, 3))
+        buffer.add(trace)
+
+
+def begin_span(name: str, kind: str = 'code'):
+    """
+    Opens a span that becomes the parent of spans opened after it, until
+    end_span() is called with the returned handle in the same context.
+    Returns None outside a trace.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return None
+    span_id = next(trace.ids)
+    parent = _parent.get()
+    return trace, span_id, parent, name, kind, _parent.set(span_id), time.perf_counter()
+
+
+def end_span(handle, error: Optional[str] = None) -> None:
+    if handle is None:
+        return
+    trace, span_id, parent, name, kind, token, start = handle
+    end = time.perf_counter()
+    _parent.reset(token)
+    trace.add({
+        'id': span_id,
+        'parent_id': parent,
+        'name': name,
+        'kind': kind,
+        'start_ms': round((start - trace.start) * 1000, 3),
+        'duration_ms': round((end - start) * 1000, 3),
+        'error': error,
+    })
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = 'code'):
+    handle = begin_span(name, kind)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        end_span(handle, error)
+
+
+def _wrap(func, name: str, kind: str):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _trace.get() is None:
+            return func(*args, **kwargs)
+        with span(name, kind):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def traced(cls):
+    """
+    Class decorator that opens a span named Class.method around every public
+    method, static or not.
+    """
+    kind = 'service' if cls.__name__.endswith('Service') else (
+        'repository' if cls.__name__.endswith('Repository') else 'code'
+    )
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_'):
+            continue
+        name = f"{cls.__name__}.{attr}"
+        if isinstance(value, staticmethod):
+            setattr(cls, attr, staticmethod(_wrap(value.__func__, name, kind)))
+        elif isinstance(value, classmethod):
+            setattr(cls, attr, classmethod(_wrap(value.__func__, name, kind)))
+        elif inspect.isfunction(value):
+            setattr(cls, attr, _wrap(value, name, kind))
+    return cls
+
+
+def sql_span(execute, sql, params, many, context):
+    if _trace.get() is None:
+        return execute(sql, params, many, context)
+    with span(' '.join(sql.split())[:conf()['SQL_LENGTH']], 'sql'):
+        return execute(sql, params, many, context)
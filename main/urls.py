@@ -1,12 +1,21 @@
 from django.urls import path
 from main.views import (
     api_register, api_login, api_self,
-    api_courses, api_course_detail,
+    api_courses, api_course_autocomplete,
+    api_course_detail,
     api_course_modules, api_module_detail,
-    api_module_complete, api_module_reorder,
-    api_buy_course, api_my_courses,
+    api_module_complete, api_module_complete_batch,
+    api_module_reorder,
+    api_buy_course, api_my_courses, api_course_purchase_status, api_batch,
+    api_course_view, api_activity, api_module_resume,
+    api_course_certificate, api_certificate_verify, api_certificate_revoke,
+    api_course_thumbnail, api_module_content, media_file,
+    api_traces, api_trace_detail,
+    api_course_recommendations, api_course_similar,
+    api_courses_similar, api_course_search, api_changes,
     api_users, api_user_detail,
-    api_user_balance, register_page,
+    api_user_balance, api_bulk_credit,
+    api_bulk_credit_detail, register_page,
     login_page, logout_page,
     home_page, course_detail_page,
     my_courses_page, profile_page,
@@ -31,15 +40,37 @@ urlpatterns = [
     path('api/auth/register', api_register, name='api_register'),
     path('api/auth/login', api_login, name='api_login'),
     path('api/auth/self', api_self, name='api_self'),
+    path('api/batch', api_batch, name='api_batch'),
     path('api/courses', api_courses, name='api_courses'),
+    path('api/changes', api_changes, name='api_changes'),
     path('api/courses/my-courses', api_my_courses, name='api_my_courses'),
+    path('api/courses/autocomplete', api_course_autocomplete, name='api_course_autocomplete'),
+    path('api/courses/similar', api_courses_similar, name='api_courses_similar'),
+    path('api/courses/search', api_course_search, name='api_course_search'),
     path('api/courses/<str:course_id>', api_course_detail, name='api_course_detail'),
+    path('api/courses/<str:course_id>/view', api_course_view, name='api_course_view'),
+    path('api/courses/<str:course_id>/recommendations', api_course_recommendations, name='api_course_recommendations'),
+    path('api/courses/<str:course_id>/similar', api_course_similar, name='api_course_similar'),
     path('api/courses/<str:course_id>/modules', api_course_modules, name='api_course_modules'),
+    path('api/modules/complete', api_module_complete_batch, name='api_module_complete_batch'),
     path('api/modules/<str:module_id>', api_module_detail, name='api_module_detail'),
     path('api/modules/<str:module_id>/complete', api_module_complete, name='api_module_complete'),
+    path('api/modules/<str:module_id>/resume', api_module_resume, name='api_module_resume'),
+    path('api/modules/<str:module_id>/content', api_module_content, name='api_module_content'),
+    path('api/activity', api_activity, name='api_activity'),
+    path('api/traces', api_traces, name='api_traces'),
+    path('api/traces/<str:trace_id>', api_trace_detail, name='api_trace_detail'),
     path('api/courses/<str:course_id>/modules/reorder', api_module_reorder, name='api_module_reorder'),
     path('api/courses/<str:course_id>/buy', api_buy_course, name='api_buy_course'),
+    path('api/courses/<str:course_id>/certificate', api_course_certificate, name='api_course_certificate'),
+    path('api/courses/<str:course_id>/thumbnail', api_course_thumbnail, name='api_course_thumbnail'),
+    path('api/certificates/revoke', api_certificate_revoke, name='api_certificate_revoke'),
+    path('api/certificates/<str:certificate_id>', api_certificate_verify, name='api_certificate_verify'),
+    path('api/courses/<str:course_id>/purchase', api_course_purchase_status, name='api_course_purchase_status'),
     path('api/users', api_users, name='api_users'),
+    path('api/users/balance/bulk', api_bulk_credit, name='api_bulk_credit'),
+    path('api/users/balance/bulk/<str:batch_id>', api_bulk_credit_detail, name='api_bulk_credit_detail'),
     path('api/users/<str:user_id>', api_user_detail, name='api_user_detail'),
     path('api/users/<str:user_id>/balance', api_user_balance, name='api_user_balance'),
+    path('media/<path:name>', media_file, name='media_file'),
 ]
\ No newline at end of file
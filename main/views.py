@@ -1,17 +1,21 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-import datetime, jwt, json
+from django.http import FileResponse, HttpResponse
+import json
+from main import activity, batch, media, tracing
+from main.changes import CursorExpired
 from main.services import CourseService, ModuleService, PurchaseService, UserService
 from main.factories import EntityFactory
-
-SECRET_KEY = settings.SECRET_KEY
+from main.certificates import prepared_certificate, render_certificate
+from main.tokens import decode_token, encode_token
+from main.serializers import (
+    COURSE_FIELDS, MODULE_FIELDS, USER_FIELDS, PURCHASE_FIELDS, USER_LIST_FIELDS, PURCHASE_SUMMARY_FIELDS,
+    SYNC_MODULE_FIELDS,
+)
 
 def _unauthorized():
     return JsonResponse({'status': 'error', 'message': 'Unauthorized', 'data': None}, status=401)
@@ -21,14 +25,26 @@ def _method_not_allowed():
     return JsonResponse({'status': 'error', 'message': 'Method not allowed', 'data': None}, status=405)
 
 
+def _bad_request(message):
+    return JsonResponse({'status': 'error', 'message': message, 'data': None}, status=400)
+
+
 def get_user_from_token(request):
+    # Set by /api/batch on its sub-requests, and memoized here otherwise.
+    if hasattr(request, 'token_user'):
+        return request.token_user
+    request.token_user = _load_token_user(request)
+    return request.token_user
+
+
+def _load_token_user(request):
     auth_header = request.META.get('HTTP_AUTHORIZATION')
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
     token = auth_header.split(' ', 1)[1]
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        payload = decode_token(token)
         return UserService.get_user_by_id(payload['id'])
     except Exception:
         return None
@@ -77,11 +93,9 @@ def api_login(request):
         payload = {
             'id': str(user.id),
             'username': user.username,
-            'is_admin': user.is_administrator,
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-            'iat': datetime.datetime.utcnow()
+            'is_admin': user.is_administrator
         }
-        token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+        token = encode_token(payload)
         return JsonResponse({'status': 'success', 'message': 'Login successful', 'data': {'username': user.username, 'token': token}})
     except ValueError as ve:
         return JsonResponse({'status': 'error', 'message': str(ve), 'data': None}, status=400)
@@ -120,28 +134,24 @@ def api_courses(request):
         q = request.GET.get('q', '')
         page = int(request.GET.get('page', 1))
         limit = min(int(request.GET.get('limit', 15)), 50)
-        courses, total_items = CourseService.list_courses(q=q, page=page, limit=limit)
+        try:
+            filters = EntityFactory.build_course_filters(request.GET)
+            sort = EntityFactory.build_course_sort(request.GET.get('sort'))
+            fields = COURSE_FIELDS.parse(request.GET.get('fields'))
+        except ValueError as ve:
+            return _bad_request(str(ve))
+        courses, total_items = CourseService.list_courses(
+            q=q, page=page, limit=limit, columns=COURSE_FIELDS.columns(fields), sort=sort, **filters
+        )
+        facets = CourseService.course_facets(q=q, **filters)
         total_pages = (total_items + limit - 1) // limit
-        data = []
-
-        for c in courses:
-            data.append({
-                "id": str(c.id),
-                "title": c.title,
-                "description": c.description,
-                "instructor": c.instructor,
-                "topics": c.topics,
-                "price": c.price,
-                "thumbnail_image": c.thumbnail_image,
-                "total_modules": c.modules.count() if hasattr(c, 'modules') else 0,
-                "created_at": c.created_at.isoformat() if hasattr(c, 'created_at') else None,
-                "updated_at": c.updated_at.isoformat() if hasattr(c, 'updated_at') else None
-            })
+        data = [COURSE_FIELDS.serialize(c, fields) for c in courses]
 
         return JsonResponse({
             "status": "success",
             "message": "",
             "data": data,
+            "facets": facets,
             "pagination": {"current_page": page, "total_pages": total_pages, "total_items": total_items}
         })
 
@@ -177,6 +187,16 @@ def api_courses(request):
         return _method_not_allowed()
 
 
+@csrf_exempt
+def api_course_autocomplete(request):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    q = request.GET.get('q', '')
+    limit = max(1, min(int(request.GET.get('limit', 10)), 25))
+    return JsonResponse({"status": "success", "message": "", "data": CourseService.autocomplete(q, limit)})
+
+
 @csrf_exempt
 def api_course_detail(request, course_id):
     user = get_user_from_token(request)
@@ -186,18 +206,11 @@ def api_course_detail(request, course_id):
         return JsonResponse({'status': 'error', 'message': 'Course not found', 'data': None}, status=404)
 
     if request.method == 'GET':
-        return JsonResponse({"status": "success", "message": "", "data": {
-            "id": str(course.id),
-            "title": course.title,
-            "description": course.description,
-            "instructor": course.instructor,
-            "topics": course.topics,
-            "price": course.price,
-            "thumbnail_image": course.thumbnail_image,
-            "total_modules": course.modules.count() if hasattr(course, 'modules') else 0,
-            "created_at": course.created_at.isoformat() if hasattr(course, 'created_at') else None,
-            "updated_at": course.updated_at.isoformat() if hasattr(course, 'updated_at') else None
-        }})
+        try:
+            fields = COURSE_FIELDS.parse(request.GET.get('fields'))
+        except ValueError as ve:
+            return _bad_request(str(ve))
+        return JsonResponse({"status": "success", "message": "", "data": COURSE_FIELDS.serialize(course, fields)})
 
     elif request.method == 'PUT':
         if not user or not user.is_administrator:
@@ -237,6 +250,136 @@ def api_course_detail(request, course_id):
         return _method_not_allowed()
 
 
+@csrf_exempt
+def api_course_view(request, course_id):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    view = CourseService.get_course_view(get_user_from_token(request), course_id)
+    if not view:
+        return JsonResponse({'status': 'error', 'message': 'Course not found', 'data': None}, status=404)
+
+    module_ctx = {'is_completed': lambda m: m.is_completed}
+    return JsonResponse({"status": "success", "message": "", "data": {
+        "course": COURSE_FIELDS.serialize(view['course'], list(COURSE_FIELDS.fields)),
+        "modules": [MODULE_FIELDS.serialize(m, list(MODULE_FIELDS.fields), module_ctx) for m in view['modules']],
+        "is_purchased": view['is_purchased'],
+        "progress_percentage": view['progress_percentage'],
+        "certificate_available": view['certificate_available']
+    }})
+
+
+@csrf_exempt
+def api_course_recommendations(request, course_id):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    return JsonResponse({"status": "success", "message": "", "data": {
+        "course_id": course_id,
+        "recommendations": CourseService.recommendations(course_id, limit)
+    }})
+
+
+def _scored_courses(courses, matches, fields):
+    # Index hits for courses deleted since the last delta update are dropped.
+    return [
+        dict(COURSE_FIELDS.serialize(courses[m['course_id']], fields), score=m['score'])
+        for m in matches if m['course_id'] in courses
+    ]
+
+
+def _similar_courses(request, course_ids):
+    try:
+        fields = COURSE_FIELDS.parse(request.GET.get('fields'))
+    except ValueError as ve:
+        return None, _bad_request(str(ve))
+    limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    matches = CourseService.similar_courses(course_ids, limit)
+    courses = CourseService.get_courses([m['course_id'] for ms in matches.values() for m in ms])
+    return {cid: _scored_courses(courses, ms, fields) for cid, ms in matches.items()}, None
+
+
+def api_course_similar(request, course_id):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    similar, error = _similar_courses(request, [course_id])
+    if error:
+        return error
+    return JsonResponse({"status": "success", "message": "", "data": {
+        "course_id": course_id, "similar": similar[course_id]
+    }})
+
+
+def api_courses_similar(request):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    course_ids = [cid for cid in request.GET.get('ids', '').split(',') if cid]
+    if not course_ids:
+        return _bad_request("ids is required")
+    if len(course_ids) > 20:
+        return _bad_request("At most 20 ids per request")
+    similar, error = _similar_courses(request, course_ids)
+    if error:
+        return error
+    return JsonResponse({"status": "success", "message": "", "data": similar})
+
+
+def api_course_search(request):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return _bad_request("q is required")
+    try:
+        fields = COURSE_FIELDS.parse(request.GET.get('fields'))
+    except ValueError as ve:
+        return _bad_request(str(ve))
+    limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    matches = CourseService.search_courses(q, limit)
+    courses = CourseService.get_courses([m['course_id'] for m in matches])
+    return JsonResponse({"status": "success", "message": "", "data": _scored_courses(courses, matches, fields)})
+
+
+def api_changes(request):
+    """
+    Courses and modules changed or deleted since ?since=<cursor>. Follow the
+    returned cursor while has_more is true, and keep the last one for the
+    next sync.
+    """
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    limit = max(1, min(int(request.GET.get('limit', 100)), 500))
+    try:
+        changes = CourseService.catalog_changes(request.GET.get('since') or None, limit)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+    except CursorExpired as ce:
+        return JsonResponse({'status': 'error', 'message': str(ce), 'data': None}, status=410)
+
+    data = {
+        'courses': [COURSE_FIELDS.serialize(c, list(COURSE_FIELDS.fields)) for c in changes['courses']],
+        'modules': [MODULE_FIELDS.serialize(m, SYNC_MODULE_FIELDS) for m in changes['modules']],
+        'deleted': [{
+            'entity': t.entity,
+            'id': str(t.entity_id),
+            'course_id': str(t.course_id),
+            'deleted_at': t.deleted_at.isoformat(),
+        } for t in changes['deleted']],
+    }
+    return JsonResponse({
+        "status": "success",
+        "message": "",
+        "data": data,
+        "cursor": changes['cursor'],
+        "has_more": changes['has_more'],
+    })
+
+
 @csrf_exempt
 def api_course_modules(request, course_id):
     user = get_user_from_token(request)
@@ -248,24 +391,19 @@ def api_course_modules(request, course_id):
     if request.method == 'GET':
         page = int(request.GET.get('page', 1))
         limit = min(int(request.GET.get('limit', 15)), 50)
-        modules, total_items = ModuleService.list_modules(course, page=page, limit=limit)
+        try:
+            fields = MODULE_FIELDS.parse(request.GET.get('fields'))
+        except ValueError as ve:
+            return _bad_request(str(ve))
+        modules, total_items = ModuleService.list_modules(
+            course, page=page, limit=limit, columns=MODULE_FIELDS.columns(fields)
+        )
         total_pages = (total_items + limit - 1) // limit
-        data = []
-
-        for m in modules:
-            is_completed = ModuleService.get_module_status(user, m)
-            data.append({
-                "id": str(m.id),
-                "course_id": str(course.id),
-                "title": m.title,
-                "description": m.description,
-                "order": m.order,
-                "pdf_content": m.pdf_content,
-                "video_content": m.video_content,
-                "is_completed": is_completed,
-                "created_at": m.created_at.isoformat() if hasattr(m, 'created_at') else None,
-                "updated_at": m.updated_at.isoformat() if hasattr(m, 'updated_at') else None
-            })
+        completed = set()
+        if 'is_completed' in fields:
+            completed = ModuleService.completed_module_ids(user, [m.id for m in modules])
+        ctx = {'is_completed': lambda m: m.id in completed}
+        data = [MODULE_FIELDS.serialize(m, fields, ctx) for m in modules]
 
         return JsonResponse({"status": "success", "message": "", "data": data, "pagination": {
             "current_page": page, "total_pages": total_pages, "total_items": total_items
@@ -309,21 +447,13 @@ def api_module_detail(request, module_id):
     if not module:
         return JsonResponse({'status': 'error', 'message': 'Module not found', 'data': None}, status=404)
 
-    is_completed = ModuleService.get_module_status(user, module)
-
     if request.method == 'GET':
-        return JsonResponse({"status": "success", "message": "", "data": {
-            "id": str(module.id),
-            "course_id": str(module.course.id),
-            "title": module.title,
-            "description": module.description,
-            "order": module.order,
-            "pdf_content": module.pdf_content,
-            "video_content": module.video_content,
-            "is_completed": is_completed,
-            "created_at": module.created_at.isoformat() if hasattr(module, 'created_at') else None,
-            "updated_at": module.updated_at.isoformat() if hasattr(module, 'updated_at') else None
-        }})
+        try:
+            fields = MODULE_FIELDS.parse(request.GET.get('fields'))
+        except ValueError as ve:
+            return _bad_request(str(ve))
+        ctx = {'is_completed': lambda m: ModuleService.get_module_status(user, m)}
+        return JsonResponse({"status": "success", "message": "", "data": MODULE_FIELDS.serialize(module, fields, ctx)})
 
     elif request.method == 'PUT':
         if not user or not user.is_administrator:
@@ -384,6 +514,79 @@ def api_module_complete(request, module_id):
     }})
 
 
+@csrf_exempt
+def api_module_complete_batch(request):
+    user = get_user_from_token(request)
+    if request.method != 'PATCH':
+        return _method_not_allowed()
+
+    if not user:
+        return _unauthorized()
+
+    try:
+        body = json.loads(request.body)
+        data = EntityFactory.build_module_completion(body)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    user_ids = data['user_ids']
+    if user_ids is None:
+        user_ids = [user.id]
+    elif not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    result = ModuleService.mark_completed_bulk(user_ids, data['module_ids'])
+    return JsonResponse({"status": "success", "message": "Modules completed", "data": result})
+
+
+@csrf_exempt
+def api_activity(request):
+    user = get_user_from_token(request)
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    if not user:
+        return _unauthorized()
+
+    try:
+        body = json.loads(request.body)
+        events = EntityFactory.build_activity(body)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    allowed = set(ModuleService.purchased_module_ids(user, list({e['module_id'] for e in events})))
+    accepted = [e for e in events if e['module_id'] in allowed]
+    rejected = list(dict.fromkeys(str(e['module_id']) for e in events if e['module_id'] not in allowed))
+    if accepted and not activity.buffer.add(user.id, accepted):
+        response = JsonResponse({'status': 'error', 'message': 'Activity buffer full', 'data': None}, status=503)
+        response['Retry-After'] = '5'
+        return response
+
+    return JsonResponse({"status": "success", "message": "Activity accepted", "data": {
+        "accepted": len(accepted),
+        "rejected_module_ids": rejected
+    }}, status=202)
+
+
+@csrf_exempt
+def api_module_resume(request, module_id):
+    user = get_user_from_token(request)
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    if not user:
+        return _unauthorized()
+
+    module = ModuleService.get_module(module_id)
+    if not module:
+        return JsonResponse({'status': 'error', 'message': 'Module not found', 'data': None}, status=404)
+
+    return JsonResponse({"status": "success", "message": "", "data": {
+        "module_id": str(module.id),
+        **activity.resume(user, module)
+    }})
+
+
 @csrf_exempt
 def api_module_reorder(request, course_id):
     user = get_user_from_token(request)
@@ -448,6 +651,222 @@ def api_buy_course(request, course_id):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e), 'data': None}, status=500)
 
+@csrf_exempt
+def api_course_purchase_status(request, course_id):
+    user = get_user_from_token(request)
+
+    if not user:
+        return _unauthorized()
+
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    course = CourseService.get_course(course_id)
+    if not course:
+        return JsonResponse({'status': 'error', 'message': 'Course not found', 'data': None}, status=404)
+
+    return JsonResponse({"status": "success", "message": "", "data": {
+        "course_id": str(course.id),
+        "is_purchased": PurchaseService.has_purchased(user, course)
+    }})
+
+
+@csrf_exempt
+def api_batch(request):
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    try:
+        body = json.loads(request.body)
+        entries = EntityFactory.build_batch(body, max_items=batch.MAX_REQUESTS)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    results = batch.run(request, get_user_from_token(request), entries)
+    return JsonResponse({"status": "success", "message": "", "data": results})
+
+
+def _certificate_data(certificate):
+    return {
+        "certificate_id": certificate['certificate_id'],
+        "course_id": str(certificate['course_id']),
+        "completed_on": certificate['completed_on'].isoformat(),
+        "verify_url": f"/api/certificates/{certificate['certificate_id']}"
+    }
+
+
+@csrf_exempt
+def api_course_certificate(request, course_id):
+    user = get_user_from_token(request)
+
+    if not user:
+        return _unauthorized()
+
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    course = CourseService.get_course(course_id)
+    if not course:
+        return JsonResponse({'status': 'error', 'message': 'Course not found', 'data': None}, status=404)
+
+    certificate = CourseService.issue_certificate(user, course)
+    if not certificate:
+        return JsonResponse({'status': 'error', 'message': 'Certificate not available', 'data': None}, status=403)
+
+    return JsonResponse({"status": "success", "message": "", "data": _certificate_data(certificate)})
+
+
+@csrf_exempt
+def api_certificate_verify(request, certificate_id):
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    fields = CourseService.verify_certificate(certificate_id)
+    if not fields:
+        return JsonResponse({'status': 'error', 'message': 'Invalid certificate', 'data': None}, status=404)
+
+    data = {
+        "certificate_id": certificate_id,
+        "user_id": str(fields['user_id']),
+        "course_id": str(fields['course_id']),
+        "completed_on": fields['completed_on'].isoformat(),
+        "valid": not fields['revoked']
+    }
+    if fields['revoked']:
+        return JsonResponse({'status': 'error', 'message': 'Certificate revoked', 'data': data}, status=410)
+    return JsonResponse({"status": "success", "message": "", "data": data})
+
+
+@csrf_exempt
+def api_certificate_revoke(request):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    try:
+        data = EntityFactory.build_certificate_revocation(json.loads(request.body))
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    fields = CourseService.revoke_certificate(data['certificate_id'], data['reason'])
+    if not fields:
+        return JsonResponse({'status': 'error', 'message': 'Invalid certificate', 'data': None}, status=404)
+
+    return JsonResponse({"status": "success", "message": "Certificate revoked", "data": {
+        "user_id": str(fields['user_id']),
+        "course_id": str(fields['course_id'])
+    }})
+
+
+@csrf_exempt
+def api_course_thumbnail(request, course_id):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    if not media.enabled():
+        return JsonResponse({'status': 'error', 'message': 'Local media storage is disabled', 'data': None}, status=404)
+
+    course = CourseService.get_course(course_id)
+    if not course:
+        return JsonResponse({'status': 'error', 'message': 'Course not found', 'data': None}, status=404)
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        return _bad_request("file is required")
+    try:
+        thumbnails = CourseService.upload_thumbnail(course, upload, request.build_absolute_uri)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    return JsonResponse({"status": "success", "message": "Thumbnail uploaded", "data": {
+        "id": str(course.id),
+        "thumbnail_image": course.thumbnail_image,
+        "original": thumbnails['original'],
+        "sizes": {str(width): url for width, url in thumbnails['sizes'].items()}
+    }})
+
+
+@csrf_exempt
+def api_module_content(request, module_id):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    if not media.enabled():
+        return JsonResponse({'status': 'error', 'message': 'Local media storage is disabled', 'data': None}, status=404)
+
+    module = ModuleService.get_module(module_id)
+    if not module:
+        return JsonResponse({'status': 'error', 'message': 'Module not found', 'data': None}, status=404)
+
+    uploads = {kind: request.FILES[kind] for kind in ('pdf', 'video') if kind in request.FILES}
+    if not uploads:
+        return _bad_request("pdf or video is required")
+    try:
+        module = ModuleService.upload_content(module, uploads, request.build_absolute_uri)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+    return JsonResponse({"status": "success", "message": "Content uploaded", "data": {
+        "id": str(module.id),
+        "pdf_content": module.pdf_content,
+        "video_content": module.video_content
+    }})
+
+
+def media_file(request, name):
+    if request.method not in ('GET', 'HEAD'):
+        return _method_not_allowed()
+    return media.serve(request, name)
+
+
+def api_traces(request):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+        min_ms = float(request.GET.get('min_ms', 0))
+    except ValueError as ve:
+        return _bad_request(str(ve))
+    # Traces are kept per worker process, so this lists the serving worker's.
+    traces = tracing.buffer.recent(limit=limit, min_ms=min_ms, path=request.GET.get('path', ''))
+    return JsonResponse({"status": "success", "message": "", "data": traces})
+
+
+def api_trace_detail(request, trace_id):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    trace = tracing.buffer.get(trace_id)
+    if not trace:
+        return JsonResponse({'status': 'error', 'message': 'Trace not found', 'data': None}, status=404)
+    return JsonResponse({"status": "success", "message": "", "data": trace})
+
+
 @csrf_exempt
 def api_my_courses(request):
     user = get_user_from_token(request)
@@ -458,24 +877,19 @@ def api_my_courses(request):
     q = request.GET.get('q', '')
     page = int(request.GET.get('page', 1))
     limit = min(int(request.GET.get('limit', 15)), 50)
-    purchases, total_items = PurchaseService.list_user_purchases(user, q=q, page=page, limit=limit)
+    try:
+        fields = PURCHASE_FIELDS.parse(request.GET.get('fields'))
+    except ValueError as ve:
+        return _bad_request(str(ve))
+    purchases, total_items = PurchaseService.list_user_purchases(
+        user, q=q, page=page, limit=limit, columns=PURCHASE_FIELDS.columns(fields)
+    )
     total_pages = (total_items + limit - 1) // limit
-    data = []
-
-    for p in purchases:
-        course = p.course
-        total_modules = ModuleService.total_modules(course)
-        completed_modules = ModuleService.completed_modules_count(user, course)
-        progress_percentage = int((completed_modules / total_modules) * 100) if total_modules > 0 else 0
-        data.append({
-            "id": str(course.id),
-            "title": course.title,
-            "instructor": course.instructor,
-            "topics": course.topics,
-            "thumbnail_image": course.thumbnail_image,
-            "progress_percentage": progress_percentage,
-            "purchased_at": p.purchased_at.isoformat()
-        })
+    progress = {}
+    if 'progress_percentage' in fields:
+        progress = ModuleService.progress_by_course(user, [p.course_id for p in purchases])
+    ctx = {'progress_percentage': lambda p: progress[p.course_id]}
+    data = [PURCHASE_FIELDS.serialize(p, fields, ctx) for p in purchases]
 
     return JsonResponse({"status": "success", "message": "", "data": data, "pagination": {
         "current_page": page, "total_pages": total_pages, "total_items": total_items
@@ -495,19 +909,15 @@ def api_users(request):
     q = request.GET.get('q', '')
     page = int(request.GET.get('page', 1))
     limit = min(int(request.GET.get('limit', 15)), 50)
-    users, total_items = UserService.list_users(q=q, page=page, limit=limit)
+    try:
+        fields = USER_FIELDS.parse(request.GET.get('fields'), default=USER_LIST_FIELDS)
+    except ValueError as ve:
+        return _bad_request(str(ve))
+    if 'courses_purchased' in fields:
+        return _bad_request('courses_purchased is only available on a single user')
+    users, total_items = UserService.list_users(q=q, page=page, limit=limit, columns=USER_FIELDS.columns(fields))
     total_pages = (total_items + limit - 1) // limit
-    data = []
-
-    for u in users:
-        data.append({
-            "id": str(u.id),
-            "username": u.username,
-            "email": u.email,
-            "first_name": u.first_name,
-            "last_name": u.last_name,
-            "balance": u.balance
-        })
+    data = [USER_FIELDS.serialize(u, fields) for u in users]
 
     return JsonResponse({"status": "success", "message": "", "data": data, "pagination": {
         "current_page": page, "total_pages": total_pages, "total_items": total_items
@@ -526,16 +936,19 @@ def api_user_detail(request, user_id):
         return JsonResponse({'status': 'error', 'message': 'User not found', 'data': None}, status=404)
 
     if request.method == 'GET':
-        courses_purchased = PurchaseService.list_user_purchases(target, page=1, limit=100)[0]
-        return JsonResponse({"status": "success", "message": "", "data": {
-            "id": str(target.id),
-            "username": target.username,
-            "email": target.email,
-            "first_name": target.first_name,
-            "last_name": target.last_name,
-            "balance": target.balance,
-            "courses_purchased": courses_purchased
-        }})
+        try:
+            fields = USER_FIELDS.parse(request.GET.get('fields'))
+        except ValueError as ve:
+            return _bad_request(str(ve))
+
+        def courses_purchased(u):
+            purchases = PurchaseService.list_user_purchases(
+                u, page=1, limit=100, columns=PURCHASE_FIELDS.columns(PURCHASE_SUMMARY_FIELDS)
+            )[0]
+            return [PURCHASE_FIELDS.serialize(p, PURCHASE_SUMMARY_FIELDS) for p in purchases]
+
+        ctx = {'courses_purchased': courses_purchased}
+        return JsonResponse({"status": "success", "message": "", "data": USER_FIELDS.serialize(target, fields, ctx)})
 
     elif request.method == 'PUT':
         if target.is_administrator:
@@ -602,7 +1015,60 @@ def api_user_balance(request, user_id):
 
     else:
         return _method_not_allowed()
-    
+
+
+def _credit_batch_data(batch):
+    return {
+        "id": str(batch.id),
+        "increment": batch.delta,
+        "reason": batch.reason,
+        "status": batch.status,
+        "applied_count": batch.applied_count,
+        "created_at": batch.created_at.isoformat(),
+        "completed_at": batch.completed_at.isoformat() if batch.completed_at else None
+    }
+
+
+@csrf_exempt
+def api_bulk_credit(request):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'POST':
+        return _method_not_allowed()
+
+    try:
+        body = json.loads(request.body)
+        data = EntityFactory.build_bulk_credit(body)
+        batch = UserService.start_bulk_credit(data['delta'], user_ids=data['user_ids'], reason=data['reason'], created_by=user)
+        return JsonResponse({"status": "success", "message": "Credit batch queued", "data": _credit_batch_data(batch)}, status=202)
+
+    except ValueError as ve:
+        return _bad_request(str(ve))
+
+
+@csrf_exempt
+def api_bulk_credit_detail(request, batch_id):
+    user = get_user_from_token(request)
+
+    if not user or not user.is_administrator:
+        return JsonResponse({'status': 'error', 'message': 'Admin only', 'data': None}, status=403)
+
+    if request.method != 'GET':
+        return _method_not_allowed()
+
+    try:
+        batch = UserService.get_credit_batch(batch_id)
+    except Exception:
+        batch = None
+    if not batch:
+        return JsonResponse({'status': 'error', 'message': 'Credit batch not found', 'data': None}, status=404)
+
+    return JsonResponse({"status": "success", "message": "", "data": _credit_batch_data(batch)})
+
+
 def home_page(request):
     search_query = request.GET.get('q', '')  
     page_number = int(request.GET.get('page', 1))  
@@ -702,10 +1168,14 @@ def profile_page(request):
 
 def course_detail_page(request, course_id):
     user = request.user
-    course = CourseService.get_course(course_id)
+    view = CourseService.get_course_view(user, course_id)
 
-    already_purchased = PurchaseService.has_purchased(user, course) if user.is_authenticated else False
-    certificate_available = CourseService.certificate_accessible(user, course) if already_purchased else False
+    if not view:
+        return render(request, '404.html', {'error': 'Course not found'}, status=404)
+
+    course = view['course']
+    already_purchased = view['is_purchased']
+    certificate_available = view['certificate_available']
 
     if request.method == 'POST':
         success, error, _ = PurchaseService.purchase_course(user, course)
@@ -732,22 +1202,16 @@ def course_detail_page(request, course_id):
 
 @login_required
 def course_modules_page(request, course_id):
-    user = request.user
-    course = CourseService.get_course(course_id)
+    view = CourseService.get_course_view(request.user, course_id)
 
-    if not course:
+    if not view:
         return render(request, '404.html', {'error': 'Course not found'}, status=404)
 
-    modules, total_items = ModuleService.list_modules(course, page=1, limit=100)
-
-    progress_percentage = CourseService.progress_percentage(user, course)
-    certificate_available = CourseService.certificate_accessible(user, course)
-
     return render(request, 'courses_module.html', {
-        'course': course,
-        'modules': modules,
-        'progress_percentage': progress_percentage,
-        'certificate_available': certificate_available,
+        'course': view['course'],
+        'modules': view['modules'],
+        'progress_percentage': view['progress_percentage'],
+        'certificate_available': view['certificate_available'],
     })
 
 @login_required
@@ -770,21 +1234,17 @@ def download_certificate(request, course_id):
     if not course:
         return render(request, '404.html', {'error': 'Course not found'}, status=404)
  
-    modules, _ = ModuleService.list_modules(course, page=1, limit=100)
-    completed_modules = ModuleService.completed_modules_count(user, course)
-    if completed_modules != len(modules):
+    certificate = CourseService.issue_certificate(user, course)
+    if not certificate:
         return render(request, '403.html', {'error': 'Certificate not available'}, status=403)
  
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{course.title}_certificate.pdf"'
+    filename = f"{course.title}_certificate.pdf"
+    prepared = prepared_certificate(user, course, certificate)
+    if prepared:
+        return FileResponse(open(prepared, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
 
-    p = canvas.Canvas(response)
-    p.drawString(100, 750, "Certificate of Completion")
-    p.drawString(100, 700, f"Presented to: {user.first_name} {user.last_name}")
-    p.drawString(100, 650, f"For completing the course: {course.title}")
-    p.drawString(100, 600, f"Instructor: {course.instructor}")
-    p.drawString(100, 550, f"Date: {datetime.date.today().strftime('%B %d, %Y')}")
-    p.showPage()
-    p.save()
+    response = HttpResponse(content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
+    render_certificate(response, user, course, certificate['completed_on'], certificate['certificate_id'])
     return response
\ No newline at end of file
@@ -0,0 +1,77 @@
+import importlib
+import logging
+import time
+from typing import Dict
+from django.conf import settings
+from django.db import connections
+from main import invalidation
+from main.autocomplete import course_index
+from main.certificates import revocations
+from main.repositories import COURSE_ORDERINGS
+from main.services import CourseService, ModuleService
+from main.textindex import text_index
+
+logger = logging.getLogger(__name__)
+
+# Lazily imported by the request path but needed by nearly every API call.
+PRELOAD_MODULES = ('jwt', 'main.tasks')
+
+
+def preload() -> None:
+    """
+    Runs once in the gunicorn master before workers are forked, so modules and
+    in-process caches built here are shared copy-on-write by every worker.
+    Database connections must not cross the fork and are closed at the end.
+    """
+    start = time.perf_counter()
+    for name in PRELOAD_MODULES + (settings.ROOT_URLCONF,):
+        importlib.import_module(name)
+    try:
+        invalidation.mark_synced()
+        courses = course_index.build()
+        revocations.refresh()
+        text_index.ensure_loaded()
+        replayed = replay(getattr(settings, 'WARMUP_TOP_COURSES', 50))
+    except Exception:
+        # Workers build what is missing on first use; a cold start beats none.
+        logger.exception("Preload failed after %.0f ms, starting with cold caches",
+                         (time.perf_counter() - start) * 1000)
+        return
+    finally:
+        connections.close_all()
+    logger.info("Preloaded app in %.0f ms (%d courses indexed, %d popular courses warmed)",
+                (time.perf_counter() - start) * 1000, courses, replayed['courses'])
+
+
+def replay(top: int = 50, page_size: int = 15) -> Dict[str, int]:
+    """
+    Replays the most common reads through the service layer so the shared
+    entity cache and SQLite's pages are hot before traffic arrives: the
+    first catalog page in every sort order, then the detail page, modules
+    and neighbours of the `top` most purchased courses.
+    """
+    stats = {'catalog_pages': 0, 'courses': 0, 'modules': 0}
+    if top <= 0:
+        return stats
+    for sort in COURSE_ORDERINGS:
+        CourseService.list_courses(page=1, limit=page_size, sort=sort)
+        stats['catalog_pages'] += 1
+
+    popular, _ = CourseService.list_courses(page=1, limit=top, sort='popular', columns=['id'])
+    course_ids = [str(course.id) for course in popular]
+    for course_id in course_ids:
+        view = CourseService.get_course_view(None, course_id)
+        if view is None:
+            continue
+        for module in view['modules'][:page_size]:
+            ModuleService.get_module(str(module.id))
+            stats['modules'] += 1
+        CourseService.recommendations(course_id)
+        stats['courses'] += 1
+    CourseService.similar_courses(course_ids)
+    return stats
+
+
+def connect() -> None:
+    for conn in connections.all():
+        conn.ensure_connection()